@@ -3,8 +3,11 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.forms import ReadOnlyPasswordHashField
 from django.contrib.auth.models import Group
+from django.db.models import Q
 
+from curbd.admin import ScalableModelAdmin
 from .models import User, Host, Customer, Vehicle, Address
+from .search import search_users
 
 
 class UserCreationForm(forms.ModelForm):
@@ -52,7 +55,7 @@ class UserChangeForm(forms.ModelForm):
         return self.initial["password"]
 
 
-class UserAdmin(BaseUserAdmin):
+class UserAdmin(ScalableModelAdmin, BaseUserAdmin):
     # The forms to add and change user instances
     form = UserChangeForm
     add_form = UserCreationForm
@@ -62,6 +65,7 @@ class UserAdmin(BaseUserAdmin):
     # that reference specific fields on auth.User.
     list_display = ('email', 'first_name', 'last_name', 'phone_number', 'is_staff', 'is_active')
     list_filter = ('is_staff',)
+    date_hierarchy = 'date_joined'
 
     # add_fieldsets is not a standard ModelAdmin attribute. UserAdmin
     # overrides get_fieldsets to use this attribute when creating a user.
@@ -75,15 +79,56 @@ class UserAdmin(BaseUserAdmin):
         ('Personal info', {'fields': ('first_name', 'last_name', 'phone_number')}),
         ('Permissions', {'fields': ('is_staff',)}),
     )
-    search_fields = ('email',)
     ordering = ('email',)
     filter_horizontal = ()
 
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+
+        # same indexed prefix search as the staff API (accounts.search)
+        users = search_users(queryset, search_term)
+        if search_term.isdigit():
+            # user ids as well as phone numbers
+            return queryset.filter(Q(pk=int(search_term)) | Q(pk__in=users.values('pk'))), False
+        return users, False
+
+
+class HostAdmin(ScalableModelAdmin, admin.ModelAdmin):
+    list_display = ('__str__', 'host_since', 'venmo_email')
+    list_select_related = ('user',)
+    raw_id_fields = ('user', 'address')
+    indexed_search_fields = ('user__email', 'venmo_email')
+
+
+class CustomerAdmin(ScalableModelAdmin, admin.ModelAdmin):
+    list_display = ('__str__', 'stripe_customer_id')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+    indexed_search_fields = ('user__email', 'stripe_customer_id')
+
+
+class VehicleAdmin(ScalableModelAdmin, admin.ModelAdmin):
+    list_display = ('license_plate', 'customer', 'make', 'model', 'size', 'created_at')
+    list_select_related = ('customer__user',)
+    raw_id_fields = ('customer',)
+    date_hierarchy = 'created_at'
+    indexed_search_fields = ('license_plate',)
+
+    def get_search_results(self, request, queryset, search_term):
+        # license plates are stored upper case
+        return super(VehicleAdmin, self).get_search_results(request, queryset, search_term.upper())
+
+
+class AddressAdmin(ScalableModelAdmin, admin.ModelAdmin):
+    pass
+
 
 # Register your models here.
 admin.site.register(User, UserAdmin)
-admin.site.register(Host)
-admin.site.register(Customer)
-admin.site.register(Vehicle)
-admin.site.register(Address)
+admin.site.register(Host, HostAdmin)
+admin.site.register(Customer, CustomerAdmin)
+admin.site.register(Vehicle, VehicleAdmin)
+admin.site.register(Address, AddressAdmin)
 admin.site.unregister(Group)
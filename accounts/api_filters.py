@@ -0,0 +1,16 @@
+from rest_framework.filters import BaseFilterBackend
+
+from .search import search_users
+
+
+class UserSearchFilter(BaseFilterBackend):
+    """
+    ?search= over the user search indexes (see accounts.search).
+    """
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        term = request.query_params.get(self.search_param, '').strip()
+        if not term:
+            return queryset
+        return search_users(queryset, term)
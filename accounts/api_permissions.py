@@ -1,5 +1,7 @@
 from rest_framework import permissions
 
+from api.general_permissions import is_request_user
+
 
 class IsAdminOrIsVehicleOwnerOrIfIsStaffReadOnly(permissions.BasePermission):
     """
@@ -8,9 +10,9 @@ class IsAdminOrIsVehicleOwnerOrIfIsStaffReadOnly(permissions.BasePermission):
     """
     def has_object_permission(self, request, view, obj):
         if request.method in permissions.SAFE_METHODS:
-            return request.user.is_staff or obj.customer.user == request.user
+            return request.user.is_staff or is_request_user(request, obj.customer_id)
 
-        return request.user.is_superuser or obj.customer.user == request.user
+        return request.user.is_superuser or is_request_user(request, obj.customer_id)
 
 
 class IsStaffOrIsTargetUserOrReadOnly(permissions.BasePermission):
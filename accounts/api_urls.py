@@ -7,6 +7,7 @@ urlpatterns = [
     path('users/', api_views.UserList.as_view(), name='user-list'),
     path('users/<int:pk>/', api_views.UserDetail.as_view(), name='user-detail'),
     path('users/self/', api_views.UserSelfDetail.as_view(), name='user-self-detail'),
+    path('users/search/', api_views.UserSearch.as_view(), name='user-search'),
     path('users/<int:pk>/change_password/', api_views.ChangePassword.as_view(), name='user-change-password'),
     path('users/<int:pk>/customer/', api_views.UserCustomer.as_view(), name='user-customer'),
     path('users/<int:pk>/host/', api_views.UserHost.as_view(), name='user-host'),
@@ -14,6 +15,8 @@ urlpatterns = [
     path('customers/', api_views.CustomerList.as_view(), name='customer-list'),
     path('customers/<int:pk>/', api_views.CustomerDetail.as_view(), name='customer-detail'),
     path('customers/self/', api_views.CustomerSelfDetail.as_view(), name='customer-self-detail'),
+    path('customers/<int:pk>/reservations/', api_views.CustomerReservations.as_view(),
+         name='customer-reservations'),
     path('customers/self/reservations/current/', api_views.CustomerSelfCurrentReservations.as_view(),
          name='customer-self-reservations-current'),
     path('customers/self/reservations/previous/', api_views.CustomerSelfPreviousReservations.as_view(),
@@ -27,6 +30,7 @@ urlpatterns = [
          name='host-self-reservations-current'),
     path('hosts/self/reservations/previous/', api_views.HostSelfPreviousReservations.as_view(),
          name='host-self-reservations-previous'),
+    path('hosts/self/stats/', api_views.HostSelfStats.as_view(), name='host-self-stats'),
     path('hosts/self/verify/', api_views.HostSelfUpdateVerificationInfo.as_view(), name='host-self-verify'),
 
     path('vehicles/', api_views.VehicleList.as_view(), name='vehicle-list'),
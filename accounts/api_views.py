@@ -1,40 +1,65 @@
 import dateutil.parser
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ObjectDoesNotExist
+from django.db.models import F, Sum
+from django.db.models.functions import TruncMonth
 from django.http import Http404
+from django.utils import timezone
 from django.utils.datastructures import MultiValueDictKeyError
 
 from rest_framework import generics, status, filters, permissions
 from rest_framework.response import Response
-from rest_framework.exceptions import ValidationError, ParseError
+from rest_framework.settings import api_settings
+from rest_framework.exceptions import ValidationError, ParseError, PermissionDenied
 from rest_framework.views import APIView
 
 import datetime
 import pytz
 
+from api.general_mixins import ConditionalListMixin, DeltaSyncMixin, PlannedQuerysetMixin, SparseQuerysetMixin
 from api.general_permissions import ReadOnly, IsStaff
+from api.general_serializers import queryset_for_serializer
+from .api_filters import UserSearchFilter
 from .api_permissions import (
     IsAdminOrIsVehicleOwnerOrIfIsStaffReadOnly, IsStaffOrIsTargetUserOrReadOnly,
     IsAdminOrIsTargetUser, IsStaffOrWriteOnly, CustomersCanCreateStaffCanRead,
     StaffCanReadAndHostsCanWrite, IsHost)
 from .models import Customer, Host, Vehicle, Address
-from .pagination import PreviousReservationsCursorPagination
+from .pagination import PreviousReservationsCursorPagination, UserSearchPagination
+from .search import search_users
 from .serializers import (
     UserListSerializer, UserDetailSerializer,
     ChangePasswordSerializer,
     CustomerSerializer, HostSerializer, VehicleSerializer)
 
 
-class UserList(generics.ListCreateAPIView):
+class UserList(SparseQuerysetMixin, generics.ListCreateAPIView):
     queryset = get_user_model().objects.all().order_by('-date_joined')
     serializer_class = UserListSerializer
     permission_classes = (IsStaffOrWriteOnly,)
-    filter_backends = (filters.SearchFilter, filters.OrderingFilter)
-    search_fields = ('email',)
+    filter_backends = (UserSearchFilter, filters.OrderingFilter)
     ordering_fields = ('date_joined', 'first_name', 'last_name', 'email',)
 
 
-class UserDetail(generics.RetrieveUpdateDestroyAPIView):
+class UserSearch(generics.ListAPIView):
+    """
+    Ranked user search for staff: ?q= matches the beginning of the email,
+    name or phone number (or the end of the phone number).
+    """
+    serializer_class = UserListSerializer
+    permission_classes = (IsStaff,)
+    pagination_class = UserSearchPagination
+
+    def get_queryset(self):
+        term = self.request.query_params.get('q', '').strip()
+        if not term:
+            raise ValidationError("q is required")
+
+        # is_host is read from the joined host
+        return search_users(get_user_model().objects.select_related('host'), term)
+
+
+class UserDetail(SparseQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = get_user_model().objects.all()
     serializer_class = UserDetailSerializer
     permission_classes = (IsStaffOrIsTargetUserOrReadOnly,)
@@ -98,16 +123,22 @@ class UserCustomer(generics.RetrieveAPIView):
 
 
 class CustomerList(generics.ListAPIView):
-    queryset = Customer.objects.all()
     serializer_class = CustomerSerializer
     permission_classes = (IsStaff,)
 
+    def get_queryset(self):
+        # joins and prefetches everything the page renders, the recent
+        # reservations are loaded by CustomerListSerializer
+        return queryset_for_serializer(Customer.objects.order_by('-pk'), self.get_serializer())
+
 
 class CustomerDetail(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Customer.objects.all()
     serializer_class = CustomerSerializer
     permission_classes = (ReadOnly,)
 
+    def get_queryset(self):
+        return queryset_for_serializer(Customer.objects.all(), self.get_serializer())
+
 
 class CustomerSelfDetail(generics.RetrieveAPIView):
     serializer_class = CustomerSerializer
@@ -120,21 +151,51 @@ class CustomerSelfDetail(generics.RetrieveAPIView):
             raise Http404
 
 
-class CustomerSelfCurrentReservations(generics.ListAPIView):
+class CustomerReservations(DeltaSyncMixin, PlannedQuerysetMixin, generics.ListAPIView):
+    """
+    Every reservation of a customer, latest first, for staff and the
+    customer themselves.
+    """
     from parking.serializers import ReservationSerializer
     serializer_class = ReservationSerializer
     permission_classes = (permissions.IsAuthenticated,)
+    pagination_class = PreviousReservationsCursorPagination
+
+    def get_queryset(self):
+        if not (self.request.user.is_staff or self.request.user.id == self.kwargs['pk']):
+            raise PermissionDenied
+
+        from parking.models import Reservation
+        return Reservation.objects.filter(vehicle__customer_id=self.kwargs['pk']).order_by('-start_datetime')
+
+    def get_sync_scope(self):
+        from parking.models import Reservation
+        return Reservation.all_objects.filter(vehicle__customer_id=self.kwargs['pk'])
+
+
+class CustomerSelfCurrentReservations(DeltaSyncMixin, PlannedQuerysetMixin, generics.ListAPIView):
+    from parking.serializers import ReservationSerializer
+    serializer_class = ReservationSerializer
+    permission_classes = (permissions.IsAuthenticated,)
+    # they move from current to previous when they end
+    sync_time_fields = ('end_datetime',)
 
     def get_queryset(self):
         return self.request.user.customer.reservations().filter(
             end_datetime__gte=datetime.datetime.now(pytz.utc)).filter(
             cancelled=False).order_by('start_datetime')
 
+    def get_sync_scope(self):
+        from parking.models import Reservation
+        return Reservation.all_objects.filter(vehicle__customer_id=self.request.user.id)
 
-class CustomerSelfPreviousReservations(generics.ListAPIView):
+
+class CustomerSelfPreviousReservations(DeltaSyncMixin, PlannedQuerysetMixin, generics.ListAPIView):
     from parking.serializers import ReservationSerializer
     serializer_class = ReservationSerializer
     permission_classes = (permissions.IsAuthenticated,)
+    # they move from current to previous when they end
+    sync_time_fields = ('end_datetime',)
     pagination_class = PreviousReservationsCursorPagination
 
     def get_queryset(self):
@@ -142,8 +203,12 @@ class CustomerSelfPreviousReservations(generics.ListAPIView):
             end_datetime__lt=datetime.datetime.now(pytz.utc)).filter(
             cancelled=False).order_by('-start_datetime')
 
+    def get_sync_scope(self):
+        from parking.models import Reservation
+        return Reservation.all_objects.filter(vehicle__customer_id=self.request.user.id)
+
 
-class HostList(generics.ListAPIView):
+class HostList(SparseQuerysetMixin, generics.ListAPIView):
     queryset = Host.objects.all().order_by('-host_since')
     serializer_class = HostSerializer
     permission_classes = (IsStaff,)
@@ -151,7 +216,7 @@ class HostList(generics.ListAPIView):
     # to automatically set host
 
 
-class HostDetail(generics.RetrieveUpdateDestroyAPIView):
+class HostDetail(SparseQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Host.objects.all()
     serializer_class = HostSerializer
     permission_classes = (ReadOnly,)
@@ -168,22 +233,33 @@ class HostSelfDetail(generics.RetrieveAPIView):
             raise Http404
 
 
-class HostSelfParkingSpaces(generics.ListAPIView):
+class HostSelfParkingSpaces(DeltaSyncMixin, ConditionalListMixin, SparseQuerysetMixin, generics.ListAPIView):
     from parking.serializers import ParkingSpaceSerializer
     serializer_class = ParkingSpaceSerializer
     permission_classes = (permissions.IsAuthenticated,)
+    filter_backends = api_settings.DEFAULT_FILTER_BACKENDS + [filters.OrderingFilter]
+    ordering_fields = ('created_at', 'average_rating', 'rating_count')
 
     def get_queryset(self):
+        from parking.models import ParkingSpace
+
         try:
-            return self.request.user.host.parkingspace_set.all().order_by('-created_at')
+            return self.request.user.host.parkingspace_set.annotate(
+                average_rating=ParkingSpace.average_rating_ordering()).order_by('-created_at')
         except Host.DoesNotExist:
             raise Http404
 
+    def get_sync_scope(self):
+        from parking.models import ParkingSpace
+        return ParkingSpace.all_objects.filter(host_id=self.request.user.id)
 
-class HostSelfCurrentReservations(generics.ListAPIView):
+
+class HostSelfCurrentReservations(DeltaSyncMixin, PlannedQuerysetMixin, generics.ListAPIView):
     from parking.serializers import ReservationSerializer
     serializer_class = ReservationSerializer
     permission_classes = (permissions.IsAuthenticated,)
+    # they move from current to previous when they end
+    sync_time_fields = ('end_datetime',)
 
     def get_queryset(self):
         try:
@@ -192,11 +268,17 @@ class HostSelfCurrentReservations(generics.ListAPIView):
         except Host.DoesNotExist:
             raise Http404
 
+    def get_sync_scope(self):
+        from parking.models import Reservation
+        return Reservation.all_objects.filter(parking_space__host_id=self.request.user.id)
+
 
-class HostSelfPreviousReservations(generics.ListAPIView):
+class HostSelfPreviousReservations(DeltaSyncMixin, PlannedQuerysetMixin, generics.ListAPIView):
     from parking.serializers import ReservationSerializer
     serializer_class = ReservationSerializer
     permission_classes = (permissions.IsAuthenticated,)
+    # they move from current to previous when they end
+    sync_time_fields = ('end_datetime',)
     pagination_class = PreviousReservationsCursorPagination
 
     def get_queryset(self):
@@ -206,6 +288,70 @@ class HostSelfPreviousReservations(generics.ListAPIView):
         except Host.DoesNotExist:
             raise Http404
 
+    def get_sync_scope(self):
+        from parking.models import Reservation
+        return Reservation.all_objects.filter(parking_space__host_id=self.request.user.id)
+
+
+class HostSelfStats(APIView):
+    """
+    Reserved minutes, bookings, cancellations and income of each of the
+    host's parking spaces, per day or per month, between `from` and `to`
+    (inclusive dates, defaulting to the last 30 days).
+    """
+    permission_classes = (permissions.IsAuthenticated, IsHost,)
+
+    def get(self, request):
+        from parking.models import ParkingSpaceDailyStats
+
+        granularity = request.query_params.get('granularity', 'day')
+        if granularity not in ('day', 'month'):
+            raise ValidationError("granularity must be either 'day' or 'month'")
+
+        try:
+            to_day = timezone.localdate()
+            if request.query_params.get('to'):
+                to_day = dateutil.parser.parse(request.query_params['to']).date()
+
+            from_day = to_day - datetime.timedelta(days=30)
+            if request.query_params.get('from'):
+                from_day = dateutil.parser.parse(request.query_params['from']).date()
+        except (ValueError, OverflowError):
+            raise ValidationError("from and to must be valid dates")
+
+        if from_day > to_day:
+            raise ValidationError("to must not come before from")
+
+        stats = ParkingSpaceDailyStats.objects.filter(
+            parking_space__host=request.user.host, day__gte=from_day, day__lte=to_day)
+
+        if granularity == 'month':
+            stats = stats.annotate(period=TruncMonth('day'))
+        else:
+            stats = stats.annotate(period=F('day'))
+
+        stats = stats.values('parking_space', 'period').annotate(
+            total_reserved_minutes=Sum('reserved_minutes'),
+            total_booking_count=Sum('booking_count'),
+            total_cancellation_count=Sum('cancellation_count'),
+            total_host_income=Sum('host_income')).order_by('period', 'parking_space')
+
+        return Response({
+            'from': from_day,
+            'to': to_day,
+            'granularity': granularity,
+            'results': [
+                {
+                    'parking_space': row['parking_space'],
+                    'period': row['period'],
+                    'reserved_minutes': row['total_reserved_minutes'],
+                    'booking_count': row['total_booking_count'],
+                    'cancellation_count': row['total_cancellation_count'],
+                    'host_income': row['total_host_income'],
+                }
+                for row in stats],
+        })
+
 
 class HostSelfUpdateVerificationInfo(APIView):
     queryset = Host.objects.all()
@@ -237,7 +383,7 @@ class HostSelfUpdateVerificationInfo(APIView):
         return Response("Success", status=200)
 
 
-class VehicleList(generics.ListCreateAPIView):
+class VehicleList(SparseQuerysetMixin, generics.ListCreateAPIView):
     queryset = Vehicle.objects.all().order_by('-created_at')
     serializer_class = VehicleSerializer
     permission_classes = (CustomersCanCreateStaffCanRead,)
@@ -247,7 +393,7 @@ class VehicleList(generics.ListCreateAPIView):
         return super(VehicleList, self).perform_create(serializer)
 
 
-class VehicleDetail(generics.RetrieveUpdateDestroyAPIView):
+class VehicleDetail(SparseQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Vehicle.objects.all()
     serializer_class = VehicleSerializer
     permission_classes = (IsAdminOrIsVehicleOwnerOrIfIsStaffReadOnly,)
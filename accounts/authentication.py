@@ -0,0 +1,70 @@
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+
+def token_cache_key(key):
+    return 'auth_token:%s' % key
+
+
+def is_cache_shared():
+    """
+    Whether every worker sees the same cache. Tokens are only cached then:
+    invalidating a per-process cache (e.g. on logout) would leave the
+    token authenticating on the other workers.
+    """
+    return not isinstance(caches['default'], LocMemCache)
+
+
+def invalidate_token(key):
+    cache.delete(token_cache_key(key))
+
+
+def invalidate_user_tokens(user_id):
+    """
+    Drops the cached authentication of a user, e.g. after they were
+    deactivated or became a host.
+    """
+    keys = Token.objects.filter(user_id=user_id).values_list('key', flat=True)
+    cache.delete_many([token_cache_key(key) for key in keys])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication that keeps the user of each token, along with
+    whether they are a host and/or a customer, in the shared cache, so that
+    authenticated requests don't have to read the token, the user and their
+    roles from the database. Entries are invalidated by accounts.signals.
+    Nothing is cached unless the cache is shared (see is_cache_shared).
+    """
+    def authenticate_credentials(self, key):
+        if not is_cache_shared():
+            return super(CachedTokenAuthentication, self).authenticate_credentials(key)
+
+        cache_key = token_cache_key(key)
+        entry = cache.get(cache_key)
+
+        if entry is None:
+            user, token = super(CachedTokenAuthentication, self).authenticate_credentials(key)
+            entry = {
+                'user': user,
+                'created': token.created,
+                'is_host': user.is_host(),
+                'is_customer': user.is_customer(),
+            }
+            cache.set(cache_key, entry, settings.AUTH_TOKEN_CACHE_TIMEOUT)
+        else:
+            # the same request.auth as a token read from the database
+            token = Token(key=key, user=entry['user'], created=entry['created'])
+            token._state.adding = False
+            token._state.db = 'default'
+
+        user = entry['user']
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+
+        user.set_roles(entry['is_host'], entry['is_customer'])
+        return user, token
@@ -0,0 +1,41 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0014_vehicle_deleted_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedVehicle',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('deleted_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('color', models.CharField(max_length=25)),
+                ('year', models.CharField(max_length=25)),
+                ('make', models.CharField(max_length=25)),
+                ('model', models.CharField(max_length=25)),
+                ('size', models.PositiveIntegerField(choices=[(1, 'Motorcycle'), (2, 'Compact'), (3, 'Mid-sized'), (4, 'Large'), (5, 'Oversized')])),
+                ('license_plate', models.CharField(max_length=15, unique=True)),
+            ],
+            options={
+                'db_table': 'accounts_vehicle_archive',
+                'managed': False,
+            },
+        ),
+        # Soft deleted vehicles are filtered out of every query, so the hot
+        # index only needs to cover the live ones.
+        migrations.RunSQL(
+            'CREATE INDEX accounts_vehicle_customer_id_live_idx ON accounts_vehicle (customer_id) '
+            'WHERE deleted_at IS NULL;',
+            'DROP INDEX accounts_vehicle_customer_id_live_idx;'),
+        # Same columns as the live table, without its indexes and unique
+        # constraints (an archived license plate can be registered again).
+        migrations.RunSQL(
+            ['CREATE TABLE accounts_vehicle_archive (LIKE accounts_vehicle INCLUDING CONSTRAINTS);',
+             'ALTER TABLE accounts_vehicle_archive ADD PRIMARY KEY (id);'],
+            'DROP TABLE accounts_vehicle_archive;'),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.1 on 2026-10-19 15:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0015_vehicle_archive'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='date_joined',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='date joined'),
+        ),
+        migrations.AlterField(
+            model_name='vehicle',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
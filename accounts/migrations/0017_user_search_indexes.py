@@ -0,0 +1,43 @@
+# Generated by Django 2.1 on 2026-10-19 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0016_admin_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['first_name', 'last_name'], name='accounts_user_first_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['last_name', 'first_name'], name='accounts_user_last_name_idx'),
+        ),
+        # prefix indexes of the expressions compared by accounts.search
+        migrations.RunSQL(
+            [
+                "CREATE INDEX accounts_user_email_search_idx "
+                "ON accounts_user (UPPER(email) text_pattern_ops)",
+                "CREATE INDEX accounts_user_full_name_search_idx "
+                "ON accounts_user (UPPER((first_name || ' ' || last_name)) text_pattern_ops)",
+                "CREATE INDEX accounts_user_last_name_search_idx "
+                "ON accounts_user (UPPER(last_name) text_pattern_ops)",
+                "CREATE INDEX accounts_user_phone_search_idx "
+                "ON accounts_user (REGEXP_REPLACE(phone_number, '[^0-9]', '', 'g') text_pattern_ops)",
+                "CREATE INDEX accounts_user_phone_reversed_search_idx "
+                "ON accounts_user (REVERSE(REGEXP_REPLACE(phone_number, '[^0-9]', '', 'g')) text_pattern_ops)",
+            ],
+            [
+                "DROP INDEX accounts_user_email_search_idx",
+                "DROP INDEX accounts_user_full_name_search_idx",
+                "DROP INDEX accounts_user_last_name_search_idx",
+                "DROP INDEX accounts_user_phone_search_idx",
+                "DROP INDEX accounts_user_phone_reversed_search_idx",
+            ],
+        ),
+    ]
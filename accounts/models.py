@@ -4,20 +4,20 @@ from django.contrib.auth import get_user_model
 from django.core.mail import send_mail
 from django.core.exceptions import ObjectDoesNotExist
 from django.db import models
-from django.db.models import Sum
+from django.db.models import F, Sum, Window
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
 from django.db.models.query import Q
 
 import datetime
 import pytz
 
-from decouple import config
 from enum import Enum
 
 from .managers import UserManager
-from curbd.models import SoftDeletionModel
-
-import stripe
-stripe.api_key = config('STRIPE_SECRET_KEY')
+from curbd.clients import stripe_client
+from curbd.metrics import timed
+from curbd.models import SoftDeletionModel, archive_model_for
 
 
 class User(AbstractBaseUser, PermissionsMixin):
@@ -26,7 +26,7 @@ class User(AbstractBaseUser, PermissionsMixin):
     first_name = models.CharField('first name', max_length=30, blank=False)
     last_name = models.CharField('last name', max_length=30, blank=False)
     phone_number = models.CharField('phone number', max_length=20, blank=False, unique=True)
-    date_joined = models.DateTimeField('date joined', auto_now_add=True)
+    date_joined = models.DateTimeField('date joined', auto_now_add=True, db_index=True)
     is_active = models.BooleanField('active', default=True)
     is_staff = models.BooleanField('staff', default=False)
 
@@ -39,6 +39,11 @@ class User(AbstractBaseUser, PermissionsMixin):
     class Meta:
         verbose_name = 'user'
         verbose_name_plural = 'users'
+        # the upper case / digits-only indexes of accounts.search are created in migration 0017
+        indexes = [
+            models.Index(fields=['first_name', 'last_name'], name='accounts_user_first_name_idx'),
+            models.Index(fields=['last_name', 'first_name'], name='accounts_user_last_name_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         is_initial_save = False
@@ -47,7 +52,8 @@ class User(AbstractBaseUser, PermissionsMixin):
 
         super().save(*args, **kwargs)
         if is_initial_save:
-            stripe_customer = stripe.Customer.create(
+            stripe_customer = stripe_client.call(
+                'Customer.create',
                 description="Customer for " + self.first_name + " " + self.last_name,
                 email=self.email,
                 metadata={'user_id': self.pk}
@@ -71,9 +77,22 @@ class User(AbstractBaseUser, PermissionsMixin):
         """
         Sends an email to this User.
         """
-        send_mail(subject, message, from_email, [self.email], **kwargs)
+        with timed('send_mail'):
+            send_mail(subject, message, from_email, [self.email], **kwargs)
+
+    def set_roles(self, is_host, is_customer):
+        """
+        Remembers whether the user is a host and/or a customer (see
+        accounts.authentication.CachedTokenAuthentication), so that is_host()
+        and is_customer() don't have to query for it.
+        """
+        self._is_host = is_host
+        self._is_customer = is_customer
 
     def is_host(self):
+        if hasattr(self, '_is_host'):
+            return self._is_host
+
         try:
             self.host
         except ObjectDoesNotExist:
@@ -81,6 +100,9 @@ class User(AbstractBaseUser, PermissionsMixin):
         return True
 
     def is_customer(self):
+        if hasattr(self, '_is_customer'):
+            return self._is_customer
+
         try:
             self.customer
         except ObjectDoesNotExist:
@@ -115,10 +137,64 @@ class Customer(models.Model):
     def vehicles(self):
         return Vehicle.objects.filter(customer=self)
 
+    # number of reservations embedded in a customer's representation
+    RECENT_RESERVATIONS = 5
+
     def reservations(self):
         from parking.models import Reservation
         return Reservation.objects.filter(vehicle__customer=self)
 
+    @property
+    def recent_reservations(self):
+        """
+        The customer's latest reservations (see latest_reservations), unless
+        they were already loaded for a batch of customers.
+        """
+        if not hasattr(self, '_recent_reservations'):
+            Customer.attach_recent_reservations([self])
+        return self._recent_reservations
+
+    @staticmethod
+    def latest_reservations(customer_ids, limit, reservations=None):
+        """
+        The `limit` latest reservations (by start) of each of the customers,
+        in one query, annotated with their `reserver_id`.
+        :param customer_ids: list of customer ids
+        :param limit: number of reservations per customer
+        :param reservations: Reservation queryset to read them from, e.g. with
+        the joins the caller needs
+        """
+        from parking.models import Reservation
+
+        ranked = Reservation.objects.filter(vehicle__customer_id__in=customer_ids).annotate(
+            position=Window(
+                expression=RowNumber(),
+                partition_by=[F('vehicle__customer_id')],
+                order_by=[F('start_datetime').desc(), F('id').desc()])).values('id', 'position')
+        ranked_sql, ranked_params = ranked.query.sql_with_params()
+
+        if reservations is None:
+            reservations = Reservation.objects.all()
+        return reservations.filter(
+            id__in=RawSQL('SELECT ranked.id FROM (%s) ranked WHERE ranked.position <= %%s' % ranked_sql,
+                          ranked_params + (limit,))
+        ).annotate(reserver_id=F('vehicle__customer_id')).order_by('-start_datetime', '-id')
+
+    @staticmethod
+    def attach_recent_reservations(customers, reservations=None, limit=RECENT_RESERVATIONS):
+        """
+        Loads the latest reservations of a batch of customers in one query
+        and caches them on each customer as `recent_reservations`.
+        :param customers: list of Customer
+        :param reservations: see latest_reservations
+        :param limit: number of reservations per customer
+        """
+        recent = {customer.pk: [] for customer in customers}
+        for reservation in Customer.latest_reservations(list(recent), limit, reservations):
+            recent[reservation.reserver_id].append(reservation)
+        for customer in customers:
+            customer._recent_reservations = recent[customer.pk]
+
     def __str__(self):
         return "Customer: %s %s" % (self.user.first_name, self.user.last_name)
 
@@ -189,7 +265,7 @@ VEHICLE_SIZES = (
 class Vehicle(SoftDeletionModel):
 
     customer = models.ForeignKey(Customer, null=True, on_delete=models.SET_NULL)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
     color = models.CharField(max_length=25)
     year = models.CharField(max_length=25)
@@ -205,3 +281,6 @@ class Vehicle(SoftDeletionModel):
     def __str__(self):
         return "Vehicle: %s - %s %s %s %s" % (
             self.license_plate, self.color, self.year, self.make, self.model)
+
+
+ArchivedVehicle = archive_model_for(Vehicle)
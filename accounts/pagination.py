@@ -1,7 +1,75 @@
-from rest_framework.pagination import CursorPagination
+import binascii
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, CursorPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 class PreviousReservationsCursorPagination(CursorPagination):
     page_size = 10
     page_size_query_param = 'page_size'
     ordering = '-start_datetime'  # '-creation' is default
+
+
+class UserSearchPagination(BasePagination):
+    """
+    Keyset pagination of user search results, ordered by search rank and
+    then email. The cursor holds the (rank, email) of the last user of the
+    page, so no page is ever counted or offset into.
+    """
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            rank, email = cursor
+            queryset = queryset.filter(Q(search_rank__gt=rank) | Q(search_rank=rank, email__gt=email))
+
+        users = list(queryset.order_by('search_rank', 'email')[:self.page_size + 1])
+        self.has_next = len(users) > self.page_size
+        self.page = users[:self.page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+
+        try:
+            rank, email = json.loads(urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+        except (TypeError, ValueError, UnicodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        return int(rank), str(email)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+
+        last = self.page[-1]
+        encoded = urlsafe_b64encode(json.dumps([last.search_rank, last.email]).encode('utf-8')).decode('ascii')
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, encoded)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
@@ -0,0 +1,92 @@
+"""
+Indexed user search for staff.
+
+A search term is matched as a prefix of the user's email, full name
+("first last"), last name or phone number digits, and as a suffix of the
+phone number digits (so that local numbers are found without their
+country code). Every comparison is on an upper case or digits-only
+expression with a matching text_pattern_ops index (see migration
+accounts 0017), so a search reads a few index ranges instead of scanning
+the table. Exact matches rank before prefix matches.
+"""
+import re
+
+from django.db.models import Case, CharField, F, Func, IntegerField, Q, Value, When
+from django.db.models.functions import Upper
+
+
+# phone numbers shorter than this are too unselective to search by
+MIN_PHONE_DIGITS = 3
+
+
+class ConcatText(Func):
+    # `||` is immutable, unlike CONCAT(), so it can be indexed
+    arg_joiner = ' || '
+    template = '(%(expressions)s)'
+    output_field = CharField()
+
+
+class Digits(Func):
+    function = 'REGEXP_REPLACE'
+    output_field = CharField()
+
+    def __init__(self, expression, **extra):
+        super(Digits, self).__init__(expression, Value('[^0-9]'), Value(''), Value('g'), **extra)
+
+
+class Reverse(Func):
+    function = 'REVERSE'
+    output_field = CharField()
+
+
+def user_search_expressions():
+    """
+    The expressions of the user search indexes, keyed by annotation name.
+    """
+    phone_digits = Digits(F('phone_number'))
+    return {
+        'search_email': Upper(F('email')),
+        'search_full_name': Upper(ConcatText(F('first_name'), Value(' '), F('last_name'))),
+        'search_last_name': Upper(F('last_name')),
+        'search_phone': phone_digits,
+        'search_phone_reversed': Reverse(phone_digits),
+    }
+
+
+def normalize_search_term(term):
+    """
+    The upper case term, with runs of whitespace collapsed, and its digits
+    when it looks like a phone number (None otherwise).
+    """
+    term = ' '.join(term.split()).upper()
+    digits = None
+    if re.fullmatch(r'\+?[0-9 ().-]+', term):
+        digits = re.sub(r'[^0-9]', '', term)
+        if len(digits) < MIN_PHONE_DIGITS:
+            digits = None
+    return term, digits
+
+
+def search_users(queryset, term):
+    """
+    Filters a user queryset down to the users matching the search term and
+    annotates them with `search_rank`: 0 for exact matches, 1 for prefix
+    matches.
+    :param queryset: User queryset
+    :param term: what staff typed in the search box
+    """
+    term, digits = normalize_search_term(term)
+    if not term:
+        return queryset.none()
+
+    matches = Q(search_email__startswith=term) | \
+        Q(search_full_name__startswith=term) | \
+        Q(search_last_name__startswith=term)
+    exact = Q(search_email=term) | Q(search_full_name=term)
+
+    if digits is not None:
+        matches |= Q(search_phone__startswith=digits) | Q(search_phone_reversed__startswith=digits[::-1])
+        exact |= Q(search_phone=digits)
+
+    return queryset.annotate(**user_search_expressions()).filter(matches).annotate(
+        search_rank=Case(When(exact, then=Value(0)), default=Value(1), output_field=IntegerField()))
@@ -1,20 +1,18 @@
 from django.contrib.auth import get_user_model
-from django.db import IntegrityError
+from django.db import IntegrityError, models
 from django.db.models import Sum
 from django.db.models.query import Q
 from rest_framework import serializers
 
+from api.general_serializers import SparseFieldsMixin, queryset_for_serializer
+
 import datetime
-from decouple import config
 import pytz
 
 from .models import Customer, Host, Vehicle
 
-import stripe
-stripe.api_key = config('STRIPE_SECRET_KEY')
-
 
-class UserListSerializer(serializers.ModelSerializer):
+class UserListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Standard User Serializer for displaying a list of users via GET.
     Allows creation of users via POST.
@@ -23,6 +21,8 @@ class UserListSerializer(serializers.ModelSerializer):
 
     is_host = serializers.BooleanField()
 
+    field_lookups = {'is_host': ('host',)}
+
     class Meta:
         model = get_user_model()
         exclude = ('groups', 'user_permissions',)
@@ -40,7 +40,7 @@ class UserListSerializer(serializers.ModelSerializer):
         return user
 
 
-class UserDetailSerializer(serializers.ModelSerializer):
+class UserDetailSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Standard User Serializer that allows viewing detail of a User instance.
     Allows deletion and editing of user attributes via DELETE, PUT, and PATCH
@@ -51,6 +51,8 @@ class UserDetailSerializer(serializers.ModelSerializer):
                                                  "You can set is_host to true, but "
                                                  "not vice versa.")
 
+    field_lookups = {'is_host': ('host',)}
+
     class Meta:
         model = get_user_model()
         exclude = ('password', 'groups', 'user_permissions',)
@@ -84,7 +86,7 @@ class ChangePasswordSerializer(serializers.Serializer):
     new_password = serializers.CharField(required=True)
 
 
-class VehicleSerializer(serializers.HyperlinkedModelSerializer):
+class VehicleSerializer(SparseFieldsMixin, serializers.HyperlinkedModelSerializer):
     id = serializers.IntegerField(read_only=True)
     url = serializers.HyperlinkedIdentityField(
         view_name='vehicle-detail')
@@ -99,30 +101,76 @@ class VehicleSerializer(serializers.HyperlinkedModelSerializer):
         read_only_fields = ('customer',)
 
 
-class VehicleMinimalSerializer(serializers.ModelSerializer):
+class CustomerVehicleSerializer(VehicleSerializer):
+    """
+    Vehicle nested in a customer, without the links to every one of its
+    reservations (the customer's reservations_url pages through them).
+    """
+    class Meta(VehicleSerializer.Meta):
+        fields = ('url', 'id', 'deleted_at', 'created_at', 'color', 'year', 'make', 'model',
+                  'size', 'license_plate', 'customer')
+
+
+class VehicleMinimalSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Vehicle
         fields = ('id', 'year', 'make', 'model', 'color', 'size', 'license_plate',)
 
 
-class CustomerSerializer(serializers.ModelSerializer):
+class CustomerListSerializer(serializers.ListSerializer):
+    """
+    Loads the recent reservations of a whole page of customers at once.
+    """
+    def to_representation(self, data):
+        customers = list(data.all() if isinstance(data, models.Manager) else data)
+        self.child.attach_recent_reservations(customers)
+        return super(CustomerListSerializer, self).to_representation(customers)
+
+
+class CustomerSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     from parking.serializers import ReservationSerializer
 
     user = UserDetailSerializer(read_only=True)
-    vehicle_set = VehicleSerializer(
+    vehicle_set = CustomerVehicleSerializer(
         many=True,
         # view_name='vehicle-detail',
         read_only=True)
+    # only the latest few, the full history is paginated at reservations_url
     reservations = ReservationSerializer(
+        source='recent_reservations',
         many=True,
         read_only=True)
+    reservations_url = serializers.HyperlinkedIdentityField(view_name='customer-reservations')
+    field_lookups = {'reservations': ()}
 
     class Meta:
         model = Customer
         fields = '__all__'
+        list_serializer_class = CustomerListSerializer
+
+    def attach_recent_reservations(self, customers):
+        """
+        Loads the recent reservations of the customers in one query, joining
+        what the (possibly pruned) nested reservation serializer renders.
+        """
+        from parking.models import Reservation
+
+        field = self.fields.get('reservations')
+        if field is None:
+            return
+
+        reservations = None
+        if isinstance(field, serializers.ListSerializer):
+            reservations = queryset_for_serializer(Reservation.objects.all(), field.child)
+        Customer.attach_recent_reservations(customers, reservations)
+
+    def to_representation(self, instance):
+        if not hasattr(instance, '_recent_reservations'):
+            self.attach_recent_reservations([instance])
+        return super(CustomerSerializer, self).to_representation(instance)
 
 
-class HostSerializer(serializers.ModelSerializer):
+class HostSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     user = UserDetailSerializer(read_only=True)
     parkingspace_set = serializers.HyperlinkedRelatedField(
         many=True,
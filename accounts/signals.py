@@ -0,0 +1,26 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import invalidate_token, invalidate_user_tokens
+from .models import Customer, Host, User
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    invalidate_token(instance.key)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    # covers deactivation and any other change to the cached user
+    if not created:
+        invalidate_user_tokens(instance.pk)
+
+
+@receiver(post_save, sender=Host)
+@receiver(post_delete, sender=Host)
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+def role_changed(sender, instance, **kwargs):
+    invalidate_user_tokens(instance.user_id)
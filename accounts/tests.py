@@ -1,3 +1,260 @@
-from django.test import TestCase
+import datetime
+import shutil
+import tempfile
 
-# Create your tests here.
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import exceptions
+from rest_framework.authtoken.models import Token
+
+from curbd.testing import ParkingFixturesMixin
+from .authentication import CachedTokenAuthentication
+from .models import Customer, Host, User
+from .search import search_users
+
+
+class CachedTokenAuthenticationTests(ParkingFixturesMixin, TestCase):
+
+    def setUp(self):
+        super(CachedTokenAuthenticationTests, self).setUp()
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        cache_settings = override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': cache_dir}})
+        cache_settings.enable()
+        self.addCleanup(cache_settings.disable)
+
+        self.user = self.create_user()
+        self.token = Token.objects.create(user=self.user)
+        self.authentication = CachedTokenAuthentication()
+
+    def authenticate(self):
+        return self.authentication.authenticate_credentials(self.token.key)
+
+    def test_cache_hits_skip_the_database(self):
+        self.authenticate()
+        with CaptureQueriesContext(connection) as queries:
+            user, token = self.authenticate()
+
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(user.pk, self.user.pk)
+        self.assertFalse(user.is_host())
+        self.assertIsInstance(token, Token)
+        self.assertEqual((token.key, token.user_id, token.created), (self.token.key, self.user.pk, self.token.created))
+
+    def test_deleted_tokens_are_invalidated(self):
+        self.authenticate()
+        self.token.delete()
+
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate()
+
+    def test_deactivated_users_are_invalidated(self):
+        self.authenticate()
+        self.user.is_active = False
+        self.user.save()
+
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate()
+
+    def test_role_changes_are_invalidated(self):
+        self.authenticate()
+        Host.objects.create(user=self.user)
+
+        user, _ = self.authenticate()
+        self.assertTrue(user.is_host())
+
+    def test_local_memory_cache_is_not_used(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.authenticate()
+            with CaptureQueriesContext(connection) as queries:
+                self.authenticate()
+
+        self.assertGreater(len(queries), 0)
+
+
+class HostSelfStatsTests(ParkingFixturesMixin, TestCase):
+
+    def setUp(self):
+        super(HostSelfStatsTests, self).setUp()
+        from parking.models import ParkingSpaceDailyStats
+
+        self.user = self.create_user(host=True)
+        self.parking_space = self.create_parking_space(self.user)
+        other_space = self.create_parking_space(self.create_user(host=True))
+
+        for parking_space, day, minutes in ((self.parking_space, datetime.date(2026, 3, 30), 60),
+                                            (self.parking_space, datetime.date(2026, 3, 31), 30),
+                                            (self.parking_space, datetime.date(2026, 4, 1), 15),
+                                            (other_space, datetime.date(2026, 3, 31), 45)):
+            ParkingSpaceDailyStats.objects.create(
+                parking_space=parking_space, day=day, reserved_minutes=minutes, booking_count=1, host_income=100)
+        self.client.force_login(self.user)
+
+    def get(self, **params):
+        return self.client.get(reverse('host-self-stats'), dict(params, format='json'))
+
+    def test_days(self):
+        response = self.get(**{'from': '2026-03-31', 'to': '2026-04-01'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(row['period'], row['reserved_minutes']) for row in response.data['results']],
+                         [(datetime.date(2026, 3, 31), 30), (datetime.date(2026, 4, 1), 15)])
+
+    def test_months(self):
+        response = self.get(**{'from': '2026-03-01', 'to': '2026-04-30', 'granularity': 'month'})
+
+        self.assertEqual([(row['period'], row['reserved_minutes'], row['booking_count'], row['host_income'])
+                          for row in response.data['results']],
+                         [(datetime.date(2026, 3, 1), 90, 2, 200), (datetime.date(2026, 4, 1), 15, 1, 100)])
+        self.assertEqual({row['parking_space'] for row in response.data['results']}, {self.parking_space.pk})
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.get(granularity='week').status_code, 400)
+        self.assertEqual(self.get(**{'from': 'someday'}).status_code, 400)
+        self.assertEqual(self.get(**{'from': '2026-04-02', 'to': '2026-04-01'}).status_code, 400)
+
+    def test_hosts_only(self):
+        self.client.force_login(self.create_user())
+        self.assertEqual(self.get().status_code, 403)
+
+
+class UserSearchTests(ParkingFixturesMixin, TestCase):
+
+    def setUp(self):
+        super(UserSearchTests, self).setUp()
+        self.staff = self.create_user(is_staff=True, email='staff@curbdparking.com')
+        self.ada = self.create_user(
+            email='ada@curbdparking.com', first_name='Ada', last_name='Lovelace', phone_number='+1 (555) 120-0001')
+        self.adam = self.create_user(
+            email='adam@curbdparking.com', first_name='Adam', last_name='Smith', phone_number='+1 (555) 120-0002')
+        self.other = self.create_user(
+            email='grace@curbdparking.com', first_name='Grace', last_name='Adams', phone_number='+1 (555) 999-0003')
+        self.client.force_login(self.staff)
+
+    def plan(self, term):
+        """
+        The query plan of a search with sequential scans ruled out, which
+        the planner would otherwise prefer on a table this small.
+        """
+        sql, params = search_users(User.objects.all(), term).query.sql_with_params()
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('EXPLAIN ' + sql, params)
+            return '\n'.join(row[0] for row in cursor.fetchall())
+
+    def test_searches_read_the_prefix_indexes(self):
+        plan = self.plan('555 120')
+
+        self.assertNotIn('Seq Scan', plan)
+        for index in ('email', 'full_name', 'last_name', 'phone', 'phone_reversed'):
+            self.assertIn('Index Scan on accounts_user_%s_search_idx' % index, plan)
+
+    def test_name_searches_skip_the_phone_indexes(self):
+        plan = self.plan('ada')
+        self.assertIn('accounts_user_email_search_idx', plan)
+        self.assertNotIn('accounts_user_phone_search_idx', plan)
+
+    def search(self, **params):
+        response = self.client.get(reverse('user-search'), dict(params, format='json'))
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_matches(self):
+        self.assertEqual([user['id'] for user in self.search(q='ADA  lovelace')['results']], [self.ada.pk])
+        # the end of the phone number, without the country code
+        self.assertEqual([user['id'] for user in self.search(q='999-0003')['results']], [self.other.pk])
+
+    def test_exact_matches_come_first(self):
+        results = self.search(q='adam@curbdparking.com')['results']
+        self.assertEqual([user['id'] for user in results], [self.adam.pk])
+
+        results = self.search(q='ada')['results']
+        self.assertEqual([user['id'] for user in results], [self.ada.pk, self.adam.pk, self.other.pk])
+
+        # an exact full name ranks before an email that sorts first
+        namesake = self.create_user(email='a@curbdparking.com', first_name='Ada', last_name='Lovelaceworth')
+        results = self.search(q='Ada Lovelace')['results']
+        self.assertEqual([user['id'] for user in results], [self.ada.pk, namesake.pk])
+
+    def test_cursor(self):
+        for number in range(5):
+            self.create_user(email='ada%s@curbdparking.com' % number)
+
+        page = self.search(q='ada', page_size=2)
+        pages = [page['results']]
+        while page['next']:
+            response = self.client.get(page['next'])
+            page = response.data
+            pages.append(page['results'])
+
+        self.assertEqual([len(results) for results in pages], [2, 2, 2, 2])
+        emails = [user['email'] for results in pages for user in results]
+        self.assertEqual(emails, sorted(emails))
+        self.assertEqual(len(emails), 8)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('user-search'), {'q': 'ada', 'cursor': 'not a cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_staff_only(self):
+        self.client.force_login(self.ada)
+        self.assertEqual(self.client.get(reverse('user-search'), {'q': 'ada'}).status_code, 403)
+
+
+class LatestReservationsTests(ParkingFixturesMixin, TestCase):
+
+    def setUp(self):
+        super(LatestReservationsTests, self).setUp()
+        self.now = timezone.now()
+        self.host = self.create_user(host=True)
+        self.first = self.create_user()
+        self.second = self.create_user()
+
+        first_vehicles = [self.create_vehicle(self.first), self.create_vehicle(self.first)]
+        second_vehicle = self.create_vehicle(self.second)
+        self.first_reservations = [
+            self.reserve_hours(first_vehicles[0], 1),
+            self.reserve_hours(first_vehicles[1], 2),
+            self.reserve_hours(first_vehicles[0], 3),
+            # starts at the same time as the previous one
+            self.reserve_hours(first_vehicles[1], 3),
+        ]
+        self.second_reservations = [self.reserve_hours(second_vehicle, 2)]
+
+    def reserve_hours(self, vehicle, hours):
+        availability = self.create_fixed_availability(
+            self.create_parking_space(self.host), self.now, self.now + datetime.timedelta(days=1))
+        return self.reserve(vehicle, availability, self.now + datetime.timedelta(hours=hours),
+                            self.now + datetime.timedelta(hours=hours, minutes=30))
+
+    def test_latest_reservations_of_each_customer(self):
+        reservations = Customer.latest_reservations([self.first.pk, self.second.pk], 3)
+
+        with self.assertNumQueries(1):
+            rows = [(reservation.reserver_id, reservation.pk) for reservation in reservations]
+
+        # latest start first, then latest id
+        first = self.first_reservations
+        self.assertEqual([pk for reserver_id, pk in rows if reserver_id == self.first.pk],
+                         [first[3].pk, first[2].pk, first[1].pk])
+        self.assertEqual([pk for reserver_id, pk in rows if reserver_id == self.second.pk],
+                         [self.second_reservations[0].pk])
+        self.assertEqual(len(rows), 4)
+
+    def test_customers_outside_the_batch_are_left_out(self):
+        reservations = Customer.latest_reservations([self.second.pk], 3)
+        self.assertEqual([reservation.pk for reservation in reservations], [self.second_reservations[0].pk])
+
+    def test_attach_recent_reservations(self):
+        customers = list(Customer.objects.filter(pk__in=[self.first.pk, self.second.pk]).order_by('pk'))
+
+        with self.assertNumQueries(1):
+            Customer.attach_recent_reservations(customers, limit=2)
+            recent = [[reservation.pk for reservation in customer.recent_reservations] for customer in customers]
+
+        self.assertEqual(recent, [[self.first_reservations[3].pk, self.first_reservations[2].pk],
+                                  [self.second_reservations[0].pk]])
@@ -0,0 +1,176 @@
+import calendar
+import hashlib
+
+from django.db.models import Count, Max, Sum
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework import permissions
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.response import Response
+
+from curbd.sync import InvalidSyncToken, SyncToken
+
+from .general_serializers import queryset_for_serializer, sparse_field_params
+
+
+class ConditionalListMixin(object):
+    """
+    Conditional GET for list views over a VersionedModel. The ETag comes
+    from one aggregate query over the filtered queryset (row count, sum of
+    versions and latest update), so a request whose If-None-Match still
+    matches is answered with 304 Not Modified without loading or
+    serializing any rows.
+    """
+
+    def get_version_queryset(self):
+        return self.filter_queryset(self.get_queryset())
+
+    def get_version_state(self):
+        return self.get_version_queryset().aggregate(
+            count=Count('pk'), version=Sum('version'), updated_at=Max('updated_at'))
+
+    def get_etag(self, state):
+        # the same rows render differently per format (json, browsable api)
+        key = '%s:%s:%s:%s' % (
+            self.request.accepted_renderer.format, state['count'], state['version'], state['updated_at'].isoformat())
+        return quote_etag(hashlib.md5(key.encode()).hexdigest())
+
+    def get_last_modified(self, state):
+        # rows leaving the list don't move the latest update forward, so
+        # lists can only be revalidated by ETag
+        return None
+
+    def get(self, request, *args, **kwargs):
+        state = self.get_version_state()
+        if not state['count']:
+            return super(ConditionalListMixin, self).get(request, *args, **kwargs)
+
+        etag = self.get_etag(state)
+        last_modified = self.get_last_modified(state)
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = super(ConditionalListMixin, self).get(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+
+
+class ConditionalRetrieveMixin(ConditionalListMixin):
+    """
+    Conditional GET for detail views over a VersionedModel, using the
+    row's version for the ETag and its updated_at for Last-Modified.
+    Object permissions are not checked before answering 304, so this is
+    only meant for views that let anyone read the object.
+    """
+
+    def get_version_queryset(self):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        return super(ConditionalRetrieveMixin, self).get_version_queryset().filter(
+            **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+
+    def get_last_modified(self, state):
+        return calendar.timegm(state['updated_at'].utctimetuple())
+
+
+class SparseQuerysetMixin(object):
+    """
+    Restricts the queryset of reads that use ?fields= or ?expand= to the
+    columns and relations the pruned serializer actually renders.
+    """
+
+    def filter_queryset(self, queryset):
+        queryset = super(SparseQuerysetMixin, self).filter_queryset(queryset)
+        fields, expand = sparse_field_params(self.request)
+        if fields is not None or expand is not None:
+            queryset = queryset_for_serializer(queryset, self.get_serializer())
+        return queryset
+
+
+class PlannedQuerysetMixin(object):
+    """
+    Joins and prefetches everything the view's serializer renders on every
+    read, not only when ?fields= or ?expand= is given, so that list views
+    over models with deep nested serializers run a fixed number of queries
+    per page.
+    """
+
+    def filter_queryset(self, queryset):
+        queryset = super(PlannedQuerysetMixin, self).filter_queryset(queryset)
+        if self.request.method in permissions.SAFE_METHODS:
+            queryset = queryset_for_serializer(queryset, self.get_serializer())
+        return queryset
+
+
+class SyncTokenExpired(APIException):
+    status_code = 410
+    default_detail = "Too much has changed since this sync token, list again without ?since= to get a new one."
+    default_code = 'sync_token_expired'
+
+
+class DeltaSyncMixin(object):
+    """
+    Delta sync for list views over a ChangeTrackedModel. Every list response
+    carries a `sync_token`; listing again with ?since=<token> returns only
+    the rows that changed since then (unpaginated, at most `sync_limit` of
+    them) and, in `removed`, the ids of the rows that have left the list
+    since then, e.g. because they were deleted or cancelled.
+
+    Views define get_sync_scope(): every row the client could have been
+    sent, including soft deleted ones. Lists filtered against the current
+    time name the datetime fields they compare in `sync_time_fields`, so
+    that rows that cross the boundary as time passes are sent as well.
+    """
+    sync_limit = 1000
+    sync_time_fields = ()
+
+    def get_sync_scope(self):
+        raise NotImplementedError
+
+    def get_sync_filter(self, since, token):
+        changed = since.changed()
+        for field in self.sync_time_fields:
+            changed |= since.elapsed(token, field)
+        return changed
+
+    def get(self, request, *args, **kwargs):
+        # conditional GETs (ConditionalListMixin) are about the whole list
+        if 'since' in request.query_params:
+            return self.list(request, *args, **kwargs)
+        return super(DeltaSyncMixin, self).get(request, *args, **kwargs)
+
+    def list(self, request, *args, **kwargs):
+        # taken before the rows are read and before the list reads the time, see curbd.sync
+        token = SyncToken.current(self.get_sync_scope().db)
+        queryset = self.filter_queryset(self.get_queryset())
+
+        since = request.query_params.get('since')
+        if since is None:
+            response = super(DeltaSyncMixin, self).list(request, *args, **kwargs)
+            response.data['sync_token'] = token.encode()
+            return response
+
+        try:
+            since = SyncToken.decode(since)
+        except InvalidSyncToken:
+            raise ValidationError({'since': "Invalid sync token"})
+
+        changed = list(queryset.filter(self.get_sync_filter(since, token))[:self.sync_limit + 1])
+        if len(changed) > self.sync_limit:
+            raise SyncTokenExpired
+
+        removed = list(self.get_sync_scope().filter(self.get_sync_filter(since, token))
+                       .exclude(pk__in=[obj.pk for obj in changed])
+                       .order_by('pk').values_list('pk', flat=True)[:self.sync_limit + 1])
+        if len(removed) > self.sync_limit:
+            raise SyncTokenExpired
+
+        return Response({
+            'results': self.get_serializer(changed, many=True).data,
+            'removed': removed,
+            'sync_token': token.encode(),
+        })
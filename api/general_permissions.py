@@ -1,6 +1,14 @@
 from rest_framework import permissions
 
 
+def is_request_user(request, user_id):
+    """
+    Whether the id (of a user, or of the host or customer sharing their
+    primary key) is the authenticated user's, without loading any object.
+    """
+    return user_id is not None and user_id == request.user.id
+
+
 class IsStaff(permissions.BasePermission):
     """
     Custom permission to only allow staff to browse.
@@ -0,0 +1,194 @@
+"""
+?fields= and ?expand= support for the API serializers.
+
+?fields=id,start_datetime,parking_space.name keeps only the listed fields;
+dotted paths pick fields of nested serializers. Once ?expand= is given,
+nested serializers it doesn't name are collapsed to primary keys, e.g.
+?expand=parking_space embeds the parking space and leaves vehicle_detail,
+reserver, host, ... as ids. Without either parameter the full
+representation is returned as before.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import permissions, serializers
+from rest_framework.relations import ManyRelatedField, RelatedField
+
+
+def parse_field_paths(value):
+    """
+    Turns 'id,parking_space.name' into {'id': {}, 'parking_space': {'name': {}}}.
+    An empty dict means the whole field.
+    """
+    tree = {}
+    for path in value.split(','):
+        node = tree
+        for name in path.strip().split('.'):
+            if name:
+                node = node.setdefault(name, {})
+    return tree
+
+
+def sparse_field_params(request):
+    """
+    The parsed ?fields= and ?expand= of a request, or None for parameters
+    that weren't given. Only reads are affected.
+    """
+    if request is None or request.method not in permissions.SAFE_METHODS:
+        return None, None
+
+    query_params = getattr(request, 'query_params', request.GET)
+    fields = query_params.get('fields')
+    expand = query_params.get('expand')
+    return (parse_field_paths(fields) if fields else None,
+            parse_field_paths(expand) if expand is not None else None)
+
+
+def nested_serializer(field):
+    """
+    The serializer behind a nested (possibly many=True) serializer field,
+    or None for any other field.
+    """
+    if isinstance(field, serializers.ListSerializer):
+        return field.child
+    if isinstance(field, serializers.BaseSerializer):
+        return field
+    return None
+
+
+def prune_fields(serializer, fields=None, expand=None):
+    """
+    Drops the fields of a serializer (and of its nested serializers) that are
+    not in the `fields` tree and, when an `expand` tree is given, replaces
+    the nested serializers it doesn't name with their primary keys.
+    """
+    if fields:
+        for name in list(serializer.fields):
+            if name not in fields:
+                del serializer.fields[name]
+
+    for name, field in list(serializer.fields.items()):
+        child = nested_serializer(field)
+        if child is None:
+            continue
+
+        if expand is not None and name not in expand:
+            kwargs = {'many': child is not field, 'read_only': True}
+            if field.source != name:
+                kwargs['source'] = field.source
+            serializer.fields[name] = serializers.PrimaryKeyRelatedField(**kwargs)
+            continue
+
+        prune_fields(child, (fields or {}).get(name), None if expand is None else expand[name])
+
+
+class SparseFieldsMixin(object):
+    """
+    Serializer mixin applying ?fields= and ?expand= from the request in its
+    context. `field_lookups` names the relations read by the serializer's
+    SerializerMethodFields so that they can be prefetched.
+    """
+    field_lookups = {}
+
+    def __init__(self, *args, **kwargs):
+        super(SparseFieldsMixin, self).__init__(*args, **kwargs)
+        fields, expand = sparse_field_params(self.context.get('request'))
+        if fields is not None or expand is not None:
+            prune_fields(self, fields, expand)
+
+
+def model_attribute_field(model, name):
+    """
+    The model field or reverse relation behind an attribute name, or None
+    if the attribute isn't backed by one (property, method, ...).
+    """
+    try:
+        return model._meta.get_field(name)
+    except FieldDoesNotExist:
+        for relation in model._meta.related_objects:
+            if relation.get_accessor_name() == name:
+                return relation
+    return None
+
+
+def collect_lookups(serializer, model, prefix, only, select_related, prefetch_related):
+    """
+    Adds the columns, joins and prefetches needed to render `serializer`
+    for rows of `model` reached through the `prefix` lookup. When the
+    serializer reads attributes that can't be traced back to columns every
+    column of the model is loaded.
+    """
+    only.append(prefix + model._meta.pk.name)
+    complete = True
+    field_lookups = getattr(serializer, 'field_lookups', {})
+
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+
+        if name in field_lookups:
+            prefetch_related.extend(prefix + lookup for lookup in field_lookups[name])
+        elif field.source == '*':
+            # identity hyperlinks only need the primary key
+            if not isinstance(field, (RelatedField, ManyRelatedField)):
+                complete = False
+        elif not collect_field_lookups(field, model, prefix, only, select_related, prefetch_related):
+            complete = False
+
+    if not complete:
+        only.extend(prefix + model_field.name for model_field in model._meta.concrete_fields)
+
+
+def collect_field_lookups(field, model, prefix, only, select_related, prefetch_related):
+    child = nested_serializer(field)
+
+    for index, attr in enumerate(field.source_attrs):
+        model_field = model_attribute_field(model, attr)
+        if model_field is None:
+            return False
+
+        lookup = prefix + attr
+        last = index == len(field.source_attrs) - 1
+
+        if not model_field.is_relation:
+            if last:
+                only.append(lookup)
+            return last
+
+        if model_field.concrete and (model_field.many_to_one or model_field.one_to_one):
+            only.append(lookup)
+            if last and child is None:
+                # primary key or hyperlink of the related row
+                return True
+
+            select_related.append(lookup)
+            model = model_field.related_model
+            prefix = lookup + '__'
+            if last:
+                collect_lookups(child, model, prefix, only, select_related, prefetch_related)
+                return True
+            continue
+
+        if last and (model_field.one_to_many or model_field.many_to_many):
+            prefetch_related.append(lookup)
+            if child is not None:
+                # joins below a prefetch become prefetches of their own
+                nested_select_related = []
+                collect_lookups(child, model_field.related_model, lookup + '__',
+                                [], nested_select_related, prefetch_related)
+                prefetch_related.extend(nested_select_related)
+            return True
+
+        return False
+
+    return False
+
+
+def queryset_for_serializer(queryset, serializer):
+    """
+    Restricts a queryset to the columns and relations that `serializer`
+    renders, joining or prefetching the nested ones.
+    """
+    only, select_related, prefetch_related = [], [], []
+    collect_lookups(serializer, queryset.model, '', only, select_related, prefetch_related)
+
+    return queryset.select_related(*select_related).prefetch_related(
+        *sorted(set(prefetch_related))).only(*only)
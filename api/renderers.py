@@ -0,0 +1,51 @@
+import json
+
+import msgpack
+from rest_framework.renderers import BaseRenderer, JSONRenderer, BrowsableAPIRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from curbd.metrics import timed
+
+
+class TimedJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed('render'):
+            return super(TimedJSONRenderer, self).render(data, accepted_media_type, renderer_context)
+
+
+class TimedBrowsableAPIRenderer(BrowsableAPIRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed('render'):
+            return super(TimedBrowsableAPIRenderer, self).render(data, accepted_media_type, renderer_context)
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    Compact binary encoding for endpoints whose payload size matters more
+    than readability, e.g. the columnar map search results.
+    """
+    media_type = 'application/x-msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        with timed('render'):
+            return msgpack.packb(data, use_bin_type=True)
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Lets clients that only accept text/event-stream (EventSource) reach
+    streaming endpoints. Responses that aren't streamed, i.e. errors, are
+    sent as a single `error` event.
+    """
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return ('event: error\ndata: %s\n\n' % json.dumps(data, cls=JSONEncoder)).encode()
@@ -0,0 +1,97 @@
+import datetime
+
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from curbd.testing import ParkingFixturesMixin
+from .general_serializers import parse_field_paths
+
+
+class ParseFieldPathsTests(SimpleTestCase):
+
+    def test_paths(self):
+        self.assertEqual(parse_field_paths('id, parking_space.name,parking_space.id,,vehicle_detail.'), {
+            'id': {},
+            'parking_space': {'name': {}, 'id': {}},
+            'vehicle_detail': {},
+        })
+
+
+class SparseFieldsTests(ParkingFixturesMixin, TestCase):
+    """
+    ?fields= and ?expand= prune the serializers and the queries behind them.
+    """
+
+    def setUp(self):
+        super(SparseFieldsTests, self).setUp()
+        self.user = self.create_user(host=True)
+        self.vehicle = self.create_vehicle(self.user)
+        self.client.force_login(self.user)
+        self.add_reservations(1)
+
+    def add_reservations(self, count):
+        now = timezone.now()
+        for _ in range(count):
+            parking_space = self.create_parking_space(self.user)
+            availability = self.create_fixed_availability(parking_space, now, now + datetime.timedelta(days=1))
+            self.reserve(self.vehicle, availability, now + datetime.timedelta(hours=1),
+                         now + datetime.timedelta(hours=2))
+
+    def list_reservations(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('reservation-list'), dict(params, format='json'))
+        self.assertEqual(response.status_code, 200)
+        return response.data['results'], len(queries)
+
+    def test_fields(self):
+        results, _ = self.list_reservations(fields='id,parking_space.name,parking_space.size')
+
+        self.assertEqual(set(results[0]), {'id', 'parking_space'})
+        self.assertEqual(set(results[0]['parking_space']), {'name', 'size'})
+
+    def test_unknown_fields_are_ignored(self):
+        results, _ = self.list_reservations(fields='id,nickname,parking_space.nickname')
+
+        self.assertEqual(set(results[0]), {'id', 'parking_space'})
+        self.assertEqual(results[0]['parking_space'], {})
+
+    def test_expand(self):
+        results, _ = self.list_reservations(expand='parking_space')
+        reservation = results[0]
+
+        self.assertIsInstance(reservation['parking_space'], dict)
+        # nested serializers that weren't named are collapsed to ids
+        self.assertEqual(reservation['vehicle_detail'], self.vehicle.pk)
+        self.assertEqual(reservation['reserver'], self.user.pk)
+        self.assertEqual(reservation['host'], self.user.pk)
+
+        results, _ = self.list_reservations(expand='')
+        self.assertEqual(results[0]['parking_space'], reservation['parking_space']['id'])
+
+    def test_query_count_does_not_grow_with_the_page(self):
+        for params in ({'expand': 'parking_space'}, {'expand': 'parking_space,reserver'},
+                       {'fields': 'id,parking_space.name,vehicle_detail.license_plate'}):
+            _, one_row = self.list_reservations(**params)
+            self.add_reservations(5)
+            results, six_rows = self.list_reservations(**params)
+
+            self.assertGreater(len(results), 5)
+            self.assertEqual(one_row, six_rows, params)
+
+    def test_detail_fields(self):
+        parking_space = self.create_parking_space(self.user)
+        response = self.client.get(reverse('parkingspace-detail', args=[parking_space.pk]),
+                                   {'fields': 'id,name', 'format': 'json'})
+
+        self.assertEqual(response.data, {'id': parking_space.pk, 'name': parking_space.name})
+
+    def test_writes_are_not_pruned(self):
+        parking_space = self.create_parking_space(self.user)
+        response = self.client.patch(reverse('parkingspace-detail', args=[parking_space.pk]) + '?fields=id',
+                                     {'name': 'Renamed'}, content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['name'], 'Renamed')
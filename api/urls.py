@@ -7,6 +7,7 @@ from . import views
 
 urlpatterns = [
     path('', views.api_root),
+    path('metrics', views.metrics, name='metrics'),
     path('auth/', include('rest_framework.urls'), name='rest_framework'),
     path('auth/token', drf_views.obtain_auth_token, name='auth'),
     path('accounts/', include('accounts.api_urls')),
@@ -1,8 +1,13 @@
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
 from rest_framework import permissions
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
 
+from curbd import metrics as curbd_metrics
+
 
 @api_view(['GET'])
 @permission_classes((permissions.AllowAny,))
@@ -17,3 +22,17 @@ def api_root(request, format=None):
         'repeatingavailabilities': reverse('repeatingavailability-list', request=request, format=format),
         'reservations': reverse('reservation-list', request=request, format=format),
     })
+
+
+def metrics(request):
+    """
+    Request and command histograms in the Prometheus text format.
+    """
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    has_token = bool(settings.METRICS_TOKEN) and constant_time_compare(
+        authorization, 'Bearer %s' % settings.METRICS_TOKEN)
+
+    if not (has_token or request.user.is_staff):
+        return HttpResponse(status=403)
+
+    return HttpResponse(curbd_metrics.render_prometheus(), content_type='text/plain; version=0.0.4')
@@ -0,0 +1,67 @@
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that reads the row count of unfiltered changelists from the
+    planner statistics instead of running COUNT(*) over the whole table.
+    Filtered querysets and small tables are still counted exactly.
+    """
+    exact_count_threshold = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        model = queryset.model
+        unfiltered_query = model._default_manager.all().query
+
+        if len(queryset.query.where.children) > len(unfiltered_query.where.children):
+            return super(EstimatedCountPaginator, self).count
+
+        with connections[queryset.db].cursor() as cursor:
+            # partitioned tables have no rows of their own, so their
+            # partitions are added up as well
+            cursor.execute(
+                "SELECT coalesce(sum(greatest(reltuples, 0)), 0) FROM pg_class "
+                "WHERE oid = %s::regclass OR oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = %s::regclass)",
+                [model._meta.db_table, model._meta.db_table])
+            estimate = int(cursor.fetchone()[0])
+
+        if estimate < self.exact_count_threshold:
+            return super(EstimatedCountPaginator, self).count
+        return estimate
+
+
+class ScalableModelAdmin(object):
+    """
+    Mixin for the admin of tables that can grow to millions of rows:
+    estimated counts, no second full-table count for "x of y selected", and
+    a search box that only hits indexed columns. A numeric search term
+    matches the primary key and `indexed_id_search_fields`, and any term is
+    matched exactly against `indexed_search_fields`.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    indexed_id_search_fields = ()
+    indexed_search_fields = ()
+    search_fields = ('=id',)
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+
+        query = Q()
+        if search_term.isdigit():
+            query |= Q(pk=int(search_term))
+            for field_name in self.indexed_id_search_fields:
+                query |= Q(**{field_name: int(search_term)})
+        for field_name in self.indexed_search_fields:
+            query |= Q(**{field_name: search_term})
+
+        if not query:
+            return queryset.none(), False
+        return queryset.filter(query), False
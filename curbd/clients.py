@@ -0,0 +1,127 @@
+"""
+Lazily initialized third-party clients.
+
+Stripe and timezonefinder (which pulls in numpy) are slow to import, so
+they are only imported the first time a request or command actually needs
+them, instead of when Django loads the models and URLconf. This keeps
+worker boot and management commands fast.
+"""
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .metrics import registry, timed
+
+
+_stripe_lock = threading.Lock()
+_local = threading.local()
+
+# ephemeral keys are handed out until this many seconds before they expire
+EPHEMERAL_KEY_MIN_TTL = 300
+
+
+def stripe_http_client():
+    """
+    The HTTP client of the stripe library: one keep-alive connection pool
+    (up to STRIPE_POOL_SIZE connections) shared by every thread, with the
+    timeout of the current `StripeClient.call`.
+    """
+    import requests
+    from stripe.http_client import RequestsClient
+
+    class PooledRequestsClient(RequestsClient):
+
+        @property
+        def _timeout(self):
+            return getattr(_local, 'stripe_timeout', None) or settings.STRIPE_TIMEOUT
+
+        @_timeout.setter
+        def _timeout(self, value):
+            # set by RequestsClient.__init__, the timeout is per call instead
+            pass
+
+    session = requests.Session()
+    session.mount('https://', requests.adapters.HTTPAdapter(
+        pool_connections=1, pool_maxsize=settings.STRIPE_POOL_SIZE))
+    return PooledRequestsClient(session=session)
+
+
+def stripe_api():
+    """
+    The stripe module, configured with the secret key and the pooled HTTP
+    client on first use.
+    """
+    import stripe
+
+    if stripe.api_key is None:
+        with _stripe_lock:
+            if stripe.api_key is None:
+                stripe.default_http_client = stripe_http_client()
+                stripe.api_key = settings.STRIPE_SECRET_KEY
+    return stripe
+
+
+class StripeClient(object):
+    """
+    Calls to the Stripe API, with a timeout per call. Their latency is
+    recorded in the `curbd_stripe_seconds` histogram (by operation) and in
+    the `stripe` component of the current scope.
+    """
+
+    @property
+    def stripe(self):
+        return stripe_api()
+
+    def call(self, operation, timeout=None, **params):
+        """
+        :param operation: resource and method, e.g. 'Customer.create'
+        :param timeout: seconds, STRIPE_TIMEOUT by default
+        :param params: parameters of the API method
+        """
+        resource, method = operation.split('.')
+        function = getattr(getattr(self.stripe, resource), method)
+
+        started = time.perf_counter()
+        _local.stripe_timeout = timeout
+        try:
+            with timed('stripe'):
+                return function(**params)
+        finally:
+            _local.stripe_timeout = None
+            registry.observe('curbd_stripe_seconds', time.perf_counter() - started, operation=operation)
+
+    def ephemeral_key(self, customer_id, api_version):
+        """
+        An ephemeral key of a customer for a mobile API version. Keys are
+        cached and reused until EPHEMERAL_KEY_MIN_TTL seconds before they
+        expire, so most app launches don't wait for Stripe.
+        :return: the key as a dict
+        """
+        cache_key = 'stripe_ephemeral_key:%s:%s' % (customer_id, api_version)
+        key = cache.get(cache_key)
+        if key is None:
+            key = json.loads(str(self.call(
+                'EphemeralKey.create', customer=customer_id, stripe_version=api_version)))
+            ttl = key['expires'] - int(time.time()) - EPHEMERAL_KEY_MIN_TTL
+            if ttl > 0:
+                cache.set(cache_key, key, ttl)
+        return key
+
+
+stripe_client = StripeClient()
+
+
+def timezone_finder():
+    """
+    A TimezoneFinder for the current thread. Instances read their data files
+    through shared file handles, so each thread gets its own, created the
+    first time the thread needs one and reused afterwards.
+    """
+    finder = getattr(_local, 'timezone_finder', None)
+    if finder is None:
+        from timezonefinder import TimezoneFinder
+        finder = _local.timezone_finder = TimezoneFinder()
+    return finder
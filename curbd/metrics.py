@@ -0,0 +1,222 @@
+"""
+In-process performance instrumentation.
+
+Code runs inside an `instrument(name)` scope (one per request, see
+curbd.middleware.InstrumentationMiddleware). Within a scope every SQL query is counted and timed, and blocks
+wrapped in `timed(component)` add to that component's total. When the
+scope ends its totals are folded into per-name histograms, which
+`render_prometheus()` exposes in the Prometheus text format.
+
+Histograms live in the memory of each process, so every worker reports
+its own numbers. Management commands are instrumented by deriving from
+`InstrumentedCommand`; their process exits when they are done, so they push
+their numbers to a Prometheus Pushgateway instead (METRICS_PUSHGATEWAY_URL).
+"""
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for index, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                self.bucket_counts[index] += 1
+
+
+class Registry(object):
+    """
+    Histograms keyed by (metric name, sorted label items).
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+
+    def observe(self, metric, value, buckets=DURATION_BUCKETS, **labels):
+        key = (metric, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            last_metric = None
+            for (metric, labels), histogram in sorted(self.histograms.items()):
+                if metric != last_metric:
+                    lines.append('# HELP %s %s' % (metric, METRIC_HELP.get(metric, metric)))
+                    lines.append('# TYPE %s histogram' % metric)
+                    last_metric = metric
+
+                # bucket counts are already cumulative
+                for upper_bound, bucket_count in zip(histogram.buckets, histogram.bucket_counts):
+                    lines.append('%s_bucket{%s} %d' % (
+                        metric, format_labels(labels + (('le', upper_bound),)), bucket_count))
+                lines.append('%s_bucket{%s} %d' % (metric, format_labels(labels + (('le', '+Inf'),)), histogram.count))
+                lines.append('%s_sum{%s} %s' % (metric, format_labels(labels), histogram.sum))
+                lines.append('%s_count{%s} %d' % (metric, format_labels(labels), histogram.count))
+        return '\n'.join(lines) + '\n'
+
+
+METRIC_HELP = {
+    'curbd_duration_seconds': "Wall time of each request, by name.",
+    'curbd_sql_queries': "Number of SQL queries run per request, by name.",
+    'curbd_component_seconds': "Time spent in a component (sql, stripe, send_mail, ...) per request.",
+    'curbd_stripe_seconds': "Latency of Stripe API calls, by operation.",
+}
+
+
+def format_labels(labels):
+    return ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                    for name, value in labels)
+
+
+registry = Registry()
+_local = threading.local()
+
+
+class Scope(object):
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.duration = None
+        self.query_count = 0
+        self.components = {}
+
+    def add(self, component, seconds):
+        self.components[component] = self.components.get(component, 0) + seconds
+
+    def server_timing(self):
+        """
+        Value of the Server-Timing header describing this scope.
+        """
+        metrics = ['total;dur=%.1f' % (self.duration * 1000)]
+        for component, seconds in sorted(self.components.items()):
+            description = ''
+            if component == 'sql':
+                description = ';desc="%d queries"' % self.query_count
+            metrics.append('%s;dur=%.1f%s' % (component, seconds * 1000, description))
+        return ', '.join(metrics)
+
+
+def current_scope():
+    stack = getattr(_local, 'scopes', None)
+    return stack[-1] if stack else None
+
+
+def sql_execute_wrapper(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        scope = current_scope()
+        if scope is not None:
+            scope.query_count += 1
+            scope.add('sql', time.perf_counter() - started)
+
+
+@contextmanager
+def instrument(name):
+    """
+    Records the wall time, SQL queries and timed components of the
+    enclosed block under the given name. The name of a request scope may be
+    changed while it is running (the view is only known once URLs are
+    resolved).
+    """
+    scope = Scope(name)
+    stack = getattr(_local, 'scopes', None)
+    if stack is None:
+        stack = _local.scopes = []
+    stack.append(scope)
+
+    try:
+        with ExitStack() as wrappers:
+            for connection in connections.all():
+                if sql_execute_wrapper not in connection.execute_wrappers:
+                    wrappers.enter_context(connection.execute_wrapper(sql_execute_wrapper))
+            yield scope
+    finally:
+        # streamed responses can end after scopes that started later
+        stack.remove(scope)
+        scope.duration = time.perf_counter() - scope.started
+
+        registry.observe('curbd_duration_seconds', scope.duration, name=scope.name)
+        registry.observe('curbd_sql_queries', scope.query_count, buckets=QUERY_COUNT_BUCKETS, name=scope.name)
+        for component, seconds in scope.components.items():
+            registry.observe('curbd_component_seconds', seconds, name=scope.name, component=component)
+
+
+@contextmanager
+def timed(component):
+    """
+    Adds the time spent in the enclosed block to `component` in the
+    current scope. Does nothing outside of a scope.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        scope = current_scope()
+        if scope is not None:
+            scope.add(component, time.perf_counter() - started)
+
+
+def render_prometheus():
+    return registry.render()
+
+
+def push(job, **grouping):
+    """
+    Sends the histograms of this process to the Prometheus Pushgateway at
+    METRICS_PUSHGATEWAY_URL, replacing those last pushed for the job and
+    grouping labels.
+    :return: False if the push failed
+    """
+    import requests
+
+    url = '%s/metrics/job/%s' % (settings.METRICS_PUSHGATEWAY_URL.rstrip('/'), job)
+    for label, value in sorted(grouping.items()):
+        url += '/%s/%s' % (label, value)
+    try:
+        requests.put(url, data=render_prometheus().encode('utf-8'), timeout=10).raise_for_status()
+    except requests.RequestException:
+        return False
+    return True
+
+
+class InstrumentedCommand(BaseCommand):
+    """
+    A management command whose run is recorded like a request, under the
+    name 'command:<name>'. The numbers are pushed to the Pushgateway when
+    the command ends (if METRICS_PUSHGATEWAY_URL is set), and written to
+    stderr with --verbosity 2 or more.
+    """
+
+    def execute(self, *args, **options):
+        command = self.__module__.rsplit('.', 1)[-1]
+        try:
+            with instrument('command:%s' % command) as scope:
+                return super(InstrumentedCommand, self).execute(*args, **options)
+        finally:
+            if options.get('verbosity', 1) >= 2:
+                self.stderr.write("%s: %s" % (scope.name, scope.server_timing()))
+            if settings.METRICS_PUSHGATEWAY_URL and not push('curbd', command=command):
+                self.stderr.write("Couldn't push metrics to %s" % settings.METRICS_PUSHGATEWAY_URL)
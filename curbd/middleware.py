@@ -0,0 +1,102 @@
+import hashlib
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework import permissions
+
+from . import metrics, routers
+
+
+class InstrumentedStream(object):
+    """
+    Streaming content that ends the request's scope once it has been sent,
+    or the client went away (Django closes it either way).
+    """
+
+    def __init__(self, content, scope_context):
+        self.content = content
+        self.scope_context = scope_context
+
+    def __iter__(self):
+        return iter(self.content)
+
+    def close(self):
+        self.scope_context.close()
+
+
+class InstrumentationMiddleware(object):
+    """
+    Records the wall time, SQL queries and timed components of every
+    request under the name of the URL pattern that served it, and reports
+    them to staff users in a Server-Timing header. Streamed responses are
+    recorded until their last byte is sent, so they get no header.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with ExitStack() as scope_context:
+            scope = request.metrics_scope = scope_context.enter_context(metrics.instrument('unresolved'))
+            response = self.get_response(request)
+
+            if response.streaming:
+                response.streaming_content = InstrumentedStream(response.streaming_content, scope_context.pop_all())
+                return response
+
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_staff:
+            response['Server-Timing'] = scope.server_timing()
+
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # URL pattern names keep the number of label values bounded
+        resolver_match = request.resolver_match
+        request.metrics_scope.name = resolver_match.view_name or resolver_match._func_path
+
+
+class ReplicaRoutingMiddleware(object):
+    """
+    Sends the reads of safe-method requests to a read replica and pins a
+    client to the primary for REPLICA_PIN_SECONDS after each of its writes,
+    so that e.g. a reservation it just created is in its next listing. The
+    pin lives in the shared cache, keyed by the client's token or session.
+    """
+
+    def __init__(self, get_response):
+        # a pin set by one worker must be seen by the others
+        if settings.DATABASE_REPLICAS and isinstance(caches['default'], LocMemCache):
+            raise ImproperlyConfigured(
+                "Read replicas need a cache shared by every worker (CACHE_BACKEND) to pin clients to the "
+                "primary after they write, the default local memory cache is per process.")
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+
+        pin_key = self.pin_key(request)
+        safe = request.method in permissions.SAFE_METHODS
+
+        if safe and (pin_key is None or not cache.get(pin_key)):
+            with routers.replica_reads():
+                return self.get_response(request)
+
+        response = self.get_response(request)
+        if not safe and pin_key is not None:
+            cache.set(pin_key, True, settings.REPLICA_PIN_SECONDS)
+        return response
+
+    def pin_key(self, request):
+        """
+        Cache key of the client's pin, or None for anonymous clients without
+        a session.
+        """
+        credentials = request.META.get('HTTP_AUTHORIZATION') or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+        if not credentials:
+            return None
+        return 'primary_pin:%s' % hashlib.sha1(credentials.encode('utf-8')).hexdigest()
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 import datetime
 import pytz
 
@@ -27,6 +28,19 @@ class SoftDeletionManager(models.Manager):
     def hard_delete(self):
         return self.get_queryset().hard_delete()
 
+    def with_archived(self, *args, **kwargs):
+        """
+        Returns the rows matching the given filters from both the live table
+        and the archive table that `archive_deleted` moves old rows into.
+        The result is a union, so it can be ordered and sliced but not
+        filtered any further.
+        """
+        queryset = self.get_queryset().filter(*args, **kwargs)
+        archive_model = getattr(self.model, 'archive_model', None)
+        if archive_model is None:
+            return queryset
+        return queryset.union(archive_model.objects.filter(*args, **kwargs), all=True)
+
 
 class SoftDeletionModel(models.Model):
     deleted_at = models.DateTimeField(blank=True, null=True)
@@ -34,9 +48,34 @@ class SoftDeletionModel(models.Model):
     objects = SoftDeletionManager()
     all_objects = SoftDeletionManager(include_deleted=True)
 
+    # set by archive_model_for()
+    archive_model = None
+
     class Meta:
         abstract = True
 
+    @classmethod
+    def archive_condition(cls, cutoff):
+        return models.Q(deleted_at__lt=cutoff)
+
+    @classmethod
+    def archivable(cls, cutoff):
+        """
+        Rows that may be moved to the archive table: those matching
+        archive_condition() that no row staying behind still references.
+        """
+        queryset = cls.all_objects.filter(cls.archive_condition(cutoff))
+
+        for relation in cls._meta.related_objects:
+            if relation.related_model._meta.proxy or relation.many_to_many:
+                continue
+            annotation = 'has_%s' % relation.name
+            queryset = queryset.annotate(**{annotation: models.Exists(
+                relation.related_model._base_manager.filter(
+                    **{relation.field.name: models.OuterRef('pk')}))}).filter(**{annotation: False})
+
+        return queryset
+
     def delete(self, *args, **kwargs):
         self.deleted_at = datetime.datetime.now(pytz.utc)
         self.save()
@@ -47,3 +86,77 @@ class SoftDeletionModel(models.Model):
 
     def hard_delete(self):
         super(SoftDeletionModel, self).delete()
+
+
+class VersionedModel(models.Model):
+    """
+    Keeps track of when a row last changed and how many times it has
+    changed, so that API views can answer conditional GETs from a cheap
+    version query. Rows whose API representation embeds other rows should
+    be touch()ed whenever one of those rows changes.
+    """
+    updated_at = models.DateTimeField(auto_now=True)
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def touch(cls, pk):
+        """
+        Bumps the version of a row without loading it.
+        """
+        if pk is not None:
+            cls._base_manager.filter(pk=pk).update(version=models.F('version') + 1, updated_at=timezone.now())
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            self.version += 1
+        super(VersionedModel, self).save(*args, **kwargs)
+
+
+class ChangeTrackedModel(models.Model):
+    """
+    Rows stamped with a change sequence number on every write, so that
+    clients can fetch only what changed since their last sync (see
+    curbd.sync). The columns are set by a trigger that each table gets in a
+    migration (curbd.sync.change_tracking_sql), never by Django.
+    """
+    change_seq = models.BigIntegerField(default=0, editable=False, db_index=True)
+    change_xid = models.BigIntegerField(default=0, editable=False, db_index=True)
+
+    class Meta:
+        abstract = True
+
+
+def archive_model_for(model):
+    """
+    Builds an unmanaged model over the "<db_table>_archive" table of a
+    SoftDeletionModel. Relations are kept as unconstrained foreign keys so
+    that archived rows can still be filtered on them.
+    """
+    attrs = {
+        '__module__': model.__module__,
+        'Meta': type('Meta', (), {
+            'managed': False,
+            'db_table': '%s_archive' % model._meta.db_table,
+            'app_label': model._meta.app_label,
+        }),
+    }
+
+    for field in model._meta.concrete_fields:
+        if field.is_relation:
+            attrs[field.name] = models.ForeignKey(
+                field.remote_field.model,
+                on_delete=models.DO_NOTHING,
+                db_constraint=False,
+                db_column=field.column,
+                related_name='+',
+                null=field.null,
+                blank=field.blank)
+        else:
+            attrs[field.name] = field.clone()
+
+    archive_model = type('Archived%s' % model.__name__, (models.Model,), attrs)
+    model.archive_model = archive_model
+    return archive_model
@@ -0,0 +1,80 @@
+"""
+Read replica routing.
+
+Reads go to a replica only inside `replica_reads()`, which
+curbd.middleware.ReplicaRoutingMiddleware enters for safe-method requests
+of clients that haven't written recently. Everything else (writes, unsafe
+requests, management commands, tests) uses the primary. Once anything is
+written, the rest of the block reads from the primary as well, so a
+request always sees its own writes.
+"""
+import random
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+
+_state = threading.local()
+
+# credentials are read from the primary, or a client that just logged in or
+# got a token could be turned away by a replica that hasn't caught up yet
+PRIMARY_ONLY_MODELS = ('authtoken.Token', 'sessions.Session')
+
+
+def database_address(alias):
+    settings_dict = connections[alias].settings_dict
+    return settings_dict['HOST'], settings_dict['PORT'], settings_dict['NAME']
+
+
+def usable_replicas():
+    """
+    The replicas that aren't the primary under another alias. Test mirrors
+    are: they get the primary's settings but a connection of their own,
+    which can't see the test case's uncommitted transaction.
+    """
+    primary = database_address('default')
+    return [alias for alias in settings.DATABASE_REPLICAS if database_address(alias) != primary]
+
+
+@contextmanager
+def replica_reads():
+    """
+    Routes the reads of the enclosed block to one replica, picked at random
+    so that the block reads from a single consistent copy.
+    """
+    previous = getattr(_state, 'replica', None)
+    replicas = usable_replicas()
+    _state.replica = random.choice(replicas) if replicas else None
+    try:
+        yield
+    finally:
+        _state.replica = previous
+
+
+class ReplicaRouter(object):
+
+    def db_for_read(self, model, **hints):
+        if model._meta.label in PRIMARY_ONLY_MODELS:
+            return 'default'
+
+        # related objects come from the database their instance came from,
+        # e.g. the roles of a user authenticated against the primary
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db is not None:
+            return instance._state.db
+
+        return getattr(_state, 'replica', None) or 'default'
+
+    def db_for_write(self, model, **hints):
+        # read your own writes for the rest of the block
+        _state.replica = None
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
@@ -1,6 +1,5 @@
 import os
 from decouple import config
-from google.oauth2 import service_account
 
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -39,13 +38,17 @@ INSTALLED_APPS = [
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.TokenAuthentication'
+        'accounts.authentication.CachedTokenAuthentication'
     ),
     # Use Django's standard `django.contrib.auth` permissions,
     # or allow read-only access for unauthenticated users.
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.DjangoModelPermissionsOrAnonReadOnly'
     ],
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.renderers.TimedJSONRenderer',
+        'api.renderers.TimedBrowsableAPIRenderer',
+    ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
     'DEFAULT_FILTER_BACKENDS': ('django_filters.rest_framework.DjangoFilterBackend',)
@@ -59,6 +62,8 @@ WEBPACK_LOADER = {
 }
 
 MIDDLEWARE = [
+    'curbd.middleware.InstrumentationMiddleware',
+    'curbd.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -103,6 +108,38 @@ DATABASES = {
     }
 }
 
+# Read replicas, e.g. DB_REPLICA_HOSTS=replica-1,replica-2. DB_REPLICA_NAME can point
+# them at another database on the same server instead, to try replication locally.
+DATABASE_REPLICAS = []
+for replica_host in config('DB_REPLICA_HOSTS', default='', cast=lambda v: [s.strip() for s in v.split(',') if s.strip()]):
+    DATABASE_REPLICAS.append('replica%d' % (len(DATABASE_REPLICAS) + 1))
+    DATABASES[DATABASE_REPLICAS[-1]] = dict(
+        DATABASES['default'],
+        NAME=config('DB_REPLICA_NAME', default=DATABASES['default']['NAME']),
+        HOST=replica_host,
+        TEST={'MIRROR': 'default'})
+
+# Metros parking spaces are grouped by: name -> (south, west, north, east) in degrees.
+# Spaces outside all of them belong to the "other" region.
+PARKING_REGIONS = {
+    'los-angeles': (33.40, -119.00, 34.85, -117.40),
+}
+
+DATABASE_ROUTERS = ['curbd.routers.ReplicaRouter']
+
+# seconds a client keeps reading from the primary after it writes
+REPLICA_PIN_SECONDS = config('REPLICA_PIN_SECONDS', default=5, cast=int)
+
+# Vacancy streams (parking/vacancy.py): each one holds a worker thread, so they end
+# after a while and clients reconnect; a comment is sent when nothing changed for a while
+VACANCY_STREAM_SECONDS = config('VACANCY_STREAM_SECONDS', default=300, cast=int)
+VACANCY_STREAM_RETRY_SECONDS = config('VACANCY_STREAM_RETRY_SECONDS', default=3, cast=int)
+VACANCY_KEEPALIVE_SECONDS = config('VACANCY_KEEPALIVE_SECONDS', default=15, cast=int)
+# Streams open at a time in each process. Streams need threaded or async workers (e.g.
+# gunicorn --worker-class gthread --threads 16 with VACANCY_MAX_STREAMS=8, leaving threads
+# for other requests); with sync workers keep it at 0, and every client polls the search.
+VACANCY_MAX_STREAMS = config('VACANCY_MAX_STREAMS', default=0, cast=int)
+
 # Password validation
 # https://docs.djangoproject.com/en/1.11/ref/settings/#auth-password-validators
 
@@ -170,16 +207,15 @@ EMAIL_SUBJECT_PREFIX = '[Curbd] '
 
 # File storage
 
-DEFAULT_FILE_STORAGE = 'storages.backends.gcloud.GoogleCloudStorage'
+# loads the credentials on first use, see curbd.storage
+DEFAULT_FILE_STORAGE = 'curbd.storage.GoogleCloudStorage'
 
 
 # Google Cloud Platform settings
 if os.getenv('GAE_INSTANCE'):
-    pass
+    GS_CREDENTIALS_PATH = None
 else:
-    GS_CREDENTIALS = service_account.Credentials.from_service_account_file(
-        config('GS_CREDENTIALS_PATH')
-    )
+    GS_CREDENTIALS_PATH = config('GS_CREDENTIALS_PATH')
 
 GS_BUCKET_NAME = config('GS_BUCKET_NAME')
 GS_AUTO_CREATE_BUCKET = config('GS_AUTO_CREATE_BUCKET')
@@ -187,6 +223,40 @@ GS_AUTO_CREATE_ACL = config('GS_AUTO_CREATE_ACL')
 GS_PROJECT_ID = config('GS_PROJECT_ID')
 GS_DEFAULT_ACL = config('GS_DEFAULT_ACL')
 
+# Stripe
+
+STRIPE_SECRET_KEY = config('STRIPE_SECRET_KEY')
+# seconds before a Stripe request gives up (the library default is 80), unless the call sets its own
+STRIPE_TIMEOUT = config('STRIPE_TIMEOUT', default=10, cast=int)
+# keep-alive connections to Stripe per process, see curbd.clients
+STRIPE_POOL_SIZE = config('STRIPE_POOL_SIZE', default=10, cast=int)
+# threads per process that send charges to Stripe, see payment/executor.py
+PAYMENT_WORKERS = config('PAYMENT_WORKERS', default=4, cast=int)
+
+# Metrics
+
+# bearer token that lets a Prometheus scraper read /api/metrics (staff can always read it)
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+# Prometheus Pushgateway that management commands push their metrics to when they end, e.g.
+# http://pushgateway:9091 (see curbd.metrics.InstrumentedCommand)
+METRICS_PUSHGATEWAY_URL = config('METRICS_PUSHGATEWAY_URL', default='')
+
+# Cache
+
+# shared between processes in production, e.g. CACHE_BACKEND=django.core.cache.backends.memcached.MemcachedCache
+# and CACHE_LOCATION=host:port (the default local memory cache is per process, and refused when
+# DB_REPLICA_HOSTS is set, see curbd.middleware.ReplicaRoutingMiddleware)
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default=''),
+    }
+}
+
+# seconds an API token's user and roles are cached for (only with a shared cache)
+AUTH_TOKEN_CACHE_TIMEOUT = config('AUTH_TOKEN_CACHE_TIMEOUT', default=300, cast=int)
+
 # Security
 
 SECURE_HSTS_SECONDS = config('SECURE_HSTS_SECONDS', default=10, cast=int)
@@ -0,0 +1,19 @@
+from django.conf import settings
+from storages.backends.gcloud import GoogleCloudStorage as BaseGoogleCloudStorage
+
+
+class GoogleCloudStorage(BaseGoogleCloudStorage):
+    """
+    Google Cloud Storage that loads the service account credentials
+    (GS_CREDENTIALS_PATH) when the first file is read or written rather
+    than when the settings are imported. Without a credentials path (on App
+    Engine) the default credentials are used.
+    """
+
+    @property
+    def client(self):
+        if self._client is None and self.credentials is None and settings.GS_CREDENTIALS_PATH:
+            from google.oauth2 import service_account
+            self.credentials = service_account.Credentials.from_service_account_file(
+                settings.GS_CREDENTIALS_PATH)
+        return super(GoogleCloudStorage, self).client
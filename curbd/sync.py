@@ -0,0 +1,109 @@
+"""
+Delta sync tokens.
+
+Every write to a ChangeTrackedModel row stamps it, in a database trigger,
+with the next value of CHANGE_SEQUENCE (change_seq) and the id of the
+writing transaction (change_xid), so that updates that bypass save() are
+tracked too.
+
+Sequence values are handed out when rows are written, not when their
+transactions commit, so a row can become visible after rows with higher
+numbers. A token therefore holds both the sequence's last value and the
+oldest transaction still running when it was taken: the rows changed
+since then are the ones with a higher change_seq, plus the ones written by
+transactions that were still running. The latter may be sent twice, which
+clients handle like any other update.
+
+Lists bounded by the current time (e.g. current and previous reservations)
+also change when time passes, without any write, so tokens record when
+they were taken too (see `SyncToken.elapsed`).
+"""
+import binascii
+import datetime
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import namedtuple
+
+import pytz
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+
+
+CHANGE_SEQUENCE = 'curbd_change_seq'
+
+
+def change_tracking_sql(table):
+    """
+    The SQL that installs (and removes) the change tracking trigger of a
+    table, for a RunSQL migration operation. The table needs the change_seq
+    and change_xid columns of ChangeTrackedModel.
+    """
+    forwards = [
+        'CREATE SEQUENCE IF NOT EXISTS %s;' % CHANGE_SEQUENCE,
+        "CREATE OR REPLACE FUNCTION curbd_track_change() RETURNS trigger AS $$ "
+        "BEGIN "
+        "NEW.change_seq := nextval('%s'); "
+        "NEW.change_xid := txid_current(); "
+        "RETURN NEW; "
+        "END; $$ LANGUAGE plpgsql;" % CHANGE_SEQUENCE,
+        'CREATE TRIGGER %s_track_change BEFORE INSERT OR UPDATE ON %s '
+        'FOR EACH ROW EXECUTE PROCEDURE curbd_track_change();' % (table, table),
+    ]
+    backwards = ['DROP TRIGGER %s_track_change ON %s;' % (table, table)]
+    return forwards, backwards
+
+
+class InvalidSyncToken(ValueError):
+    pass
+
+
+class SyncToken(namedtuple('SyncToken', ('seq', 'xmin', 'time'))):
+    """
+    seq and xmin as described above, and the time the token was taken, in
+    microseconds since the epoch.
+    """
+
+    @classmethod
+    def current(cls, using='default'):
+        """
+        The token of everything visible from now on. Taken before the rows
+        it covers are read (and before the current time is read for them),
+        so rows written meanwhile are sent again rather than missed.
+        """
+        time = timezone.now()
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                'SELECT CASE WHEN is_called THEN last_value ELSE 0 END, txid_snapshot_xmin(txid_current_snapshot()) '
+                'FROM %s' % CHANGE_SEQUENCE)
+            seq, xmin = cursor.fetchone()
+        return cls(seq, xmin, int(time.timestamp() * 1000000))
+
+    @classmethod
+    def decode(cls, value):
+        try:
+            seq, xmin, time = urlsafe_b64decode(value.encode('ascii')).decode('ascii').split('.')
+            return cls(int(seq), int(xmin), int(time))
+        except (TypeError, ValueError, UnicodeError, binascii.Error):
+            raise InvalidSyncToken(value)
+
+    def encode(self):
+        return urlsafe_b64encode(('%d.%d.%d' % self).encode('ascii')).decode('ascii')
+
+    @property
+    def datetime(self):
+        return datetime.datetime.fromtimestamp(self.time / 1000000, pytz.utc)
+
+    def changed(self, prefix=''):
+        """
+        Filter of the rows changed since the token.
+        :param prefix: lookup of a related change tracked model, e.g. 'reservation__'
+        """
+        return Q(**{prefix + 'change_seq__gt': self.seq}) | Q(**{prefix + 'change_xid__gte': self.xmin})
+
+    def elapsed(self, later, field):
+        """
+        Filter of the rows whose `field` (a datetime) passed between the
+        token and a later one, i.e. that moved across the boundary of a list
+        bounded by the current time.
+        """
+        return Q(**{field + '__gt': self.datetime, field + '__lte': later.datetime})
@@ -0,0 +1,80 @@
+"""
+Test helpers shared by the apps' test suites.
+"""
+from unittest import mock
+
+
+class FakeStripeCustomerMixin(object):
+    """
+    Keeps tests that create users from calling Stripe: every new customer
+    gets a fake Stripe customer id of its own (ids are unique).
+    """
+
+    def setUp(self):
+        super(FakeStripeCustomerMixin, self).setUp()
+        patcher = mock.patch('stripe.Customer.create', side_effect=self.fake_stripe_customer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fake_stripe_customer(self, **kwargs):
+        return mock.Mock(id='cus_%s' % kwargs['metadata']['user_id'])
+
+
+class ParkingFixturesMixin(FakeStripeCustomerMixin):
+    """
+    Builders of the users, parking spaces, availabilities and reservations
+    most tests start from. Every user gets a customer (and a host if asked)
+    and unique contact details.
+    """
+
+    def setUp(self):
+        super(ParkingFixturesMixin, self).setUp()
+        self.fixture_count = 0
+
+    def create_user(self, host=False, **fields):
+        from accounts.models import Host, User
+
+        self.fixture_count += 1
+        fields.setdefault('email', 'user%s@curbdparking.com' % self.fixture_count)
+        fields.setdefault('phone_number', '555%s' % self.fixture_count)
+        fields.setdefault('first_name', 'F')
+        fields.setdefault('last_name', 'L')
+        user = User.objects.create(**fields)
+        if host:
+            Host.objects.create(user=user)
+        return user
+
+    def create_parking_space(self, user, **fields):
+        from parking.models import ParkingSpace
+
+        self.fixture_count += 1
+        defaults = {
+            'latitude': 34.05, 'longitude': -118.25, 'size': 3, 'name': 'Space %s' % self.fixture_count,
+            'physical_type': 'Driveway', 'legal_type': 'Residential', 'is_active': True,
+        }
+        defaults.update(fields)
+        return ParkingSpace.objects.create(host=user.host, **defaults)
+
+    def create_fixed_availability(self, parking_space, start_datetime, end_datetime, pricing=200):
+        from parking.models import FixedAvailability
+
+        return FixedAvailability.objects.create(
+            parking_space=parking_space, start_datetime=start_datetime, end_datetime=end_datetime, pricing=pricing)
+
+    def create_vehicle(self, user, size=2):
+        from accounts.models import Vehicle
+
+        self.fixture_count += 1
+        return Vehicle.objects.create(
+            customer=user.customer, color='Red', year='2010', make='Honda', model='Civic', size=size,
+            license_plate='PLATE%s' % self.fixture_count)
+
+    def reserve(self, vehicle, availability, start_datetime, end_datetime, **fields):
+        from parking.models import FixedAvailability, Reservation
+
+        if isinstance(availability, FixedAvailability):
+            fields['fixed_availability'] = availability
+        else:
+            fields['repeating_availability'] = availability
+        return Reservation.objects.create(
+            vehicle=vehicle, start_datetime=start_datetime, end_datetime=end_datetime, **fields)
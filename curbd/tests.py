@@ -0,0 +1,264 @@
+import json
+import shutil
+import tempfile
+import time
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+
+from accounts.models import User
+from . import clients, metrics, routers
+from .middleware import ReplicaRoutingMiddleware
+from .testing import ParkingFixturesMixin
+
+
+def observed(metric, **labels):
+    """
+    How many values a histogram of the process registry has observed.
+    """
+    histogram = metrics.registry.histograms.get((metric, tuple(sorted(labels.items()))))
+    return histogram.count if histogram is not None else 0
+
+
+class RegistryTests(SimpleTestCase):
+
+    def test_render(self):
+        registry = metrics.Registry()
+        for value in (0.003, 0.02, 20):
+            registry.observe('curbd_duration_seconds', value, buckets=(0.01, 0.1), name='say "hi"')
+
+        self.assertEqual(registry.render().splitlines(), [
+            '# HELP curbd_duration_seconds Wall time of each request, by name.',
+            '# TYPE curbd_duration_seconds histogram',
+            'curbd_duration_seconds_bucket{name="say \\"hi\\"",le="0.01"} 1',
+            'curbd_duration_seconds_bucket{name="say \\"hi\\"",le="0.1"} 2',
+            'curbd_duration_seconds_bucket{name="say \\"hi\\"",le="+Inf"} 3',
+            'curbd_duration_seconds_sum{name="say \\"hi\\""} 20.023',
+            'curbd_duration_seconds_count{name="say \\"hi\\""} 3',
+        ])
+
+
+class InstrumentTests(ParkingFixturesMixin, TestCase):
+
+    def test_scope_records_queries_and_components(self):
+        with metrics.instrument('test:scope') as scope:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            with metrics.timed('stripe'):
+                pass
+
+        self.assertEqual(scope.query_count, 1)
+        self.assertEqual(set(scope.components), {'sql', 'stripe'})
+        self.assertEqual(observed('curbd_sql_queries', name='test:scope'), 1)
+        self.assertEqual(observed('curbd_component_seconds', name='test:scope', component='stripe'), 1)
+
+    def test_requests_are_recorded_by_url_name(self):
+        staff = self.create_user(is_staff=True)
+        self.client.force_login(staff)
+        before = observed('curbd_duration_seconds', name='user-list')
+
+        response = self.client.get(reverse('user-list'))
+
+        self.assertEqual(observed('curbd_duration_seconds', name='user-list'), before + 1)
+        self.assertIn('sql;dur=', response['Server-Timing'])
+
+    def test_server_timing_is_only_sent_to_staff(self):
+        self.client.force_login(self.create_user())
+        self.assertNotIn('Server-Timing', self.client.get(reverse('customer-self-detail')))
+
+    def test_streamed_responses_are_recorded_once_sent(self):
+        self.client.force_login(self.create_user())
+        before = observed('curbd_duration_seconds', name='reservation-export')
+
+        response = self.client.get(reverse('reservation-export', args=['csv']))
+        self.assertEqual(observed('curbd_duration_seconds', name='reservation-export'), before)
+
+        b''.join(response.streaming_content)
+        self.assertEqual(observed('curbd_duration_seconds', name='reservation-export'), before + 1)
+
+    def test_commands_are_recorded_and_pushed(self):
+        before = observed('curbd_duration_seconds', name='command:region_report')
+
+        with override_settings(METRICS_PUSHGATEWAY_URL='http://pushgateway:9091/'), \
+                mock.patch('requests.put') as put:
+            call_command('region_report', stdout=StringIO())
+
+        self.assertEqual(observed('curbd_duration_seconds', name='command:region_report'), before + 1)
+        url = put.call_args[0][0]
+        self.assertEqual(url, 'http://pushgateway:9091/metrics/job/curbd/command/region_report')
+        self.assertIn(b'name="command:region_report"', put.call_args[1]['data'])
+
+
+@override_settings(METRICS_TOKEN='secret')
+class MetricsEndpointTests(ParkingFixturesMixin, TestCase):
+
+    def test_anonymous_clients_are_refused(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+
+    def test_scraper_token(self):
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer other').status_code, 403)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_no_token_is_configured(self):
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+
+    def test_staff(self):
+        self.client.force_login(self.create_user(is_staff=True))
+        response = self.client.get(reverse('metrics'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'# TYPE curbd_duration_seconds histogram', response.content)
+
+
+@mock.patch('curbd.routers.usable_replicas', return_value=['replica1'])
+class ReplicaRouterTests(SimpleTestCase):
+
+    def setUp(self):
+        self.router = routers.ReplicaRouter()
+
+    def test_reads_use_the_primary_outside_replica_reads(self, usable_replicas):
+        self.assertEqual(self.router.db_for_read(User), 'default')
+
+    def test_reads_use_the_replica_inside_replica_reads(self, usable_replicas):
+        with routers.replica_reads():
+            self.assertEqual(self.router.db_for_read(User), 'replica1')
+        self.assertEqual(self.router.db_for_read(User), 'default')
+
+    def test_credentials_are_read_from_the_primary(self, usable_replicas):
+        with routers.replica_reads():
+            self.assertEqual(self.router.db_for_read(Token), 'default')
+
+    def test_related_objects_come_from_their_instance_database(self, usable_replicas):
+        user = User()
+        user._state.db = 'default'
+        with routers.replica_reads():
+            self.assertEqual(self.router.db_for_read(Token, instance=user), 'default')
+
+    def test_writes_pin_the_rest_of_the_block_to_the_primary(self, usable_replicas):
+        with routers.replica_reads():
+            self.assertEqual(self.router.db_for_write(User), 'default')
+            self.assertEqual(self.router.db_for_read(User), 'default')
+
+    def test_only_the_primary_is_migrated(self, usable_replicas):
+        self.assertTrue(self.router.allow_migrate('default', 'accounts'))
+        self.assertFalse(self.router.allow_migrate('replica1', 'accounts'))
+
+
+class UsableReplicasTests(SimpleTestCase):
+
+    @override_settings(DATABASE_REPLICAS=['replica1', 'replica2'])
+    def test_replicas_at_the_primary_address_are_skipped(self):
+        addresses = {
+            'default': ('db', 5432, 'curbd'),
+            'replica1': ('db', 5432, 'curbd'),
+            'replica2': ('db-replica', 5432, 'curbd'),
+        }
+        with mock.patch('curbd.routers.database_address', side_effect=addresses.get):
+            self.assertEqual(routers.usable_replicas(), ['replica2'])
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'], REPLICA_PIN_SECONDS=5)
+@mock.patch('curbd.routers.usable_replicas', return_value=['replica1'])
+class ReplicaRoutingMiddlewareTests(SimpleTestCase):
+
+    def setUp(self):
+        # pins have to be shared between workers, which the local memory cache isn't
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        cache_settings = override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': cache_dir}})
+        cache_settings.enable()
+        self.addCleanup(cache_settings.disable)
+
+        self.databases = []
+        self.middleware = ReplicaRoutingMiddleware(self.get_response)
+        self.factory = RequestFactory()
+
+    def get_response(self, request):
+        self.databases.append(routers.ReplicaRouter().db_for_read(User))
+        return HttpResponse()
+
+    def test_safe_requests_read_from_a_replica(self, usable_replicas):
+        self.middleware(self.factory.get('/', HTTP_AUTHORIZATION='Token a'))
+        self.assertEqual(self.databases, ['replica1'])
+
+    def test_clients_are_pinned_to_the_primary_after_writing(self, usable_replicas):
+        self.middleware(self.factory.post('/', HTTP_AUTHORIZATION='Token a'))
+        self.middleware(self.factory.get('/', HTTP_AUTHORIZATION='Token a'))
+        self.middleware(self.factory.get('/', HTTP_AUTHORIZATION='Token b'))
+
+        self.assertEqual(self.databases, ['default', 'default', 'replica1'])
+
+    def test_anonymous_writes_pin_nobody(self, usable_replicas):
+        self.middleware(self.factory.post('/'))
+        self.middleware(self.factory.get('/'))
+
+        self.assertEqual(self.databases, ['default', 'replica1'])
+
+    def test_local_memory_cache_is_refused(self, usable_replicas):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            with self.assertRaises(ImproperlyConfigured):
+                ReplicaRoutingMiddleware(self.get_response)
+
+
+class StripeClientTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.client = clients.StripeClient()
+
+    def fake_ephemeral_key(self, expires_in):
+        key = {'id': 'ephkey_1', 'secret': 'ek_test', 'expires': int(time.time()) + expires_in}
+        return mock.patch.object(clients.StripeClient, 'call', return_value=json.dumps(key))
+
+    def test_ephemeral_keys_are_reused(self):
+        with self.fake_ephemeral_key(3600) as call:
+            key = self.client.ephemeral_key('cus_1', '2018-05-21')
+            self.assertEqual(self.client.ephemeral_key('cus_1', '2018-05-21'), key)
+            self.client.ephemeral_key('cus_1', '2018-08-23')
+            self.client.ephemeral_key('cus_2', '2018-05-21')
+
+        self.assertEqual(call.call_count, 3)
+        call.assert_any_call('EphemeralKey.create', customer='cus_1', stripe_version='2018-05-21')
+
+    def test_ephemeral_keys_are_reused_until_shortly_before_they_expire(self):
+        with self.fake_ephemeral_key(3600), mock.patch.object(clients, 'cache') as fake_cache:
+            fake_cache.get.return_value = None
+            self.client.ephemeral_key('cus_1', '2018-05-21')
+
+        (_, _, ttl), _ = fake_cache.set.call_args
+        self.assertAlmostEqual(ttl, 3600 - clients.EPHEMERAL_KEY_MIN_TTL, delta=2)
+
+    def test_keys_about_to_expire_are_not_cached(self):
+        with self.fake_ephemeral_key(clients.EPHEMERAL_KEY_MIN_TTL - 10) as call:
+            self.client.ephemeral_key('cus_1', '2018-05-21')
+            self.client.ephemeral_key('cus_1', '2018-05-21')
+
+        self.assertEqual(call.call_count, 2)
+
+    def test_timeout_is_per_call(self):
+        http_client = clients.stripe_http_client()
+        # set by the stripe library, and ignored
+        http_client._timeout = 80
+        fake_stripe = mock.Mock()
+        fake_stripe.Customer.create.side_effect = lambda **params: http_client._timeout
+        before = observed('curbd_stripe_seconds', operation='Customer.create')
+
+        with mock.patch.object(clients.StripeClient, 'stripe', fake_stripe):
+            self.assertEqual(self.client.call('Customer.create', timeout=3, email='a@b.c'), 3)
+            self.assertEqual(self.client.call('Customer.create'), settings.STRIPE_TIMEOUT)
+
+        self.assertEqual(http_client._timeout, settings.STRIPE_TIMEOUT)
+        fake_stripe.Customer.create.assert_any_call(email='a@b.c')
+        self.assertEqual(observed('curbd_stripe_seconds', operation='Customer.create'), before + 2)
@@ -1,11 +1,32 @@
 from django.contrib import admin
 
+from curbd.admin import ScalableModelAdmin
 from .models import ParkingSpace, ParkingSpaceImage, FixedAvailability, RepeatingAvailability, Reservation
 
 
-class FixedAvailabilityAdmin(admin.ModelAdmin):
+class ParkingSpaceAdmin(ScalableModelAdmin, admin.ModelAdmin):
+    list_display = ('name', 'host', 'region', 'size', 'available_spaces', 'is_active', 'created_at')
+    list_select_related = ('host__user',)
+    list_filter = ('is_active', 'region')
+    raw_id_fields = ('host', 'address')
+    date_hierarchy = 'created_at'
+    indexed_search_fields = ('host__user__email',)
+
+
+class ParkingSpaceImageAdmin(ScalableModelAdmin, admin.ModelAdmin):
+    list_display = ('__str__', 'parking_space')
+    list_select_related = ('parking_space',)
+    raw_id_fields = ('parking_space',)
+    indexed_id_search_fields = ('parking_space',)
+
+
+class FixedAvailabilityAdmin(ScalableModelAdmin, admin.ModelAdmin):
     list_display = ('parking_space', 'get_start', 'get_end', 'get_pricing')
+    list_select_related = ('parking_space',)
+    raw_id_fields = ('parking_space',)
+    date_hierarchy = 'start_datetime'
     ordering = ('start_datetime',)
+    indexed_id_search_fields = ('parking_space',)
 
     def get_start(self, obj):
         return obj.start_datetime
@@ -20,16 +41,35 @@ class FixedAvailabilityAdmin(admin.ModelAdmin):
     get_pricing.short_description = 'price'
 
 
-class RepeatingAvailabilityAdmin(admin.ModelAdmin):
+class RepeatingAvailabilityAdmin(ScalableModelAdmin, admin.ModelAdmin):
     list_display = ('parking_space', 'all_day', 'start_time', 'end_time', 'repeating_days', 'get_pricing')
+    list_select_related = ('parking_space',)
+    raw_id_fields = ('parking_space',)
+    date_hierarchy = 'created_at'
+    indexed_id_search_fields = ('parking_space',)
 
     def get_pricing(self, obj):
         return '$' + str(obj.pricing/100) + ' / hr'
     get_pricing.short_description = 'price'
 
 
-admin.site.register(ParkingSpace)
-admin.site.register(ParkingSpaceImage)
+class ReservationAdmin(ScalableModelAdmin, admin.ModelAdmin):
+    list_display = ('__str__', 'parking_space', 'cost', 'host_income', 'cancelled', 'paid_out')
+    list_select_related = ('vehicle', 'parking_space')
+    list_filter = ('cancelled', 'paid_out')
+    raw_id_fields = ('vehicle', 'fixed_availability', 'repeating_availability', 'parking_space')
+    # end_datetime is the partition key, so drilling down prunes partitions
+    date_hierarchy = 'end_datetime'
+    indexed_id_search_fields = ('parking_space',)
+    indexed_search_fields = ('vehicle__license_plate',)
+
+    def get_search_results(self, request, queryset, search_term):
+        # license plates are stored upper case
+        return super(ReservationAdmin, self).get_search_results(request, queryset, search_term.upper())
+
+
+admin.site.register(ParkingSpace, ParkingSpaceAdmin)
+admin.site.register(ParkingSpaceImage, ParkingSpaceImageAdmin)
 admin.site.register(FixedAvailability, FixedAvailabilityAdmin)
 admin.site.register(RepeatingAvailability, RepeatingAvailabilityAdmin)
-admin.site.register(Reservation)
+admin.site.register(Reservation, ReservationAdmin)
@@ -2,9 +2,10 @@ import dateutil.parser
 from django.db.models.query import Q
 from rest_framework import filters
 from rest_framework.exceptions import ValidationError
-from timezonefinder import TimezoneFinder
 import pytz
 
+from curbd.clients import timezone_finder
+from curbd.metrics import timed
 from .helpers import lat_degrees_from_miles, long_degrees_from_miles_at_lat
 
 
@@ -69,15 +70,16 @@ class LocationAndTimeAvailableFilter(filters.BaseFilterBackend):
             if start_datetime >= end_datetime:
                 raise ValidationError("end must be a later date than start")
 
-            tf = TimezoneFinder()
-
             median_lat = (float(bottom_left_lat) + float(top_right_lat)) / 2
             median_lng = (float(bottom_left_long) + float(top_right_long)) / 2
 
-            timezone_name = tf.timezone_at(lat=median_lat, lng=median_lng)
+            with timed('timezonefinder'):
+                tf = timezone_finder()
+
+                timezone_name = tf.timezone_at(lat=median_lat, lng=median_lng)
 
-            if timezone_name is None:
-                timezone_name = tf.closest_timezone_at(lng=median_lat, lat=median_lng)
+                if timezone_name is None:
+                    timezone_name = tf.closest_timezone_at(lng=median_lat, lat=median_lng)
 
             if timezone_name is not None:
                 try:
@@ -1,5 +1,7 @@
 from rest_framework import permissions
 
+from api.general_permissions import is_request_user
+
 
 class IsAdminOrIsParkingSpaceOwnerOrReadOnly(permissions.BasePermission):
     """
@@ -11,7 +13,7 @@ class IsAdminOrIsParkingSpaceOwnerOrReadOnly(permissions.BasePermission):
         if request.method in permissions.SAFE_METHODS:
             return True
 
-        return request.user.is_superuser or obj.host.user == request.user
+        return request.user.is_superuser or is_request_user(request, obj.host_id)
 
 
 class IsHostOrReadOnly(permissions.BasePermission):
@@ -51,7 +53,7 @@ class IsAdminOrIsOwnerOfParkingSpaceOfAvailabilityOrReadOnly(permissions.BasePer
         if request.method in permissions.SAFE_METHODS:
             return True
 
-        return request.user.is_superuser or obj.parking_space.host.user == request.user
+        return request.user.is_superuser or is_request_user(request, obj.parking_space.host_id)
 
 
 class IsAdminOrIsReservationOwnerOrReadOnly(permissions.BasePermission):
@@ -64,7 +66,7 @@ class IsAdminOrIsReservationOwnerOrReadOnly(permissions.BasePermission):
         if request.method in permissions.SAFE_METHODS:
             return True
 
-        return request.user.is_superuser or obj.vehicle.customer.user == request.user
+        return request.user.is_superuser or is_request_user(request, obj.vehicle.customer_id)
 
 
 class IsCustomerOrReadOnly(permissions.BasePermission):
@@ -79,3 +81,12 @@ class IsCustomerOrReadOnly(permissions.BasePermission):
             return request.user.is_customer()
         except AttributeError:  # 'AnonymousUser' object has no attribute 'is_customer'
             return False
+
+
+class IsStaffOrIsParkingSpaceOwner(permissions.BasePermission):
+    """
+    Custom permission to only allow staff or the parking space owner to
+    access the parking space, even for reading
+    """
+    def has_object_permission(self, request, view, obj):
+        return request.user.is_staff or is_request_user(request, obj.host_id)
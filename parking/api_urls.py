@@ -6,8 +6,11 @@ from . import api_views
 urlpatterns = [
     path('spaces/', api_views.ParkingSpaceList.as_view(), name='parkingspace-list'),
     path('spaces/search/', api_views.ParkingSpaceSearch.as_view(), name='parkingspace=search'),
+    path('spaces/search/stream/', api_views.ParkingSpaceVacancyStream.as_view(), name='parkingspace-vacancy-stream'),
+    path('spaces/availability/', api_views.ParkingSpaceAvailabilityBatch.as_view(), name='parkingspace-availability-batch'),
     path('spaces/<int:pk>/', api_views.ParkingSpaceDetail.as_view(), name='parkingspace-detail'),
     path('spaces/<int:pk>/availability/', api_views.ParkingSpaceAvailability.as_view(), name='parkingspace-availability'),
+    path('spaces/<int:pk>/calendar/', api_views.ParkingSpaceCalendar.as_view(), name='parkingspace-calendar'),
     path('spaces/<int:pk>/repeatingavailabilities/', api_views.ParkingSpaceRepeatingAvailabilities.as_view(),
          name='parkingspace-repeatingavailabilities'),
     path('spaces/<int:pk>/fixedavailabilities/', api_views.ParkingSpaceFixedAvailabilities.as_view(),
@@ -26,9 +29,12 @@ urlpatterns = [
     path('repeatingavailabilities/<int:pk>/', api_views.RepeatingAvailabilityDetail.as_view(), name='repeatingavailability-detail'),
 
     path('reservations/', api_views.ReservationList.as_view(), name='reservation-list'),
+    path('reservations/export/<str:export_format>/', api_views.ReservationExport.as_view(),
+         name='reservation-export'),
     path('reservations/<int:pk>/', api_views.ReservationDetail.as_view(), name='reservation-detail'),
     path('reservations/<int:pk>/report/', api_views.ReservationReport.as_view(), name='reservation-report'),
     path('reservations/<int:pk>/cancel/', api_views.ReservationCancel.as_view(), name='reservation-cancel'),
-    # path('reservations/<int:pk>/extend/', api_views.ReservationExtend.as_view(), name='reservation-extend'),
+    path('reservations/<int:pk>/extend/', api_views.ReservationExtend.as_view(), name='reservation-extend'),
+    path('reservations/<int:pk>/rate/', api_views.ReservationRate.as_view(), name='reservation-rate'),
 
 ]
\ No newline at end of file
@@ -1,43 +1,65 @@
 import calendar
 import datetime
+import json
 import pytz
+import queue
+import time
 import dateutil.parser
 
 from decouple import config
-from timezonefinder import TimezoneFinder
 
-from django.core.exceptions import ObjectDoesNotExist
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist, ValidationError as ModelValidationError
 from django.core.mail import send_mail
-from django.db.models import Q
-from django.http import Http404
+from django.db.models import Count, Q, prefetch_related_objects
+from django.http import Http404, StreamingHttpResponse
+from django.utils import timezone
 from django.utils.datastructures import MultiValueDictKeyError
 
-from rest_framework import generics, status
+from rest_framework import filters, generics, permissions, status
 from rest_framework.exceptions import ValidationError
 from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from api.general_mixins import (
+    ConditionalListMixin, ConditionalRetrieveMixin, DeltaSyncMixin, PlannedQuerysetMixin, SparseQuerysetMixin,
+    SyncTokenExpired)
+from api.renderers import EventStreamRenderer, MessagePackRenderer
+from curbd.clients import timezone_finder
+from curbd.metrics import timed
+from curbd.sync import InvalidSyncToken, SyncToken
 from .api_permissions import (
     IsAdminOrIsParkingSpaceOwnerOrReadOnly, IsHostOrReadOnly,
     IsAdminOrIsOwnerOfParkingSpaceOfAvailabilityOrReadOnly,
     IsAdminOrIsReservationOwnerOrReadOnly, IsCustomerOrReadOnly,
-    IsAuthenticatedOrReadOnly)
+    IsAuthenticatedOrReadOnly, IsStaffOrIsParkingSpaceOwner)
 from .api_filters import IsActiveFilter, LocationAndTimeAvailableFilter, MinVehicleSizeFilter
-from .helpers import lat_degrees_from_miles, long_degrees_from_miles_at_lat, get_weekday_span_between
-from .models import ParkingSpace, ParkingSpaceImage, FixedAvailability, RepeatingAvailability, Reservation
+from .exports import export_lines, export_queryset, export_rows
+from .helpers import haversine_miles, lat_degrees_from_miles, long_degrees_from_miles_at_lat, get_weekday_span_between
+from .models import (
+    ParkingSpace, ParkingSpaceImage, FixedAvailability, RepeatingAvailability, Reservation, ParkingSpaceRating)
+from .ranking import SORTS as SEARCH_SORTS, Candidate, top_results
+from .regions import regions_in_box
+from .schedule import calendar_events
+from .vacancy import SubscribedStream, Subscription, bus as vacancy_bus
 from .serializers import (
     ParkingSpaceSerializer, FixedAvailabilitySerializer,
-    RepeatingAvailabilitySerializer, ReservationSerializer, ParkingSpaceMinimalSerializer)
+    RepeatingAvailabilitySerializer, ReservationSerializer, ParkingSpaceMinimalSerializer,
+    search_result_columns)
 from accounts.models import Host, Address
 from payment.helpers import calculate_customer_price
 
 
-class ParkingSpaceList(generics.ListCreateAPIView):
-    queryset = ParkingSpace.objects.all().order_by('-created_at')
+class ParkingSpaceList(SparseQuerysetMixin, generics.ListCreateAPIView):
+    queryset = ParkingSpace.objects.annotate(
+        average_rating=ParkingSpace.average_rating_ordering()).order_by('-created_at')
     serializer_class = ParkingSpaceSerializer
     permission_classes = (IsAuthenticatedOrReadOnly,)
-    filter_backends = (IsActiveFilter, MinVehicleSizeFilter, LocationAndTimeAvailableFilter)
+    filter_backends = (IsActiveFilter, MinVehicleSizeFilter, LocationAndTimeAvailableFilter, filters.OrderingFilter)
+    ordering_fields = ('created_at', 'average_rating', 'rating_count')
     parser_classes = (MultiPartParser, FormParser,)
 
     def perform_create(self, serializer):
@@ -75,8 +97,88 @@ class ParkingSpaceList(generics.ListCreateAPIView):
         return parking_space
 
 
+def search_box(bottom_left_lat, bottom_left_long, top_right_lat, top_right_long):
+    """
+    The bounding box of a map search, reduced around its center if it's
+    larger than the maximum search radius.
+    :return: (bottom_left_lat, bottom_left_long, top_right_lat, top_right_long)
+    """
+    max_search_radius = 6  # in miles
+
+    bottom_left_lat = float(bottom_left_lat)
+    bottom_left_long = float(bottom_left_long)
+    top_right_lat = float(top_right_lat)
+    top_right_long = float(top_right_long)
+
+    center_lat = (bottom_left_lat + top_right_lat) / 2.0
+    center_long = (bottom_left_long + top_right_long) / 2.0
+
+    max_lat_degrees_distance = lat_degrees_from_miles(max_search_radius)
+    if max_lat_degrees_distance < abs(top_right_lat - center_lat):
+        top_right_lat = center_lat + max_lat_degrees_distance
+        bottom_left_lat = center_lat - max_lat_degrees_distance
+
+    max_long_degrees_distance = long_degrees_from_miles_at_lat(max_search_radius, center_lat)
+    if max_long_degrees_distance < abs(top_right_long - center_long):
+        top_right_long = center_long + max_long_degrees_distance
+        bottom_left_long = center_long - max_long_degrees_distance
+
+    return bottom_left_lat, bottom_left_long, top_right_lat, top_right_long
+
+
+def search_window(start_datetime_iso, end_datetime_iso, center_lat, center_long):
+    """
+    The time window of a map search. The times are read in the timezone of
+    the map's center, falling back to the timezone that came with them.
+    :return: (start_datetime, end_datetime)
+    """
+    start_datetime = dateutil.parser.parse(start_datetime_iso)
+    end_datetime = dateutil.parser.parse(end_datetime_iso)
+
+    if start_datetime.tzinfo is None or end_datetime.tzinfo is None:
+        raise ValidationError("Timezone must be provided")
+
+    if start_datetime >= end_datetime:
+        raise ValidationError("end must be a later date than start")
+
+    with timed('timezonefinder'):
+        tf = timezone_finder()
+
+        timezone_name = tf.timezone_at(lat=center_lat, lng=center_long)
+
+        if timezone_name is None:
+            timezone_name = tf.closest_timezone_at(lat=center_lat, lng=center_long)
+
+    if timezone_name is not None:
+        try:
+            tz = pytz.timezone(timezone_name)
+        except pytz.exceptions.UnknownTimeZoneError:
+            # fall back to the timezone that came with the request
+            pass
+        else:
+            naive_start_datetime = start_datetime.replace(tzinfo=None)
+            naive_end_datetime = end_datetime.replace(tzinfo=None)
+
+            start_datetime = tz.localize(naive_start_datetime)
+            end_datetime = tz.localize(naive_end_datetime)
+
+    return start_datetime, end_datetime
+
+
 class ParkingSpaceSearch(APIView):
+    """
+    Parking spaces available in a bounding box for a time window, ranked by
+    `sort`. Results carry a `sync_token`: searching the same box and window
+    again with ?since=<token> returns only the parking spaces whose results
+    may have changed since then, and in `removed` the ids of those that are
+    no longer available.
+    """
     queryset = ParkingSpace.objects.all()
+    # Accept: application/x-msgpack (or ?format=msgpack) selects the compact columnar results
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [MessagePackRenderer]
+    default_limit = 50
+    max_limit = 500
+    sync_limit = 1000
 
     def get(self, request):
         bottom_left_lat = request.query_params.get('bl_lat', None)
@@ -86,58 +188,59 @@ class ParkingSpaceSearch(APIView):
         start_datetime_iso = request.query_params.get('start', None)
         end_datetime_iso = request.query_params.get('end', None)
         min_vehicle_size = request.query_params.get('size', None)
+        sort = request.query_params.get('sort', 'score')
+        limit = request.query_params.get('limit', self.default_limit)
+        origin_lat = request.query_params.get('lat', None)
+        origin_long = request.query_params.get('long', None)
+        since = request.query_params.get('since', None)
 
-        """PRE-PROCESS INPUTS"""
-        # first we need to reduce the box size if it's too large
-        max_search_radius = 6  # in miles
-
-        bottom_left_lat = float(bottom_left_lat)
-        bottom_left_long = float(bottom_left_long)
-        top_right_lat = float(top_right_lat)
-        top_right_long = float(top_right_long)
-
-        center_lat = (bottom_left_lat + top_right_lat) / 2.0
-        center_long = (bottom_left_long + top_right_long) / 2.0
-
-        max_lat_degrees_distance = lat_degrees_from_miles(max_search_radius)
-        if max_lat_degrees_distance < abs(top_right_lat - center_lat):
-            top_right_lat = center_lat + max_lat_degrees_distance
-            bottom_left_lat = center_lat - max_lat_degrees_distance
+        if sort not in SEARCH_SORTS:
+            raise ValidationError("sort must be one of: %s" % ", ".join(SEARCH_SORTS))
 
-        max_long_degrees_distance = long_degrees_from_miles_at_lat(max_search_radius, center_lat)
-        if max_long_degrees_distance < abs(top_right_long - center_long):
-            top_right_long = center_long + max_long_degrees_distance
-            bottom_left_long = center_long - max_long_degrees_distance
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ValidationError("limit must be an integer")
 
-        # adjust input datetimes for map timezone
-        start_datetime = dateutil.parser.parse(start_datetime_iso)
-        end_datetime = dateutil.parser.parse(end_datetime_iso)
+        if not 0 < limit <= self.max_limit:
+            raise ValidationError("limit must be between 1 and %d" % self.max_limit)
 
-        if start_datetime.tzinfo is None or end_datetime.tzinfo is None:
-            raise ValidationError("Timezone must be provided")
+        if since is not None:
+            try:
+                since = SyncToken.decode(since)
+            except InvalidSyncToken:
+                raise ValidationError({'since': "Invalid sync token"})
 
-        if start_datetime >= end_datetime:
-            raise ValidationError("end must be a later date than start")
+        """PRE-PROCESS INPUTS"""
+        bottom_left_lat, bottom_left_long, top_right_lat, top_right_long = search_box(
+            bottom_left_lat, bottom_left_long, top_right_lat, top_right_long)
 
-        tf = TimezoneFinder()
+        center_lat = (bottom_left_lat + top_right_lat) / 2.0
+        center_long = (bottom_left_long + top_right_long) / 2.0
 
-        timezone_name = tf.timezone_at(lat=center_lat, lng=center_long)
+        # distances are measured from the user's location when it's given
+        if origin_lat is not None and origin_long is not None:
+            try:
+                origin = (float(origin_lat), float(origin_long))
+            except ValueError:
+                raise ValidationError("lat and long must be numbers")
+        else:
+            origin = (center_lat, center_long)
 
-        if timezone_name is None:
-            timezone_name = tf.closest_timezone_at(lat=center_lat, lng=center_long)
+        # the box is small enough to touch at most a few regions
+        regions = regions_in_box(bottom_left_lat, bottom_left_long, top_right_lat, top_right_long)
 
-        if timezone_name is not None:
-            try:
-                tz = pytz.timezone(timezone_name)
-            except pytz.exceptions.UnknownTimeZoneError:
-                # fall back to the timezone that came with the request
-                pass
-            else:
-                naive_start_datetime = start_datetime.replace(tzinfo=None)
-                naive_end_datetime = end_datetime.replace(tzinfo=None)
+        start_datetime, end_datetime = search_window(start_datetime_iso, end_datetime_iso, center_lat, center_long)
 
-                start_datetime = tz.localize(naive_start_datetime)
-                end_datetime = tz.localize(naive_end_datetime)
+        # sequence numbers are per database (the results may come from a replica), see curbd.sync
+        database = ParkingSpace.objects.db
+        token = SyncToken.current(database)
+        if since is not None:
+            changed_ids = self.changed_parking_space_ids(
+                since, database, regions, bottom_left_lat, bottom_left_long, top_right_lat, top_right_long,
+                start_datetime, end_datetime)
+            # every changed parking space is sent, ranked
+            limit = self.sync_limit
 
         """QUERY AVAILABLE PARKING SPACES"""
         # determine the day of the week the user is searching for
@@ -149,6 +252,7 @@ class ParkingSpaceSearch(APIView):
                 (
                     Q(parking_space__deleted_at=None) &
                     Q(parking_space__is_active=True) &
+                    Q(parking_space__region__in=regions) &
                     Q(parking_space__longitude__gte=bottom_left_long) &
                     Q(parking_space__longitude__lte=top_right_long) &
                     Q(parking_space__latitude__gte=bottom_left_lat) &
@@ -172,6 +276,7 @@ class ParkingSpaceSearch(APIView):
                 (
                     Q(parking_space__deleted_at=None) &
                     Q(parking_space__is_active=True) &
+                    Q(parking_space__region__in=regions) &
                     Q(parking_space__longitude__gte=bottom_left_long) &
                     Q(parking_space__longitude__lte=top_right_long) &
                     Q(parking_space__latitude__gte=bottom_left_lat) &
@@ -187,6 +292,7 @@ class ParkingSpaceSearch(APIView):
             (
                 Q(parking_space__deleted_at=None) &
                 Q(parking_space__is_active=True) &
+                Q(parking_space__region__in=regions) &
                 Q(parking_space__longitude__gte=bottom_left_long) &
                 Q(parking_space__longitude__lte=top_right_long) &
                 Q(parking_space__latitude__gte=bottom_left_lat) &
@@ -202,6 +308,10 @@ class ParkingSpaceSearch(APIView):
             repeating_availabilities = repeating_availabilities.filter(parking_space__size__gte=min_vehicle_size)
             fixed_availabilities = fixed_availabilities.filter(parking_space__size__gte=min_vehicle_size)
 
+        if since is not None:
+            repeating_availabilities = repeating_availabilities.filter(parking_space_id__in=changed_ids)
+            fixed_availabilities = fixed_availabilities.filter(parking_space_id__in=changed_ids)
+
         parking_space_ids = set()
         available_spaces_map = dict()
         parking_spaces_map = dict()
@@ -232,54 +342,182 @@ class ParkingSpaceSearch(APIView):
             if available_spaces == 0:
                 del parking_spaces_map[parking_space_id]
 
+        duration_minutes = (end_datetime - start_datetime).total_seconds() / 60.0
+        candidates = [
+            Candidate(parking_space, calculate_customer_price(pricing, duration_minutes),
+                      available_spaces_map[parking_space_id],
+                      haversine_miles(origin[0], origin[1], parking_space.latitude, parking_space.longitude))
+            for parking_space_id, (parking_space, pricing) in parking_spaces_map.items()]
+
+        # only the top `limit` matches are serialized
+        candidates = top_results(candidates, sort, limit)
+        results = [(candidate.parking_space, candidate.price) for candidate in candidates]
+
+        sync = {'sync_token': token.encode()}
+        if since is not None:
+            sync['removed'] = sorted(changed_ids - set(parking_spaces_map))
+
+        if request.accepted_renderer.format == MessagePackRenderer.format:
+            columns = search_result_columns(results)
+            columns.update(sync)
+            return Response(columns)
+
+        prefetch_related_objects([parking_space for parking_space, _ in results], 'images')
+
         parking_spaces = [
             {
                 "parking_space": ParkingSpaceMinimalSerializer(parking_space).data,
-                "price": calculate_customer_price(pricing, ((end_datetime - start_datetime).total_seconds() / 60.0))
+                "price": price,
+                "distance": round(candidate.distance, 3)
             }
-            for parking_space_id, (parking_space, pricing) in parking_spaces_map.items()]
+            for candidate, (parking_space, price) in zip(candidates, results)]
 
-        return Response({
+        return Response(dict({
             "count": len(parking_spaces),
+            "total": len(parking_spaces_map),
             "results": parking_spaces,
-        })
+        }, **sync))
+
+    def changed_parking_space_ids(self, since, database, regions, bottom_left_lat, bottom_left_long,
+                                  top_right_lat, top_right_long, start_datetime, end_datetime):
+        """
+        The parking spaces in the box whose search results may have changed
+        since a sync token: those that changed themselves (availability
+        changes touch their parking space) and those with a reservation in
+        the time window that changed.
+        """
+        parking_spaces = ParkingSpace.all_objects.using(database).filter(
+            Q(region__in=regions) &
+            Q(longitude__gte=bottom_left_long) &
+            Q(longitude__lte=top_right_long) &
+            Q(latitude__gte=bottom_left_lat) &
+            Q(latitude__lte=top_right_lat))
+
+        changed_ids = set(parking_spaces.filter(since.changed()).values_list('id', flat=True)[:self.sync_limit + 1])
+        changed_ids.update(Reservation.all_objects.using(database).filter(
+            since.changed(),
+            parking_space__in=parking_spaces,
+            start_datetime__lte=end_datetime,
+            end_datetime__gte=start_datetime).values_list('parking_space_id', flat=True)[:self.sync_limit + 1])
+
+        if len(changed_ids) > self.sync_limit:
+            raise SyncTokenExpired
+        return changed_ids
+
+
+class ParkingSpaceVacancyStream(APIView):
+    """
+    Server-sent events for map clients: subscribes to a bounding box and time
+    window (the parameters of the search) and sends a `vacancy` event with
+    the number of vacant spaces of a parking space whenever a reservation,
+    availability or the space itself changes there. Clients search once and
+    then keep their pins fresh from the stream instead of polling.
+
+    A stream ends after VACANCY_STREAM_SECONDS and EventSource reconnects.
+    Each stream holds a worker thread, so a process only serves
+    VACANCY_MAX_STREAMS of them at a time (see parking/vacancy.py). Past
+    that the answer is 503 and clients poll the search with ?since=<token>.
+    """
+    queryset = ParkingSpace.objects.all()
+    renderer_classes = [EventStreamRenderer] + api_settings.DEFAULT_RENDERER_CLASSES
 
+    def get(self, request):
+        bottom_left_lat, bottom_left_long, top_right_lat, top_right_long = search_box(
+            request.query_params.get('bl_lat', None), request.query_params.get('bl_long', None),
+            request.query_params.get('tr_lat', None), request.query_params.get('tr_long', None))
+        start_datetime, end_datetime = search_window(
+            request.query_params.get('start', None), request.query_params.get('end', None),
+            (bottom_left_lat + top_right_lat) / 2.0, (bottom_left_long + top_right_long) / 2.0)
+
+        subscription = Subscription(
+            bottom_left_lat, bottom_left_long, top_right_lat, top_right_long, start_datetime, end_datetime)
+
+        if not vacancy_bus.subscribe(subscription, limit=settings.VACANCY_MAX_STREAMS):
+            # EventSource doesn't reconnect after an error status
+            return Response({'detail': "Too many vacancy streams, poll the search instead."},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            headers={'Retry-After': settings.VACANCY_STREAM_SECONDS})
+
+        response = StreamingHttpResponse(
+            SubscribedStream(self.events(subscription), subscription, vacancy_bus), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # keeps proxies from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    def events(self, subscription):
+        yield 'retry: %d\n\n' % (settings.VACANCY_STREAM_RETRY_SECONDS * 1000)
+
+        ends = time.monotonic() + settings.VACANCY_STREAM_SECONDS
+        while time.monotonic() < ends:
+            try:
+                change = subscription.changes.get(timeout=settings.VACANCY_KEEPALIVE_SECONDS)
+            except queue.Empty:
+                # lets proxies and the client know the stream is alive
+                yield ': keepalive\n\n'
+                continue
+
+            # a burst of changes (e.g. a new availability and its space) is sent once per space
+            parking_space_ids = {change['parking_space_id']}
+            while not subscription.changes.empty():
+                parking_space_ids.add(subscription.changes.get()['parking_space_id'])
+
+            for parking_space_id, vacant_spaces in self.vacancies(subscription, parking_space_ids):
+                yield 'event: vacancy\ndata: %s\n\n' % json.dumps(
+                    {'parking_space': parking_space_id, 'vacant_spaces': vacant_spaces})
+
+    def vacancies(self, subscription, parking_space_ids):
+        parking_spaces = ParkingSpace.objects.filter(pk__in=parking_space_ids, is_active=True) \
+            .prefetch_related('fixedavailability_set', 'repeatingavailability_set').in_bulk()
+
+        for parking_space_id in sorted(parking_space_ids):
+            parking_space = parking_spaces.get(parking_space_id)
+            if parking_space is None:
+                # deleted or deactivated
+                yield parking_space_id, 0
+            else:
+                yield parking_space_id, max(parking_space.unreserved_spaces(
+                    subscription.start_datetime, subscription.end_datetime), 0)
 
-class ParkingSpaceDetail(generics.RetrieveUpdateDestroyAPIView):
+
+class ParkingSpaceDetail(ConditionalRetrieveMixin, SparseQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = ParkingSpace.objects.all()
     serializer_class = ParkingSpaceSerializer
     permission_classes = (IsAdminOrIsParkingSpaceOwnerOrReadOnly,)
 
 
-class FixedAvailabilityList(generics.ListCreateAPIView):
+class FixedAvailabilityList(SparseQuerysetMixin, generics.ListCreateAPIView):
     queryset = FixedAvailability.objects.all().order_by('-start_datetime')
     serializer_class = FixedAvailabilitySerializer
     permission_classes = (IsHostOrReadOnly,)
 
 
-class FixedAvailabilityDetail(generics.RetrieveUpdateDestroyAPIView):
+class FixedAvailabilityDetail(ConditionalRetrieveMixin, SparseQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = FixedAvailability.objects.all()
     serializer_class = FixedAvailabilitySerializer
     permission_classes = (IsAdminOrIsOwnerOfParkingSpaceOfAvailabilityOrReadOnly,)
 
 
-class RepeatingAvailabilityList(generics.ListCreateAPIView):
+class RepeatingAvailabilityList(SparseQuerysetMixin, generics.ListCreateAPIView):
     queryset = RepeatingAvailability.objects.all().order_by('-created_at')
     serializer_class = RepeatingAvailabilitySerializer
     permission_classes = (IsHostOrReadOnly,)
 
 
-class RepeatingAvailabilityDetail(generics.RetrieveUpdateDestroyAPIView):
+class RepeatingAvailabilityDetail(ConditionalRetrieveMixin, SparseQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = RepeatingAvailability.objects.all()
     serializer_class = RepeatingAvailabilitySerializer
     permission_classes = (IsAdminOrIsOwnerOfParkingSpaceOfAvailabilityOrReadOnly,)
 
 
-class ReservationList(generics.ListCreateAPIView):
+class ReservationList(DeltaSyncMixin, PlannedQuerysetMixin, generics.ListCreateAPIView):
     queryset = Reservation.objects.all().order_by('-created_at')
     serializer_class = ReservationSerializer
     permission_classes = (IsCustomerOrReadOnly,)
 
+    def get_sync_scope(self):
+        return Reservation.all_objects.all()
+
     def perform_create(self, serializer):
         parking_space = serializer.validated_data.pop('parking_space_id')
         start_datetime = serializer.validated_data['start_datetime']
@@ -287,34 +525,14 @@ class ReservationList(generics.ListCreateAPIView):
 
         try:
             fixed_availability = FixedAvailability.objects.get(
-                Q(parking_space=parking_space),
-                Q(start_datetime__lte=start_datetime),
-                Q(end_datetime__gte=end_datetime),
-            )
+                Q(parking_space=parking_space) & FixedAvailability.covering(start_datetime, end_datetime))
             # TODO: make sure this doesn't return more than one object (check for overlap when creating availabilities)
         except ObjectDoesNotExist:
             # if there is no fixed availability move on to
             # check if there is a repeating availability.
             try:
-                start_day_of_week = calendar.day_name[start_datetime.weekday()][:3]
-                end_day_of_week = calendar.day_name[end_datetime.weekday()][:3]
-
-                if start_day_of_week == end_day_of_week:
-                    repeating_availability = RepeatingAvailability.objects.get(
-                        Q(parking_space=parking_space) &
-                        (Q(all_day=True) | (Q(start_time__lte=start_datetime.time()) & Q(end_time__gte=end_datetime.time()))) &
-                        Q(repeating_days__contains=[start_day_of_week]))
-                else:
-                    if (end_datetime.day - start_datetime.day) >= 7:
-                        # make sure to include every day of the week if duration is one week or more
-                        weekdays = get_weekday_span_between('Sun', 'Sat')
-                    else:
-                        weekdays = get_weekday_span_between(start_day_of_week, end_day_of_week)
-                    repeating_availability = RepeatingAvailability.objects.get(
-                        Q(parking_space=parking_space) &
-                        Q(all_day=True) &
-                        Q(repeating_days__contains=weekdays))
-
+                repeating_availability = RepeatingAvailability.objects.get(
+                    Q(parking_space=parking_space) & RepeatingAvailability.covering(start_datetime, end_datetime))
             except ObjectDoesNotExist:
                 # neither a fixed availability nor a repeating
                 # availability exists.
@@ -327,7 +545,7 @@ class ReservationList(generics.ListCreateAPIView):
         return super(ReservationList, self).perform_create(serializer)
 
 
-class ReservationDetail(generics.RetrieveUpdateDestroyAPIView):
+class ReservationDetail(PlannedQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Reservation.objects.all()
     serializer_class = ReservationSerializer
     permission_classes = (IsAdminOrIsReservationOwnerOrReadOnly,)
@@ -346,32 +564,12 @@ class ParkingSpaceAvailability(generics.RetrieveAPIView):
         end_datetime = dateutil.parser.parse(end_datetime_iso)
 
         try:
-            start_day_of_week = calendar.day_name[start_datetime.weekday()][:3]
-            end_day_of_week = calendar.day_name[end_datetime.weekday()][:3]
-
-            if start_day_of_week == end_day_of_week:
-                RepeatingAvailability.objects.get(
-                    Q(parking_space=parking_space) &
-                    (Q(all_day=True) | (Q(start_time__lte=start_datetime.time()) & Q(end_time__gte=end_datetime.time()))) &
-                    Q(repeating_days__contains=[start_day_of_week]))
-            else:
-                if (end_datetime.day - start_datetime.day) >= 7:
-                    # make sure to include every day of the week if duration is one week or more
-                    weekdays = get_weekday_span_between('Sun', 'Sat')
-                else:
-                    weekdays = get_weekday_span_between(start_day_of_week, end_day_of_week)
-                RepeatingAvailability.objects.get(
-                    Q(parking_space=parking_space) &
-                    Q(all_day=True) &
-                    Q(repeating_days__contains=weekdays))
-
+            RepeatingAvailability.objects.get(
+                Q(parking_space=parking_space) & RepeatingAvailability.covering(start_datetime, end_datetime))
         except ObjectDoesNotExist:
             try:
                 FixedAvailability.objects.get(
-                    Q(parking_space=parking_space),
-                    Q(start_datetime__lte=start_datetime),
-                    Q(end_datetime__gte=end_datetime),
-                )
+                    Q(parking_space=parking_space) & FixedAvailability.covering(start_datetime, end_datetime))
             except ObjectDoesNotExist:
                 raise ValidationError(detail="No availabilities in given time range.")
             else:
@@ -388,36 +586,139 @@ class ParkingSpaceAvailability(generics.RetrieveAPIView):
         end_datetime = dateutil.parser.parse(end_datetime_iso)
 
         try:
-            start_day_of_week = calendar.day_name[start_datetime.weekday()][:3]
-            end_day_of_week = calendar.day_name[end_datetime.weekday()][:3]
-
-            if start_day_of_week == end_day_of_week:
-                return RepeatingAvailability.objects.get(
-                    Q(parking_space=parking_space) &
-                    (Q(all_day=True) | (Q(start_time__lte=start_datetime.time()) & Q(end_time__gte=end_datetime.time()))) &
-                    Q(repeating_days__contains=[start_day_of_week]))
-            else:
-                if (end_datetime.day - start_datetime.day) >= 7:
-                    # make sure to include every day of the week if duration is one week or more
-                    weekdays = get_weekday_span_between('Sun', 'Sat')
-                else:
-                    weekdays = get_weekday_span_between(start_day_of_week, end_day_of_week)
-                return RepeatingAvailability.objects.get(
-                    Q(parking_space=parking_space) &
-                    Q(all_day=True) &
-                    Q(repeating_days__contains=weekdays))
+            return RepeatingAvailability.objects.get(
+                Q(parking_space=parking_space) & RepeatingAvailability.covering(start_datetime, end_datetime))
         except ObjectDoesNotExist:
             try:
                 return FixedAvailability.objects.get(
-                    Q(parking_space=parking_space),
-                    Q(start_datetime__lte=start_datetime),
-                    Q(end_datetime__gte=end_datetime),
-                )
+                    Q(parking_space=parking_space) & FixedAvailability.covering(start_datetime, end_datetime))
             except ObjectDoesNotExist:
                 raise ValidationError(detail="No availabilities in given time range.")
 
 
-class ParkingSpaceRepeatingAvailabilities(generics.ListAPIView):
+class ParkingSpaceAvailabilityBatch(APIView):
+    """
+    Availability, number of vacant spaces and price of many parking spaces
+    for the same time range, e.g. every pin on the map after the time window
+    changes. Availabilities are picked with the same precedence as
+    ParkingSpaceAvailability (repeating before fixed), but with one query
+    per table for all of the parking spaces. Parking spaces without an
+    availability in the time range map to null.
+    """
+    queryset = ParkingSpace.objects.all()
+    max_parking_spaces = 200
+
+    def get(self, request):
+        try:
+            parking_space_ids = {int(pk) for pk in request.query_params['ids'].split(',') if pk.strip()}
+            start_datetime = dateutil.parser.parse(request.query_params['start'])
+            end_datetime = dateutil.parser.parse(request.query_params['end'])
+        except MultiValueDictKeyError:
+            raise ValidationError("ids, start and end must be provided")
+        except (ValueError, OverflowError):
+            raise ValidationError("ids must be comma separated integers and start and end ISO 8601 datetimes")
+
+        if start_datetime.tzinfo is None or end_datetime.tzinfo is None:
+            raise ValidationError("Timezone must be provided")
+
+        if len(parking_space_ids) > self.max_parking_spaces:
+            raise ValidationError("At most %s parking spaces can be requested at once" % self.max_parking_spaces)
+
+        if start_datetime >= end_datetime:
+            raise ValidationError("end must be a later date than start")
+
+        # fixed availabilities go first so that repeating ones, which take
+        # precedence, replace them
+        availabilities = {}
+        for availability_type, model in (('fixed', FixedAvailability), ('repeating', RepeatingAvailability)):
+            matches = model.objects.filter(
+                Q(parking_space__in=parking_space_ids) &
+                Q(parking_space__deleted_at=None) &
+                model.covering(start_datetime, end_datetime)
+            ).order_by('-pk').values('pk', 'parking_space_id', 'pricing', 'parking_space__available_spaces')
+
+            for availability in matches:
+                availabilities[availability['parking_space_id']] = (availability_type, availability)
+
+        reservation_counts = dict(Reservation.objects.filter(
+            parking_space__in=availabilities.keys(),
+            start_datetime__lte=end_datetime,
+            end_datetime__gte=start_datetime,
+            cancelled=False).order_by().values_list('parking_space_id').annotate(Count('pk')))
+
+        minutes = (end_datetime - start_datetime).total_seconds() / 60.0
+        results = {}
+
+        for parking_space_id in sorted(parking_space_ids):
+            if parking_space_id not in availabilities:
+                results[parking_space_id] = None
+                continue
+
+            availability_type, availability = availabilities[parking_space_id]
+            results[parking_space_id] = {
+                "availability_type": availability_type,
+                "availability_id": availability['pk'],
+                "vacant_spaces": max(0, availability['parking_space__available_spaces'] -
+                                     reservation_counts.get(parking_space_id, 0)),
+                "price": calculate_customer_price(availability['pricing'], minutes),
+            }
+
+        return Response({"results": results})
+
+
+class ParkingSpaceCalendar(generics.GenericAPIView):
+    """
+    The concrete schedule of a parking space between `from` and `to`:
+    repeating availabilities expanded to occurrences, fixed availabilities
+    and reservations, sorted by start. The JSON is streamed as the events
+    are generated.
+    """
+    queryset = ParkingSpace.objects.all()
+    permission_classes = (permissions.IsAuthenticated, IsStaffOrIsParkingSpaceOwner)
+    max_days = 366
+
+    def get(self, request, pk):
+        parking_space = self.get_object()
+
+        try:
+            range_start = dateutil.parser.parse(request.query_params['from'])
+            range_end = dateutil.parser.parse(request.query_params['to'])
+        except MultiValueDictKeyError:
+            raise ValidationError("from and to must be provided")
+        except (ValueError, OverflowError):
+            raise ValidationError("from and to must be ISO 8601 dates or datetimes")
+
+        if timezone.is_naive(range_start):
+            range_start = timezone.make_aware(range_start)
+        if timezone.is_naive(range_end):
+            range_end = timezone.make_aware(range_end)
+
+        if range_start >= range_end:
+            raise ValidationError("to must be a later date than from")
+
+        if range_end - range_start > datetime.timedelta(days=self.max_days):
+            raise ValidationError("The calendar can span at most %s days" % self.max_days)
+
+        return StreamingHttpResponse(
+            self.stream(parking_space, range_start, range_end), content_type='application/json')
+
+    def stream(self, parking_space, range_start, range_end):
+        encoder = JSONEncoder()
+
+        yield '{"parking_space": %s, "from": %s, "to": %s, "events": [' % (
+            parking_space.id,
+            encoder.encode(timezone.localtime(range_start)),
+            encoder.encode(timezone.localtime(range_end)))
+
+        separator = ''
+        for event in calendar_events(parking_space, range_start, range_end):
+            yield separator + encoder.encode(event)
+            separator = ','
+
+        yield ']}'
+
+
+class ParkingSpaceRepeatingAvailabilities(ConditionalListMixin, SparseQuerysetMixin, generics.ListAPIView):
     serializer_class = RepeatingAvailabilitySerializer
     permission_classes = (IsHostOrReadOnly,)
 
@@ -425,7 +726,7 @@ class ParkingSpaceRepeatingAvailabilities(generics.ListAPIView):
         return RepeatingAvailability.objects.filter(parking_space=self.kwargs['pk']).order_by('-created_at')
 
 
-class ParkingSpaceFixedAvailabilities(generics.ListAPIView):
+class ParkingSpaceFixedAvailabilities(ConditionalListMixin, SparseQuerysetMixin, generics.ListAPIView):
     serializer_class = FixedAvailabilitySerializer
     permission_classes = (IsHostOrReadOnly,)
 
@@ -433,7 +734,7 @@ class ParkingSpaceFixedAvailabilities(generics.ListAPIView):
         return FixedAvailability.objects.filter(parking_space=self.kwargs['pk']).order_by('-start_datetime')
 
 
-class ParkingSpaceFixedAvailabilitiesFuture(generics.ListAPIView):
+class ParkingSpaceFixedAvailabilitiesFuture(ConditionalListMixin, SparseQuerysetMixin, generics.ListAPIView):
     serializer_class = FixedAvailabilitySerializer
     permission_classes = (IsHostOrReadOnly,)
 
@@ -442,23 +743,89 @@ class ParkingSpaceFixedAvailabilitiesFuture(generics.ListAPIView):
             parking_space=self.kwargs['pk'], end_datetime__gte=datetime.datetime.now(pytz.utc)).order_by('-start_datetime')
 
 
-class ParkingSpaceCurrentReservations(generics.ListAPIView):
+class ParkingSpaceCurrentReservations(DeltaSyncMixin, PlannedQuerysetMixin, generics.ListAPIView):
     serializer_class = ReservationSerializer
     permission_classes = (IsHostOrReadOnly,)
+    # they move from current to previous when they end
+    sync_time_fields = ('end_datetime',)
 
     def get_queryset(self):
         return ParkingSpace.objects.get(pk=self.kwargs['pk']).reservations().filter(
             end_datetime__gte=datetime.datetime.now(pytz.utc)).order_by('start_datetime')
 
+    def get_sync_scope(self):
+        return Reservation.all_objects.filter(parking_space_id=self.kwargs['pk'])
 
-class ParkingSpacePreviousReservations(generics.ListAPIView):
+
+class ParkingSpacePreviousReservations(DeltaSyncMixin, PlannedQuerysetMixin, generics.ListAPIView):
     serializer_class = ReservationSerializer
     permission_classes = (IsHostOrReadOnly,)
+    # they move from current to previous when they end
+    sync_time_fields = ('end_datetime',)
 
     def get_queryset(self):
         return ParkingSpace.objects.get(pk=self.kwargs['pk']).reservations().filter(
             end_datetime__lt=datetime.datetime.now(pytz.utc)).order_by('-start_datetime')
 
+    def get_sync_scope(self):
+        return Reservation.all_objects.filter(parking_space_id=self.kwargs['pk'])
+
+
+class ReservationExport(APIView):
+    """
+    Reservation history as one streamed CSV or JSON lines download, filtered
+    by host, space, from/to (ISO 8601), paid_out and cancelled. Staff can
+    export any host's reservations, hosts only those of their own parking
+    spaces.
+    """
+    permission_classes = (permissions.IsAuthenticated,)
+    content_types = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+    def get(self, request, export_format):
+        if export_format not in self.content_types:
+            raise Http404
+
+        params = request.query_params
+
+        host = params.get('host', None)
+        if not request.user.is_staff:
+            host = request.user.id
+
+        try:
+            parking_space = params.get('space', None)
+            queryset = export_queryset(
+                host=int(host) if host is not None else None,
+                parking_space=int(parking_space) if parking_space is not None else None,
+                start=self.datetime_param('from'),
+                end=self.datetime_param('to'),
+                paid_out=self.boolean_param('paid_out'),
+                cancelled=self.boolean_param('cancelled'))
+        except ValueError:
+            raise ValidationError("host and space must be integers")
+
+        response = StreamingHttpResponse(
+            export_lines(export_rows(queryset), export_format), content_type=self.content_types[export_format])
+        response['Content-Disposition'] = 'attachment; filename="reservations.%s"' % export_format
+        return response
+
+    def datetime_param(self, name):
+        value = self.request.query_params.get(name, None)
+        if value is None:
+            return None
+        try:
+            value = dateutil.parser.parse(value)
+        except (ValueError, OverflowError):
+            raise ValidationError("%s must be an ISO 8601 date or datetime" % name)
+        return timezone.make_aware(value) if timezone.is_naive(value) else value
+
+    def boolean_param(self, name):
+        value = self.request.query_params.get(name, None)
+        if value is None:
+            return None
+        if value.lower() not in ('true', 'false'):
+            raise ValidationError("%s must be true or false" % name)
+        return value.lower() == 'true'
+
 
 class ReservationReport(APIView):
     queryset = Reservation.objects.all()
@@ -476,11 +843,12 @@ class ReservationReport(APIView):
         reporter = request.user
         reporter_type = request.data.get("reporter_type")
 
-        send_mail(
-            '[REPORT]',
-            "reservation id: %s,\n title: %s,\n comments: %s,\n reporter full name: %s,\n reporter id: %s,\n reporter type: %s" %
-            (reservation.id, title, comments, reporter.get_full_name(), reporter.id, reporter_type),
-            'no-reply@curbdparking.com', [config('REPORT_RECIPIENT')])
+        with timed('send_mail'):
+            send_mail(
+                '[REPORT]',
+                "reservation id: %s,\n title: %s,\n comments: %s,\n reporter full name: %s,\n reporter id: %s,\n reporter type: %s" %
+                (reservation.id, title, comments, reporter.get_full_name(), reporter.id, reporter_type),
+                'no-reply@curbdparking.com', [config('REPORT_RECIPIENT')])
 
         return Response("Success", status=status.HTTP_200_OK)
 
@@ -498,15 +866,16 @@ class ReservationCancel(APIView):
         reservation = self.get_object(pk)
 
         if reservation.start_datetime < datetime.datetime.now(pytz.utc) or \
-                reservation.vehicle.customer != request.user.customer:
+                reservation.vehicle.customer_id != request.user.id:
             return Response(status=status.HTTP_403_FORBIDDEN)
         else:
-            send_mail(
-                '[CANCELLATION]',
-                "reservation id: %s,\n reservation cost: %s,\n reservation host income: %s,\n reserver id: %s,\n reserver full name: %s" %
-                (reservation.id, reservation.cost, reservation.host_income,
-                 reservation.vehicle.customer.user.id, reservation.vehicle.customer.user.get_full_name()),
-                'no-reply@curbdparking.com', [config('CANCEL_RECIPIENT')])
+            with timed('send_mail'):
+                send_mail(
+                    '[CANCELLATION]',
+                    "reservation id: %s,\n reservation cost: %s,\n reservation host income: %s,\n reserver id: %s,\n reserver full name: %s" %
+                    (reservation.id, reservation.cost, reservation.host_income,
+                     reservation.vehicle.customer.user.id, reservation.vehicle.customer.user.get_full_name()),
+                    'no-reply@curbdparking.com', [config('CANCEL_RECIPIENT')])
 
             reservation.cancelled = True
             reservation.cost = reservation.cost // 2
@@ -519,3 +888,84 @@ class ReservationCancel(APIView):
 
             return Response("Success", status=status.HTTP_200_OK)
 
+
+class ReservationExtend(APIView):
+    queryset = Reservation.objects.all()
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get_object(self, pk):
+        try:
+            return Reservation.objects.select_related(
+                'vehicle__customer', 'fixed_availability', 'repeating_availability').get(pk=pk)
+        except Reservation.DoesNotExist:
+            raise Http404
+
+    def post(self, request, pk):
+        reservation = self.get_object(pk)
+
+        if reservation.vehicle.customer_id != request.user.id:
+            return Response(status=status.HTTP_403_FORBIDDEN)
+
+        try:
+            end_datetime = dateutil.parser.parse(request.data['end_datetime'])
+        except KeyError:
+            raise ValidationError("end_datetime must be provided")
+        except (ValueError, OverflowError):
+            raise ValidationError("end_datetime must be an ISO 8601 datetime")
+
+        if end_datetime.tzinfo is None:
+            raise ValidationError("Timezone must be provided")
+
+        if reservation.end_datetime < datetime.datetime.now(pytz.utc):
+            raise ValidationError("Reservation has already ended")
+
+        try:
+            added_cost = reservation.extend(end_datetime)
+        except ModelValidationError as e:
+            raise ValidationError(detail=e.messages)
+
+        return Response({
+            "added_cost": added_cost,
+            "reservation": ReservationSerializer(reservation, context={'request': request}).data,
+        }, status=status.HTTP_200_OK)
+
+
+class ReservationRate(APIView):
+    queryset = Reservation.objects.all()
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get_object(self, pk):
+        try:
+            return Reservation.objects.select_related('vehicle__customer').get(pk=pk)
+        except Reservation.DoesNotExist:
+            raise Http404
+
+    def post(self, request, pk):
+        reservation = self.get_object(pk)
+
+        if reservation.vehicle.customer_id != request.user.id:
+            return Response(status=status.HTTP_403_FORBIDDEN)
+
+        try:
+            value = int(request.data['value'])
+        except KeyError:
+            raise ValidationError("value must be provided")
+        except (TypeError, ValueError):
+            raise ValidationError("value must be an integer")
+
+        if not 1 <= value <= 5:
+            raise ValidationError("value must be between 1 and 5")
+
+        # rating a reservation again replaces its previous rating
+        try:
+            rating = reservation.rating
+        except ParkingSpaceRating.DoesNotExist:
+            rating = ParkingSpaceRating(reservation=reservation, parking_space_id=reservation.parking_space_id)
+        rating.value = value
+
+        try:
+            rating.save()
+        except ModelValidationError as e:
+            raise ValidationError(detail=e.messages)
+
+        return Response("Success", status=status.HTTP_200_OK)
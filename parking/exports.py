@@ -0,0 +1,104 @@
+"""
+Reservation history exports, as CSV or JSON lines.
+
+Rows are read with a server side cursor, a chunk at a time, and written
+out one line at a time, so an export of any size runs in constant memory. Both the export API
+endpoint and the export_reservations command stream these lines.
+"""
+import csv
+
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import Reservation
+
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+# (column name, Reservation lookup)
+EXPORT_COLUMNS = (
+    ('id', 'id'),
+    ('parking_space_id', 'parking_space_id'),
+    ('parking_space_name', 'parking_space__name'),
+    ('host_id', 'parking_space__host_id'),
+    ('vehicle_id', 'vehicle_id'),
+    ('customer_id', 'vehicle__customer_id'),
+    ('start_datetime', 'start_datetime'),
+    ('end_datetime', 'end_datetime'),
+    ('cost', 'cost'),
+    ('host_income', 'host_income'),
+    ('paid_out', 'paid_out'),
+    ('cancelled', 'cancelled'),
+    ('payment_method_info', 'payment_method_info'),
+    ('created_at', 'created_at'),
+)
+
+
+def export_queryset(host=None, parking_space=None, start=None, end=None, paid_out=None, cancelled=None):
+    """
+    The reservations of an export as rows of EXPORT_COLUMNS, ordered by
+    start. Filters that are None are not applied.
+    :param host: host id
+    :param parking_space: parking space id
+    :param start: aware datetime, reservations ending after it
+    :param end: aware datetime, reservations starting before it
+    :param paid_out: bool
+    :param cancelled: bool
+    """
+    reservations = Reservation.objects.all()
+
+    if host is not None:
+        reservations = reservations.filter(parking_space__host_id=host)
+    if parking_space is not None:
+        reservations = reservations.filter(parking_space_id=parking_space)
+    if start is not None:
+        reservations = reservations.filter(end_datetime__gt=start)
+    if end is not None:
+        reservations = reservations.filter(start_datetime__lt=end)
+    if paid_out is not None:
+        reservations = reservations.filter(paid_out=paid_out)
+    if cancelled is not None:
+        reservations = reservations.filter(cancelled=cancelled)
+
+    return reservations.order_by('start_datetime', 'id').values_list(*[lookup for _, lookup in EXPORT_COLUMNS])
+
+
+def export_rows(queryset, chunk_size=2000):
+    """
+    Streams the rows of an export queryset, chunk_size rows at a time.
+    """
+    return queryset.iterator(chunk_size=chunk_size)
+
+
+class Line(object):
+    """
+    File-like object whose write() hands back what is written, so that a
+    csv.writer formats rows into strings.
+    """
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(Line())
+    yield writer.writerow([name for name, _ in EXPORT_COLUMNS])
+    for row in rows:
+        yield writer.writerow([value.isoformat() if hasattr(value, 'isoformat') else value for value in row])
+
+
+def jsonl_lines(rows):
+    encoder = JSONEncoder()
+    names = [name for name, _ in EXPORT_COLUMNS]
+    for row in rows:
+        yield encoder.encode(dict(zip(names, row))) + '\n'
+
+
+def export_lines(rows, export_format):
+    """
+    :param rows: rows of EXPORT_COLUMNS
+    :param export_format: one of EXPORT_FORMATS
+    :return: iterator over the lines of the export, line endings included
+    """
+    if export_format == 'csv':
+        return csv_lines(rows)
+    return jsonl_lines(rows)
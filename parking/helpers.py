@@ -1,4 +1,7 @@
-from math import cos, pi
+from math import asin, cos, pi, sin, sqrt
+
+
+EARTH_RADIUS_MILES = 3958.8
 
 
 def lat_degrees_from_miles(miles):
@@ -22,4 +25,13 @@ def get_weekday_span_between(weekday1, weekday2):
     elif weekday1_index < weekday2_index:
         return weekdays[weekday1_index:weekday2_index + 1]
     else:
-        return weekdays[weekday1_index:] + weekdays[:weekday2_index + 1]
\ No newline at end of file
+        return weekdays[weekday1_index:] + weekdays[:weekday2_index + 1]
+
+
+def haversine_miles(lat1, long1, lat2, long2):
+    """
+    Great-circle distance in miles between two points given in degrees.
+    """
+    lat1, long1, lat2, long2 = (float(value) * pi / 180 for value in (lat1, long1, lat2, long2))
+    a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((long2 - long1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * asin(sqrt(a))
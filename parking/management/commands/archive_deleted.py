@@ -0,0 +1,56 @@
+import datetime
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from accounts.models import Vehicle
+from curbd.metrics import InstrumentedCommand
+from parking.models import ParkingSpace, Reservation
+
+
+class Command(InstrumentedCommand):
+    help = "Moves long soft-deleted parking spaces, reservations and vehicles (and " \
+           "cancelled reservations that have ended) into their archive tables."
+
+    # reservations go first so that the vehicles and parking spaces
+    # they reference can be archived in the same run
+    models = (Reservation, Vehicle, ParkingSpace)
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=90,
+            help="Only archive rows deleted (or reservations ended) more than this many days ago.")
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help="Number of rows moved per transaction.")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - datetime.timedelta(days=options['days'])
+
+        for model in self.models:
+            total = 0
+            while True:
+                moved = self.archive_chunk(model, cutoff, options['chunk_size'])
+                if not moved:
+                    break
+                total += moved
+
+            self.stdout.write("Archived %s %s" % (total, model._meta.verbose_name_plural))
+
+    def archive_chunk(self, model, cutoff, chunk_size):
+        ids = model.archivable(cutoff).order_by('pk').values('pk')[:chunk_size]
+        ids_sql, params = ids.query.sql_with_params()
+        columns = ', '.join(connection.ops.quote_name(field.column) for field in model._meta.concrete_fields)
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                "WITH moved AS ("
+                "DELETE FROM {table} WHERE {pk} IN ({ids}) RETURNING {columns}"
+                ") INSERT INTO {archive_table} ({columns}) SELECT {columns} FROM moved".format(
+                    table=connection.ops.quote_name(model._meta.db_table),
+                    archive_table=connection.ops.quote_name(model.archive_model._meta.db_table),
+                    pk=connection.ops.quote_name(model._meta.pk.column),
+                    ids=ids_sql,
+                    columns=columns),
+                params)
+            return cursor.rowcount
@@ -0,0 +1,37 @@
+from itertools import groupby
+from operator import itemgetter
+
+from curbd.metrics import InstrumentedCommand
+from parking.models import ParkingSpaceDailyStats, Reservation
+
+
+class Command(InstrumentedCommand):
+    help = "Rebuilds the per-day parking space stats from the reservations table."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--parking-space', type=int, action='append', dest='parking_spaces',
+            help="Only rebuild the stats of this parking space (can be repeated).")
+
+    def handle(self, *args, **options):
+        reservations = Reservation.objects.filter(parking_space__isnull=False)
+        stale_stats = ParkingSpaceDailyStats.objects.all()
+
+        if options['parking_spaces']:
+            reservations = reservations.filter(parking_space__in=options['parking_spaces'])
+            stale_stats = stale_stats.filter(parking_space__in=options['parking_spaces'])
+
+        # parking spaces that no longer have any reservations
+        stale_stats.exclude(parking_space__in=reservations.values('parking_space_id')).delete()
+
+        periods = reservations.order_by('parking_space_id').values_list(
+            'parking_space_id', 'start_datetime', 'end_datetime')
+
+        rebuilt = 0
+
+        # reservations are streamed one parking space at a time
+        for parking_space_id, space_periods in groupby(periods.iterator(chunk_size=2000), key=itemgetter(0)):
+            ParkingSpaceDailyStats.rebuild(parking_space_id, (period[1:] for period in space_periods))
+            rebuilt += 1
+
+        self.stdout.write("Rebuilt daily stats of %s parking spaces" % rebuilt)
@@ -0,0 +1,86 @@
+import gzip
+import random
+import timeit
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from api.renderers import MessagePackRenderer, TimedJSONRenderer
+from parking.models import ParkingSpace
+
+
+class Command(BaseCommand):
+    help = "Compares the payload size and encode time of the verbose JSON map search " \
+           "results against the compact columnar layout, in JSON and msgpack."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--results', type=int, default=200,
+            help="Number of parking spaces in the simulated search response.")
+        parser.add_argument(
+            '--repeat', type=int, default=50,
+            help="Number of times each encoding is timed; the best run is reported.")
+
+    def handle(self, *args, **options):
+        # accounts.serializers has to be imported first (see the circular
+        # import in ReservationSerializer)
+        from accounts.serializers import CustomerSerializer  # noqa
+        from parking.serializers import ParkingSpaceMinimalSerializer, search_result_columns
+
+        results = self.fake_results(options['results'])
+
+        encodings = (
+            ('json', lambda: TimedJSONRenderer().render({
+                'count': len(results),
+                'results': [
+                    {'parking_space': ParkingSpaceMinimalSerializer(parking_space).data, 'price': price}
+                    for parking_space, price in results],
+            })),
+            ('json columnar', lambda: TimedJSONRenderer().render(search_result_columns(results))),
+            ('msgpack columnar', lambda: MessagePackRenderer().render(search_result_columns(results))),
+        )
+
+        self.stdout.write("%-18s %10s %12s %12s" % ("encoding", "bytes", "gzip bytes", "encode ms"))
+        for name, encode in encodings:
+            payload = encode()
+            seconds = min(timeit.repeat(encode, number=1, repeat=options['repeat']))
+            self.stdout.write("%-18s %10d %12d %12.2f" % (
+                name, len(payload), len(gzip.compress(payload)), seconds * 1000))
+
+    def fake_results(self, count):
+        """
+        Unsaved parking spaces shaped like real search results, each with
+        two images, so that nothing has to be read from the database.
+        """
+        rng = random.Random(0)
+        features = [feature for feature, _ in ParkingSpace.FEATURES]
+        results = []
+
+        for index in range(count):
+            parking_space = ParkingSpace(
+                id=index + 1,
+                name="%d Robertson Blvd" % rng.randint(100, 9999),
+                latitude=Decimal('34.052235') + Decimal(rng.randint(-50000, 50000)) / 10 ** 6,
+                longitude=Decimal('-118.243683') + Decimal(rng.randint(-50000, 50000)) / 10 ** 6,
+                features=rng.sample(features, rng.randint(0, 3)),
+                instructions="Enter from the alley behind the building and park in the spot marked %d." % index,
+                size=rng.randint(1, 5),
+                available_spaces=rng.randint(1, 4),
+                physical_type=ParkingSpace.PHYSICAL_TYPES[0][0],
+                legal_type=ParkingSpace.LEGAL_TYPES[0][0],
+                is_active=True)
+            parking_space._prefetched_objects_cache = {'images': [
+                ImageStub('images/%d_%d.jpg' % (index, image)) for image in range(2)]}
+            results.append((parking_space, rng.randint(300, 3000)))
+
+        return results
+
+
+class ImageStub(object):
+    def __init__(self, name):
+        self.image = FileStub(name)
+
+
+class FileStub(object):
+    def __init__(self, name):
+        self.url = 'https://storage.googleapis.com/curbd/%s' % name
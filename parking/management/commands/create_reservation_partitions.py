@@ -0,0 +1,25 @@
+from django.db import connection, transaction
+from django.utils import timezone
+
+from curbd.metrics import InstrumentedCommand
+from parking import partitioning
+
+
+class Command(InstrumentedCommand):
+    help = "Creates the monthly reservation partitions for the current month and the " \
+           "next few months. Meant to be run on a schedule (e.g. daily)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--months', type=int, default=3,
+            help="Number of months ahead of the current one to create partitions for.")
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            created = partitioning.create_partitions(
+                cursor, now, partitioning.add_months(partitioning.month_start(now), options['months']))
+
+        for name in created:
+            self.stdout.write("Created partition %s" % name)
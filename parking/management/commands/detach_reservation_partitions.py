@@ -0,0 +1,27 @@
+from django.db import connection, transaction
+from django.utils import timezone
+
+from curbd.metrics import InstrumentedCommand
+from parking import partitioning
+
+
+class Command(InstrumentedCommand):
+    help = "Retention policy for reservations: detaches the monthly partitions of " \
+           "reservations that ended more than --keep-months months ago."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keep-months', type=int, default=24,
+            help="Number of past months (besides the current one) to keep attached.")
+        parser.add_argument(
+            '--drop', action='store_true',
+            help="Drop the detached partitions instead of keeping them as standalone tables.")
+
+    def handle(self, *args, **options):
+        cutoff = partitioning.add_months(partitioning.month_start(timezone.now()), -options['keep_months'])
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            detached = partitioning.detach_partitions_before(cursor, cutoff, drop=options['drop'])
+
+        for name in detached:
+            self.stdout.write("%s partition %s" % ("Dropped" if options['drop'] else "Detached", name))
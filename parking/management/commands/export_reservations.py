@@ -0,0 +1,59 @@
+import dateutil.parser
+from django.core.management.base import CommandError
+from django.utils import timezone
+
+from curbd.metrics import InstrumentedCommand
+from parking.exports import EXPORT_FORMATS, export_lines, export_queryset, export_rows
+
+
+def aware_datetime(value):
+    value = dateutil.parser.parse(value)
+    return timezone.make_aware(value) if timezone.is_naive(value) else value
+
+
+class Command(InstrumentedCommand):
+    help = "Streams reservation history as CSV or JSON lines, in constant memory."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv', dest='export_format')
+        parser.add_argument('--output', help="File to write to (standard output by default).")
+        parser.add_argument('--host', type=int, help="Only the reservations of this host's parking spaces.")
+        parser.add_argument('--parking-space', type=int, help="Only the reservations of this parking space.")
+        parser.add_argument('--from', type=aware_datetime, dest='start',
+                            help="Only reservations ending after this date or datetime.")
+        parser.add_argument('--to', type=aware_datetime, dest='end',
+                            help="Only reservations starting before this date or datetime.")
+        parser.add_argument('--paid-out', choices=('true', 'false'), help="Only paid out (or unpaid) reservations.")
+        parser.add_argument('--cancelled', choices=('true', 'false'), help="Only cancelled (or kept) reservations.")
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help="Rows fetched from the database at a time.")
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be positive")
+
+        queryset = export_queryset(
+            host=options['host'],
+            parking_space=options['parking_space'],
+            start=options['start'],
+            end=options['end'],
+            paid_out=None if options['paid_out'] is None else options['paid_out'] == 'true',
+            cancelled=None if options['cancelled'] is None else options['cancelled'] == 'true')
+
+        lines = export_lines(export_rows(queryset, chunk_size=options['chunk_size']), options['export_format'])
+
+        if options['output'] is None:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+
+        rows = 0
+        with open(options['output'], 'w', newline='') as output:
+            for line in lines:
+                output.write(line)
+                rows += 1
+
+        if options['export_format'] == 'csv':
+            # header
+            rows -= 1
+        self.stdout.write("Exported %s reservations to %s" % (rows, options['output']))
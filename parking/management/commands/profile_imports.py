@@ -0,0 +1,66 @@
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+def import_times(args):
+    """
+    Runs a fresh Python process with -X importtime and parses what it
+    reports on stderr.
+    :param args: arguments of the python process, e.g. ['manage.py', 'check']
+    :return: (returncode, list of (module, self seconds, cumulative seconds, depth))
+    """
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime'] + list(args),
+        cwd=settings.BASE_DIR, env=os.environ.copy(),
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+
+    modules = []
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append((name.strip(), int(self_us) / 10 ** 6, int(cumulative_us) / 10 ** 6, depth))
+
+    return process.returncode, modules
+
+
+def total_import_time(modules):
+    # nested imports are already part of their top level import
+    return sum(cumulative for _, _, cumulative, depth in modules if depth == 0)
+
+
+class Command(BaseCommand):
+    help = "Reports the import cost of each module loaded when a fresh process sets up Django " \
+           "and imports the URLconf, like a worker does before its first request."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top', type=int, default=25,
+            help="Number of modules reported.")
+        parser.add_argument(
+            '--sort', choices=('cumulative', 'self'), default='cumulative',
+            help="Rank modules by their own import time or by the time including what they import.")
+        parser.add_argument(
+            '--module', action='append', dest='modules',
+            help="Module imported after setup instead of the URLconf (can be repeated).")
+
+    def handle(self, *args, **options):
+        script = 'import django, importlib; django.setup(); [importlib.import_module(m) for m in %r]' % (
+            options['modules'] or [settings.ROOT_URLCONF])
+        returncode, modules = import_times(['-c', script])
+
+        if returncode != 0:
+            raise CommandError("The profiled process failed with exit code %s" % returncode)
+
+        column = 1 if options['sort'] == 'self' else 2
+        ranked = sorted(modules, key=lambda module: module[column], reverse=True)[:options['top']]
+
+        self.stdout.write("%d modules imported in %.3f s" % (len(modules), total_import_time(modules)))
+        self.stdout.write("%10s %10s  %s" % ("self ms", "total ms", "module"))
+        for name, self_seconds, cumulative_seconds, _ in ranked:
+            self.stdout.write("%10.1f %10.1f  %s" % (self_seconds * 1000, cumulative_seconds * 1000, name))
@@ -0,0 +1,39 @@
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from curbd.metrics import InstrumentedCommand
+from parking.models import ParkingSpace, ParkingSpaceRating
+
+
+class Command(InstrumentedCommand):
+    help = "Recomputes the rating_count and rating_sum of parking spaces from their ratings."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--parking-space', type=int, action='append', dest='parking_spaces',
+            help="Only rebuild the totals of this parking space (can be repeated).")
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help="Number of parking spaces updated per transaction.")
+
+    def handle(self, *args, **options):
+        ratings = ParkingSpaceRating.objects.filter(parking_space=OuterRef('pk')).order_by().values('parking_space')
+        rating_count = Subquery(ratings.annotate(total=Count('pk')).values('total'))
+        rating_sum = Subquery(ratings.annotate(total=Sum('value')).values('total'))
+
+        parking_spaces = ParkingSpace.all_objects.all()
+        if options['parking_spaces']:
+            parking_spaces = parking_spaces.filter(pk__in=options['parking_spaces'])
+
+        parking_space_ids = list(parking_spaces.order_by('pk').values_list('pk', flat=True))
+        updated = 0
+
+        for index in range(0, len(parking_space_ids), options['chunk_size']):
+            chunk = parking_space_ids[index:index + options['chunk_size']]
+            with transaction.atomic():
+                updated += ParkingSpace.all_objects.filter(pk__in=chunk).update(
+                    rating_count=Coalesce(rating_count, 0),
+                    rating_sum=Coalesce(rating_sum, 0))
+
+        self.stdout.write("Rebuilt the rating totals of %s parking spaces" % updated)
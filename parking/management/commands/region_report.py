@@ -0,0 +1,22 @@
+from django.db.models import Count
+from django.utils import timezone
+
+from curbd.metrics import InstrumentedCommand
+from parking.models import ParkingSpace, Reservation
+
+
+class Command(InstrumentedCommand):
+    help = "Reports the parking spaces and upcoming reservations of each region."
+
+    def handle(self, *args, **options):
+        spaces = dict(ParkingSpace.objects.order_by().values_list('region').annotate(total=Count('pk')))
+        active_spaces = dict(ParkingSpace.objects.filter(is_active=True).order_by().values_list('region')
+                             .annotate(total=Count('pk')))
+        upcoming_reservations = dict(
+            Reservation.objects.filter(end_datetime__gte=timezone.now(), cancelled=False)
+            .order_by().values_list('parking_space__region').annotate(total=Count('pk')))
+
+        self.stdout.write("%-20s %10s %10s %10s" % ("region", "spaces", "active", "upcoming"))
+        for region in sorted(spaces):
+            self.stdout.write("%-20s %10d %10d %10d" % (
+                region, spaces[region], active_spaces.get(region, 0), upcoming_reservations.get(region, 0)))
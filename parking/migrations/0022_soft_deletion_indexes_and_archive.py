@@ -0,0 +1,80 @@
+from django.db import migrations, models
+import parking.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0015_vehicle_archive'),
+        ('parking', '0021_auto_20180906_2254'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedParkingSpace',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('deleted_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('latitude', models.DecimalField(db_index=True, decimal_places=6, max_digits=9)),
+                ('longitude', models.DecimalField(db_index=True, decimal_places=6, max_digits=9)),
+                ('available_spaces', models.PositiveIntegerField(default=1, help_text="NOTE: Each individual parking space should be positioned such that each vehicle can arrive and leave independent of other vehicles currently parked at that location. If this is not possible, please enter '1' as the number of spaces available.", verbose_name='Number of spaces available')),
+                ('size', models.PositiveIntegerField(choices=[(1, 'Motorcycle'), (2, 'Compact'), (3, 'Mid-sized'), (4, 'Large'), (5, 'Oversized')], help_text='This is the maximum vehicle size the parking space can support', verbose_name='Max supported automobile size')),
+                ('features', parking.fields.ChoiceArrayField(base_field=models.CharField(choices=[('EV Charging', 'EV Charging'), ('Illuminated', 'Illuminated'), ('Covered', 'Covered'), ('Guarded', 'Guarded'), ('Surveillance', 'Surveillance'), ('Gated', 'Gated')], max_length=50), blank=True, help_text='A list of features e.g. EV charging, Illuminated, etc.', null=True, size=None)),
+                ('name', models.CharField(help_text="e.g. '123 Robertson' or 'Sam's Diner'", max_length=50)),
+                ('instructions', models.CharField(blank=True, help_text='Any instructions that will help customers find the parking spot', max_length=1000)),
+                ('physical_type', models.CharField(choices=[('Driveway', 'Driveway'), ('Garage', 'Garage'), ('Lot', 'Parking Lot'), ('Structure', 'Parking Structure'), ('Unpaved', 'Unpaved Lot')], max_length=50)),
+                ('legal_type', models.CharField(choices=[('Residential', 'Residential'), ('Business', 'Business')], max_length=50)),
+                ('is_active', models.BooleanField(default=False)),
+            ],
+            options={
+                'db_table': 'parking_parkingspace_archive',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedReservation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('deleted_at', models.DateTimeField(blank=True, null=True)),
+                ('start_datetime', models.DateTimeField()),
+                ('end_datetime', models.DateTimeField()),
+                ('for_repeating', models.BooleanField(editable=False)),
+                ('cancelled', models.BooleanField(default=False)),
+                ('paid_out', models.BooleanField(default=False)),
+                ('cost', models.IntegerField()),
+                ('host_income', models.IntegerField()),
+                ('payment_method_info', models.CharField(blank=True, max_length=30, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'parking_reservation_archive',
+                'managed': False,
+            },
+        ),
+        # Partial indexes covering only live rows. Django 2.1 can't express
+        # Index(condition=...) so these are maintained by hand.
+        migrations.RunSQL(
+            ['CREATE INDEX parking_parkingspace_location_live_idx ON parking_parkingspace (latitude, longitude) '
+             'WHERE deleted_at IS NULL AND is_active;',
+             'CREATE INDEX parking_parkingspace_host_id_live_idx ON parking_parkingspace (host_id) '
+             'WHERE deleted_at IS NULL;',
+             'CREATE INDEX parking_reservation_space_period_live_idx '
+             'ON parking_reservation (parking_space_id, start_datetime, end_datetime) '
+             'WHERE deleted_at IS NULL;',
+             'CREATE INDEX parking_reservation_vehicle_id_live_idx ON parking_reservation (vehicle_id, start_datetime) '
+             'WHERE deleted_at IS NULL;'],
+            ['DROP INDEX parking_parkingspace_location_live_idx;',
+             'DROP INDEX parking_parkingspace_host_id_live_idx;',
+             'DROP INDEX parking_reservation_space_period_live_idx;',
+             'DROP INDEX parking_reservation_vehicle_id_live_idx;']),
+        migrations.RunSQL(
+            ['CREATE TABLE parking_parkingspace_archive (LIKE parking_parkingspace INCLUDING CONSTRAINTS);',
+             'ALTER TABLE parking_parkingspace_archive ADD PRIMARY KEY (id);',
+             'CREATE TABLE parking_reservation_archive (LIKE parking_reservation INCLUDING CONSTRAINTS);',
+             'ALTER TABLE parking_reservation_archive ADD PRIMARY KEY (id);',
+             'CREATE INDEX parking_reservation_archive_parking_space_id_idx '
+             'ON parking_reservation_archive (parking_space_id);'],
+            ['DROP TABLE parking_parkingspace_archive;',
+             'DROP TABLE parking_reservation_archive;']),
+    ]
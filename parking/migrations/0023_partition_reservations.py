@@ -0,0 +1,93 @@
+from django.db import migrations
+from django.utils import timezone
+
+from parking import partitioning
+
+
+def create_monthly_partitions(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT min(end_datetime) FROM parking_reservation_unpartitioned')
+        oldest = cursor.fetchone()[0]
+        now = timezone.now()
+        partitioning.create_partitions(cursor, oldest or now, partitioning.add_months(now, 3))
+
+
+class Migration(migrations.Migration):
+    """
+    Turns parking_reservation into a table range partitioned by month of
+    end_datetime (requires PostgreSQL 11+). The primary key has to include
+    the partition key, so tables referencing reservations can't use a
+    database-level foreign key constraint.
+    """
+
+    dependencies = [
+        ('parking', '0022_soft_deletion_indexes_and_archive'),
+    ]
+
+    operations = [
+        migrations.RunSQL([
+            'ALTER TABLE parking_reservation RENAME TO parking_reservation_unpartitioned;',
+            'CREATE TABLE parking_reservation (LIKE parking_reservation_unpartitioned '
+            'INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY RANGE (end_datetime);',
+            'CREATE TABLE parking_reservation_default PARTITION OF parking_reservation DEFAULT;',
+        ], migrations.RunSQL.noop),
+        # reversing the last operation drops the partitions with the table
+        migrations.RunPython(create_monthly_partitions, migrations.RunPython.noop),
+        migrations.RunSQL([
+            'INSERT INTO parking_reservation SELECT * FROM parking_reservation_unpartitioned;',
+            'ALTER SEQUENCE parking_reservation_id_seq OWNED BY parking_reservation.id;',
+            'DROP TABLE parking_reservation_unpartitioned;',
+
+            'ALTER TABLE parking_reservation ADD CONSTRAINT parking_reservation_pkey PRIMARY KEY (id, end_datetime);',
+            'CREATE INDEX parking_reservation_car_id_a5a947ab ON parking_reservation (vehicle_id);',
+            'CREATE INDEX parking_reservation_fixed_availability_id_131fc02a '
+            'ON parking_reservation (fixed_availability_id);',
+            'CREATE INDEX parking_reservation_parking_space_id_3f609ee4 ON parking_reservation (parking_space_id);',
+            'CREATE INDEX parking_reservation_repeating_availability_id_740b079a '
+            'ON parking_reservation (repeating_availability_id);',
+            'CREATE INDEX parking_reservation_space_period_live_idx '
+            'ON parking_reservation (parking_space_id, start_datetime, end_datetime) WHERE deleted_at IS NULL;',
+            'CREATE INDEX parking_reservation_vehicle_id_live_idx '
+            'ON parking_reservation (vehicle_id, start_datetime) WHERE deleted_at IS NULL;',
+
+            'ALTER TABLE parking_reservation ADD CONSTRAINT parking_reservation_fixed_availability_i_131fc02a_fk_parking_f '
+            'FOREIGN KEY (fixed_availability_id) REFERENCES parking_fixedavailability (id) DEFERRABLE INITIALLY DEFERRED;',
+            'ALTER TABLE parking_reservation ADD CONSTRAINT parking_reservation_parking_space_id_3f609ee4_fk_parking_p '
+            'FOREIGN KEY (parking_space_id) REFERENCES parking_parkingspace (id) DEFERRABLE INITIALLY DEFERRED;',
+            'ALTER TABLE parking_reservation ADD CONSTRAINT parking_reservation_repeating_availabili_740b079a_fk_parking_r '
+            'FOREIGN KEY (repeating_availability_id) REFERENCES parking_repeatingavailability (id) '
+            'DEFERRABLE INITIALLY DEFERRED;',
+            'ALTER TABLE parking_reservation ADD CONSTRAINT parking_reservation_vehicle_id_b5cd77ae_fk_accounts_vehicle_id '
+            'FOREIGN KEY (vehicle_id) REFERENCES accounts_vehicle (id) DEFERRABLE INITIALLY DEFERRED;',
+        ], [
+            # back to a single table, with every row of every attached partition
+            'CREATE TABLE parking_reservation_unpartitioned (LIKE parking_reservation '
+            'INCLUDING DEFAULTS INCLUDING CONSTRAINTS);',
+            'INSERT INTO parking_reservation_unpartitioned SELECT * FROM parking_reservation;',
+            'ALTER SEQUENCE parking_reservation_id_seq OWNED BY parking_reservation_unpartitioned.id;',
+            'DROP TABLE parking_reservation;',
+            'ALTER TABLE parking_reservation_unpartitioned RENAME TO parking_reservation;',
+
+            'ALTER TABLE parking_reservation ADD CONSTRAINT parking_reservation_pkey PRIMARY KEY (id);',
+            'CREATE INDEX parking_reservation_car_id_a5a947ab ON parking_reservation (vehicle_id);',
+            'CREATE INDEX parking_reservation_fixed_availability_id_131fc02a '
+            'ON parking_reservation (fixed_availability_id);',
+            'CREATE INDEX parking_reservation_parking_space_id_3f609ee4 ON parking_reservation (parking_space_id);',
+            'CREATE INDEX parking_reservation_repeating_availability_id_740b079a '
+            'ON parking_reservation (repeating_availability_id);',
+            'CREATE INDEX parking_reservation_space_period_live_idx '
+            'ON parking_reservation (parking_space_id, start_datetime, end_datetime) WHERE deleted_at IS NULL;',
+            'CREATE INDEX parking_reservation_vehicle_id_live_idx '
+            'ON parking_reservation (vehicle_id, start_datetime) WHERE deleted_at IS NULL;',
+
+            'ALTER TABLE parking_reservation ADD CONSTRAINT parking_reservation_fixed_availability_i_131fc02a_fk_parking_f '
+            'FOREIGN KEY (fixed_availability_id) REFERENCES parking_fixedavailability (id) DEFERRABLE INITIALLY DEFERRED;',
+            'ALTER TABLE parking_reservation ADD CONSTRAINT parking_reservation_parking_space_id_3f609ee4_fk_parking_p '
+            'FOREIGN KEY (parking_space_id) REFERENCES parking_parkingspace (id) DEFERRABLE INITIALLY DEFERRED;',
+            'ALTER TABLE parking_reservation ADD CONSTRAINT parking_reservation_repeating_availabili_740b079a_fk_parking_r '
+            'FOREIGN KEY (repeating_availability_id) REFERENCES parking_repeatingavailability (id) '
+            'DEFERRABLE INITIALLY DEFERRED;',
+            'ALTER TABLE parking_reservation ADD CONSTRAINT parking_reservation_vehicle_id_b5cd77ae_fk_accounts_vehicle_id '
+            'FOREIGN KEY (vehicle_id) REFERENCES accounts_vehicle (id) DEFERRABLE INITIALLY DEFERRED;',
+        ]),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.1 on 2026-10-19 15:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0023_partition_reservations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParkingSpaceDailyStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('reserved_minutes', models.PositiveIntegerField(default=0)),
+                ('booking_count', models.PositiveIntegerField(default=0)),
+                ('cancellation_count', models.PositiveIntegerField(default=0)),
+                ('host_income', models.IntegerField(default=0)),
+                ('parking_space', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='parking.ParkingSpace')),
+            ],
+            options={
+                'verbose_name_plural': 'parking space daily stats',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='parkingspacedailystats',
+            unique_together={('parking_space', 'day')},
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.1 on 2026-10-19 15:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0024_parkingspacedailystats'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='fixedavailability',
+            name='start_datetime',
+            field=models.DateTimeField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='parkingspace',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='repeatingavailability',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
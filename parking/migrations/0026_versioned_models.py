@@ -0,0 +1,71 @@
+# Generated by Django 2.1 on 2026-10-19 17:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0025_admin_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedparkingspace',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='archivedparkingspace',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.AddField(
+            model_name='fixedavailability',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='fixedavailability',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.AddField(
+            model_name='parkingspace',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='parkingspace',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.AddField(
+            model_name='parkingspaceimage',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='parkingspaceimage',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.AddField(
+            model_name='repeatingavailability',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='repeatingavailability',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        # the archive table is unmanaged, so it is kept in step by hand
+        migrations.RunSQL(
+            ['ALTER TABLE parking_parkingspace_archive '
+             'ADD COLUMN updated_at timestamp with time zone NOT NULL DEFAULT now(), '
+             'ADD COLUMN version integer NOT NULL DEFAULT 1 CHECK (version >= 0);',
+             'ALTER TABLE parking_parkingspace_archive '
+             'ALTER COLUMN updated_at DROP DEFAULT, ALTER COLUMN version DROP DEFAULT;'],
+            ['ALTER TABLE parking_parkingspace_archive DROP COLUMN updated_at, DROP COLUMN version;']),
+    ]
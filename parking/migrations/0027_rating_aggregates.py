@@ -0,0 +1,59 @@
+# Generated by Django 2.1 on 2026-10-19 18:40
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0026_versioned_models'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedparkingspace',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='archivedparkingspace',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='parkingspace',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='parkingspace',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='parkingspacerating',
+            name='reservation',
+            field=models.OneToOneField(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='rating', to='parking.Reservation'),
+        ),
+        migrations.AlterField(
+            model_name='parkingspacerating',
+            name='value',
+            field=models.PositiveIntegerField(validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(5)]),
+        ),
+        # the archive table is unmanaged, so it is kept in step by hand
+        migrations.RunSQL(
+            ['ALTER TABLE parking_parkingspace_archive '
+             'ADD COLUMN rating_count integer NOT NULL DEFAULT 0 CHECK (rating_count >= 0), '
+             'ADD COLUMN rating_sum integer NOT NULL DEFAULT 0 CHECK (rating_sum >= 0);',
+             'ALTER TABLE parking_parkingspace_archive '
+             'ALTER COLUMN rating_count DROP DEFAULT, ALTER COLUMN rating_sum DROP DEFAULT;'],
+            ['ALTER TABLE parking_parkingspace_archive DROP COLUMN rating_count, DROP COLUMN rating_sum;']),
+        migrations.RunSQL(
+            ['UPDATE parking_parkingspace SET rating_count = totals.rating_count, rating_sum = totals.rating_sum '
+             'FROM (SELECT parking_space_id, count(*) AS rating_count, sum(value) AS rating_sum '
+             'FROM parking_parkingspacerating GROUP BY parking_space_id) totals '
+             'WHERE parking_parkingspace.id = totals.parking_space_id;'],
+            migrations.RunSQL.noop),
+    ]
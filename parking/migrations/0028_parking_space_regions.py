@@ -0,0 +1,44 @@
+# Generated by Django 2.1 on 2026-10-19 19:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def assign_regions(apps, schema_editor):
+    for model_name in ('ParkingSpace', 'ArchivedParkingSpace'):
+        model = apps.get_model('parking', model_name)
+        for region, (south, west, north, east) in settings.PARKING_REGIONS.items():
+            model._base_manager.using(schema_editor.connection.alias).filter(
+                latitude__gte=south, latitude__lte=north,
+                longitude__gte=west, longitude__lte=east,
+                region='other').update(region=region)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0027_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedparkingspace',
+            name='region',
+            field=models.CharField(default='other', editable=False, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='parkingspace',
+            name='region',
+            field=models.CharField(default='other', editable=False, max_length=50),
+        ),
+        # the archive table is unmanaged, so it is kept in step by hand
+        migrations.RunSQL(
+            ['ALTER TABLE parking_parkingspace_archive ADD COLUMN region varchar(50) NOT NULL DEFAULT \'other\';',
+             'ALTER TABLE parking_parkingspace_archive ALTER COLUMN region DROP DEFAULT;'],
+            ['ALTER TABLE parking_parkingspace_archive DROP COLUMN region;']),
+        migrations.RunPython(assign_regions, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='parkingspace',
+            index=models.Index(fields=['region', 'latitude', 'longitude'], name='parking_space_region_loc_idx'),
+        ),
+    ]
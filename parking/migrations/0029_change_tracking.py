@@ -0,0 +1,67 @@
+# Generated by Django 2.1 on 2026-10-19 21:15
+
+from django.db import migrations, models
+
+from curbd.sync import change_tracking_sql
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0028_parking_space_regions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedparkingspace',
+            name='change_seq',
+            field=models.BigIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='archivedparkingspace',
+            name='change_xid',
+            field=models.BigIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='archivedreservation',
+            name='change_seq',
+            field=models.BigIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='archivedreservation',
+            name='change_xid',
+            field=models.BigIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='parkingspace',
+            name='change_seq',
+            field=models.BigIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='parkingspace',
+            name='change_xid',
+            field=models.BigIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='reservation',
+            name='change_seq',
+            field=models.BigIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='reservation',
+            name='change_xid',
+            field=models.BigIntegerField(db_index=True, default=0, editable=False),
+        ),
+        # the archive tables are unmanaged, so they are kept in step by hand
+        migrations.RunSQL(
+            ['ALTER TABLE parking_parkingspace_archive '
+             'ADD COLUMN change_seq bigint NOT NULL DEFAULT 0, ADD COLUMN change_xid bigint NOT NULL DEFAULT 0;',
+             'ALTER TABLE parking_reservation_archive '
+             'ADD COLUMN change_seq bigint NOT NULL DEFAULT 0, ADD COLUMN change_xid bigint NOT NULL DEFAULT 0;'],
+            ['ALTER TABLE parking_parkingspace_archive DROP COLUMN change_seq, DROP COLUMN change_xid;',
+             'ALTER TABLE parking_reservation_archive DROP COLUMN change_seq, DROP COLUMN change_xid;']),
+        # rows written before this migration have change_seq 0, which every token is past
+        migrations.RunSQL(*change_tracking_sql('parking_parkingspace')),
+        # a trigger on the partitioned table applies to all its partitions (Postgres 13+)
+        migrations.RunSQL(*change_tracking_sql('parking_reservation')),
+    ]
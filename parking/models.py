@@ -1,17 +1,21 @@
 from django.core.exceptions import ValidationError
-from django.core.validators import MaxValueValidator
-from django.db import models
-from django.db.models import Q
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.conf import settings
+from django.db import connections, models, router, transaction
+from django.db.models import Case, ExpressionWrapper, F, FloatField, Q, When
 from django.utils import timezone
 
 import calendar
+import datetime
 from enum import Enum
 
 from accounts.models import Host, Address, VEHICLE_SIZES
-from curbd.models import SoftDeletionModel
+from curbd.models import ChangeTrackedModel, SoftDeletionModel, VersionedModel, archive_model_for
 from payment.helpers import calculate_customer_price
 from .fields import ChoiceArrayField
 from .helpers import get_weekday_span_between
+from .regions import OTHER_REGION, region_for
+from .vacancy import notify_vacancy_change
 
 
 class ParkingSpaceFeature(Enum):
@@ -46,7 +50,7 @@ class ParkingSpaceLegalType(Enum):
     Business = "Business"
 
 
-class ParkingSpace(SoftDeletionModel):
+class ParkingSpace(VersionedModel, SoftDeletionModel, ChangeTrackedModel):
 
     FEATURES = (
         (ParkingSpaceFeature.EV_charging.value, "EV Charging"),
@@ -76,11 +80,14 @@ class ParkingSpace(SoftDeletionModel):
         on_delete=models.SET_NULL,
         help_text="The host that the parking space belongs to")
 
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
     latitude = models.DecimalField(max_digits=9, decimal_places=6, db_index=True)
     longitude = models.DecimalField(max_digits=9, decimal_places=6, db_index=True)
 
+    # assigned from the coordinates on save, see parking/regions.py
+    region = models.CharField(max_length=50, default=OTHER_REGION, editable=False)
+
     address = models.OneToOneField(Address, on_delete=models.PROTECT, null=True)
 
     available_spaces = models.PositiveIntegerField(
@@ -112,8 +119,63 @@ class ParkingSpace(SoftDeletionModel):
 
     is_active = models.BooleanField(default=False)
 
+    # running totals of the space's ratings, kept up to date by
+    # ParkingSpaceRating so that averages never need an aggregate
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+
     # TODO: parking space photos
 
+    class Meta:
+        indexes = [
+            # searches are bounded to a few miles, i.e. to one or two regions
+            models.Index(fields=['region', 'latitude', 'longitude'], name='parking_space_region_loc_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.region = region_for(self.latitude, self.longitude)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and ('latitude' in update_fields or 'longitude' in update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'region'}
+        super(ParkingSpace, self).save(*args, **kwargs)
+
+    def get_average_rating(self):
+        if not self.rating_count:
+            return None
+        return self.rating_sum / self.rating_count
+
+    @staticmethod
+    def average_rating_ordering():
+        """
+        Expression of the average rating to order parking spaces by, with
+        unrated spaces counting as 0
+        """
+        return Case(
+            When(rating_count=0, then=0.0),
+            default=ExpressionWrapper(F('rating_sum') * 1.0 / F('rating_count'), output_field=FloatField()),
+            output_field=FloatField())
+
+    @classmethod
+    def add_rating(cls, pk, count, value):
+        """
+        Adds count ratings totalling value to the running totals of a
+        parking space (negative to remove them).
+        """
+        cls._base_manager.filter(pk=pk).update(
+            rating_count=F('rating_count') + count,
+            rating_sum=F('rating_sum') + value,
+            version=F('version') + 1,
+            updated_at=timezone.now())
+
+    @classmethod
+    def lock_for_booking(cls, pk):
+        """
+        Locks the row of a parking space until the end of the transaction.
+        Every write that checks a parking space's reservations for overlaps
+        takes this lock first, so that two of them can't both pass the check.
+        """
+        cls._base_manager.select_for_update().filter(pk=pk).exists()
+
     def reservations(self):
         return Reservation.objects.filter(
             Q(fixed_availability__parking_space=self) |
@@ -168,20 +230,30 @@ class ParkingSpace(SoftDeletionModel):
         return self.name
 
 
-class ParkingSpaceImage(models.Model):
+class ParkingSpaceImage(VersionedModel):
     image = models.ImageField(upload_to='images')
     parking_space = models.ForeignKey(ParkingSpace, on_delete=models.CASCADE, related_name='images')
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super(ParkingSpaceImage, self).save(*args, **kwargs)
+            ParkingSpace.touch(self.parking_space_id)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            ParkingSpace.touch(self.parking_space_id)
+            return super(ParkingSpaceImage, self).delete(*args, **kwargs)
+
     def __str__(self):
         return self.image.name
 
 
-class FixedAvailability(models.Model):
+class FixedAvailability(VersionedModel):
 
     parking_space = models.ForeignKey(ParkingSpace, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
 
-    start_datetime = models.DateTimeField()
+    start_datetime = models.DateTimeField(db_index=True)
     end_datetime = models.DateTimeField()
 
     pricing = models.PositiveIntegerField(
@@ -193,6 +265,14 @@ class FixedAvailability(models.Model):
     class Meta:
         verbose_name_plural = 'fixed availabilities'
 
+    @staticmethod
+    def covering(start_datetime, end_datetime):
+        """
+        Q object matching the fixed availabilities a reservation from
+        start_datetime to end_datetime can be booked against
+        """
+        return Q(start_datetime__lte=start_datetime) & Q(end_datetime__gte=end_datetime)
+
     def get_duration(self):
         """ get duration of fixed availability in hours """
         delta = self.end_datetime - self.start_datetime
@@ -264,7 +344,14 @@ class FixedAvailability(models.Model):
         self.check_ends_after_current_time()
         self.check_overlap_with_fixed_availabilities()
 
-        super(FixedAvailability, self).save(*args, **kwargs)
+        with transaction.atomic():
+            super(FixedAvailability, self).save(*args, **kwargs)
+            ParkingSpace.touch(self.parking_space_id)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            ParkingSpace.touch(self.parking_space_id)
+            return super(FixedAvailability, self).delete(*args, **kwargs)
 
     def is_reserved(self, start_datetime, end_datetime):
         for reservation in self.reservation_set.filter(cancelled=False):
@@ -280,7 +367,7 @@ class FixedAvailability(models.Model):
             timezone.localtime(self.end_datetime).strftime("%Y-%m-%d %H:%M"))
 
 
-class RepeatingAvailability(models.Model):
+class RepeatingAvailability(VersionedModel):
 
     DAYS_OF_THE_WEEK = (
         (Weekday.Sunday.value, 'Sunday'),
@@ -293,7 +380,7 @@ class RepeatingAvailability(models.Model):
     )
 
     parking_space = models.ForeignKey(ParkingSpace, on_delete=models.CASCADE)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
     start_time = models.TimeField(null=True, blank=True)
     end_time = models.TimeField(null=True, blank=True)
@@ -309,6 +396,27 @@ class RepeatingAvailability(models.Model):
     class Meta:
         verbose_name_plural = 'repeating availabilities'
 
+    @staticmethod
+    def covering(start_datetime, end_datetime):
+        """
+        Q object matching the repeating availabilities a reservation from
+        start_datetime to end_datetime can be booked against
+        """
+        start_day_of_week = calendar.day_name[start_datetime.weekday()][:3]
+        end_day_of_week = calendar.day_name[end_datetime.weekday()][:3]
+
+        if start_day_of_week == end_day_of_week:
+            return (
+                (Q(all_day=True) | (Q(start_time__lte=start_datetime.time()) & Q(end_time__gte=end_datetime.time()))) &
+                Q(repeating_days__contains=[start_day_of_week]))
+
+        if (end_datetime.day - start_datetime.day) >= 7:
+            # make sure to include every day of the week if duration is one week or more
+            weekdays = get_weekday_span_between('Sun', 'Sat')
+        else:
+            weekdays = get_weekday_span_between(start_day_of_week, end_day_of_week)
+        return Q(all_day=True) & Q(repeating_days__contains=weekdays)
+
     def check_end_comes_after_start(self):
         if not self.all_day:
             if self.start_time > self.end_time:
@@ -364,7 +472,14 @@ class RepeatingAvailability(models.Model):
         self.check_overlap_with_repeating_availabilities()
         self.check_is_all_day_or_has_start_and_end_time()
 
-        super(RepeatingAvailability, self).save(*args, **kwargs)
+        with transaction.atomic():
+            super(RepeatingAvailability, self).save(*args, **kwargs)
+            ParkingSpace.touch(self.parking_space_id)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            ParkingSpace.touch(self.parking_space_id)
+            return super(RepeatingAvailability, self).delete(*args, **kwargs)
 
     def is_reserved(self, start_datetime, end_datetime):
         for reservation in self.reservation_set.filter(cancelled=False):
@@ -387,7 +502,7 @@ class RepeatingAvailability(models.Model):
                 self.end_time.strftime("%H:%M"))
 
 
-class Reservation(SoftDeletionModel):
+class Reservation(SoftDeletionModel, ChangeTrackedModel):
     from accounts.models import Vehicle
 
     vehicle = models.ForeignKey(Vehicle, on_delete=models.PROTECT)
@@ -425,6 +540,11 @@ class Reservation(SoftDeletionModel):
 
     created_at = models.DateTimeField(auto_now_add=True)
 
+    @classmethod
+    def archive_condition(cls, cutoff):
+        # cancelled reservations are dead weight once they are over
+        return super(Reservation, cls).archive_condition(cutoff) | Q(cancelled=True, end_datetime__lt=cutoff)
+
     def set_derived_fields(self):
         if self.for_repeating is None:
             if self.repeating_availability is not None:
@@ -436,9 +556,12 @@ class Reservation(SoftDeletionModel):
                 self.parking_space = self.fixed_availability.parking_space
                 self.cost = calculate_customer_price(self.fixed_availability.pricing, self.minutes())
 
-        self.host_income = (self.cost * (1 - 0.029) - 30) * 0.8
+        self.host_income = self.host_income_for(self.cost)
+
+    @staticmethod
+    def host_income_for(cost):
         # make sure the host never loses money
-        self.host_income = max(0.0, self.host_income)
+        return max(0.0, (cost * (1 - 0.029) - 30) * 0.8)
 
     def check_end_comes_after_start(self):
         if self.start_datetime > self.end_datetime:
@@ -481,9 +604,130 @@ class Reservation(SoftDeletionModel):
         self.check_start_and_end_within_availability_bounds()
         # make sure reservation start and end time are within
         # start and end time of its availability
-        self.check_reservation_overlap()
 
-        super(Reservation, self).save(*args, **kwargs)
+        previous = None
+        if self.pk is not None:
+            previous = Reservation.all_objects.filter(pk=self.pk).values(
+                'parking_space_id', 'start_datetime', 'end_datetime',
+                'fixed_availability_id', 'repeating_availability_id', 'deleted_at').first()
+
+        with transaction.atomic():
+            ParkingSpace.lock_for_booking(self.parking_space_id)
+            self.check_reservation_overlap()
+            super(Reservation, self).save(*args, **kwargs)
+            self.refresh_daily_stats(previous)
+            self.touch_availabilities(previous)
+
+    def extend(self, end_datetime):
+        """
+        Moves the end of the reservation to end_datetime. Only the added
+        interval is checked against the other reservations of the parking
+        space, whose row is locked meanwhile (see
+        ParkingSpace.lock_for_booking), and the cost only grows by the price of the
+        added minutes.
+        :param end_datetime: the new, later end time
+        :return: the added cost (in U.S. cents)
+        """
+        if self.cancelled:
+            raise ValidationError("Cancelled reservations can't be extended")
+        if end_datetime <= self.end_datetime:
+            raise ValidationError("Reservation end time must come after its current end time")
+
+        availability = self.repeating_availability if self.for_repeating else self.fixed_availability
+        if availability is None:
+            raise ValidationError("The availability of this reservation no longer exists")
+
+        previous = {
+            'parking_space_id': self.parking_space_id,
+            'start_datetime': self.start_datetime,
+            'end_datetime': self.end_datetime,
+        }
+        previous_minutes = self.minutes()
+
+        self.end_datetime = end_datetime
+        try:
+            self.check_start_and_end_within_availability_bounds()
+        except ValidationError:
+            self.end_datetime = previous['end_datetime']
+            raise
+
+        # the fixed fee is only charged once, so the added minutes are priced
+        # as the difference between the longer and the original reservation
+        added_cost = (calculate_customer_price(availability.pricing, self.minutes()) -
+                      calculate_customer_price(availability.pricing, previous_minutes))
+        cost = self.cost + added_cost
+        host_income = self.host_income_for(cost)
+
+        try:
+            with transaction.atomic():
+                ParkingSpace.lock_for_booking(self.parking_space_id)
+
+                if Reservation.objects.filter(
+                        parking_space_id=self.parking_space_id,
+                        cancelled=False,
+                        start_datetime__lte=end_datetime,
+                        end_datetime__gte=previous['end_datetime']).exclude(pk=self.pk).exists():
+                    raise ValidationError("Overlaps with other reservation")
+
+                # only applies if nobody changed the reservation since it was read
+                updated = Reservation.objects.filter(
+                    pk=self.pk,
+                    end_datetime=previous['end_datetime'],
+                    cost=self.cost,
+                    cancelled=False).update(end_datetime=end_datetime, cost=cost, host_income=host_income)
+                if not updated:
+                    raise ValidationError("Reservation was changed by another request")
+
+                self.refresh_daily_stats(previous)
+                notify_vacancy_change(self.parking_space_id, previous['end_datetime'], end_datetime)
+        except ValidationError:
+            self.end_datetime = previous['end_datetime']
+            raise
+
+        self.cost = cost
+        self.host_income = host_income
+        return added_cost
+
+    def refresh_daily_stats(self, previous=None):
+        """
+        Recomputes the daily stats of every day this reservation touches,
+        and of the days it used to touch before it was moved or resized.
+        :param previous: dict with the parking_space_id, start_datetime and
+        end_datetime of the reservation as it was before this write
+        """
+        days_by_parking_space = {}
+        for values in filter(None, [previous, {
+                'parking_space_id': self.parking_space_id,
+                'start_datetime': self.start_datetime,
+                'end_datetime': self.end_datetime}]):
+            if values['parking_space_id'] is not None:
+                days_by_parking_space.setdefault(values['parking_space_id'], set()).update(
+                    ParkingSpaceDailyStats.days_between(values['start_datetime'], values['end_datetime']))
+
+        for parking_space_id, days in days_by_parking_space.items():
+            ParkingSpaceDailyStats.refresh(parking_space_id, days)
+
+    def touch_availabilities(self, previous=None):
+        """
+        Availabilities list their reservations, so their versions (and
+        their parking space's) are bumped whenever a reservation is added
+        to, moved between or removed from them.
+        :param previous: dict with the fixed_availability_id,
+        repeating_availability_id and deleted_at of the reservation as it
+        was before this write
+        """
+        current = {
+            'fixed_availability_id': self.fixed_availability_id,
+            'repeating_availability_id': self.repeating_availability_id,
+            'deleted_at': self.deleted_at,
+        }
+        if previous is not None and all(previous[key] == value for key, value in current.items()):
+            return
+
+        for values in filter(None, [previous, current]):
+            FixedAvailability.touch(values['fixed_availability_id'])
+            RepeatingAvailability.touch(values['repeating_availability_id'])
+        ParkingSpace.touch(self.parking_space_id)
 
     def overlaps_with(self, start_datetime, end_datetime):
         return (self.start_datetime <= end_datetime) and (self.end_datetime >= start_datetime)
@@ -498,6 +742,153 @@ class Reservation(SoftDeletionModel):
                 timezone.localtime(self.end_datetime).strftime("%H:%M on %b %d, %Y"))
 
 
+ArchivedParkingSpace = archive_model_for(ParkingSpace)
+ArchivedReservation = archive_model_for(Reservation)
+
+
+class ParkingSpaceDailyStats(models.Model):
+    """
+    Per-day rollup of a parking space's reservations, kept up to date by
+    Reservation.save so host analytics never have to scan reservations.
+    Days are local days in settings.TIME_ZONE.
+    """
+    parking_space = models.ForeignKey(ParkingSpace, on_delete=models.CASCADE, related_name='daily_stats')
+    day = models.DateField()
+
+    # minutes covered by non-cancelled reservations on this day
+    reserved_minutes = models.PositiveIntegerField(default=0)
+    # the following count reservations that start on this day
+    booking_count = models.PositiveIntegerField(default=0)
+    cancellation_count = models.PositiveIntegerField(default=0)
+    host_income = models.IntegerField(default=0)  # in US cents
+
+    class Meta:
+        unique_together = ('parking_space', 'day')
+        verbose_name_plural = 'parking space daily stats'
+
+    COUNTERS = ('reserved_minutes', 'booking_count', 'cancellation_count', 'host_income')
+
+    @staticmethod
+    def days_between(start_datetime, end_datetime):
+        day = timezone.localdate(start_datetime)
+        last_day = timezone.localdate(end_datetime)
+        days = []
+        while day <= last_day:
+            days.append(day)
+            day += datetime.timedelta(days=1)
+        return days
+
+    @classmethod
+    def refresh(cls, parking_space_id, days):
+        """
+        Recomputes the stats of a parking space for the given days from its
+        reservations, with one aggregate upsert however many days there are.
+        Days no reservation touches get rows of zeros.
+        """
+        if not days:
+            return
+
+        connection = connections[router.db_for_write(cls)]
+        quote_name = connection.ops.quote_name
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO {stats} (parking_space_id, day, reserved_minutes, booking_count, "
+                "cancellation_count, host_income) "
+                "SELECT %(parking_space_id)s, days.day, "
+                "COALESCE(SUM(FLOOR(EXTRACT(EPOCH FROM "
+                "LEAST(r.end_datetime, days.day_end) - GREATEST(r.start_datetime, days.day_start)) / 60)) "
+                "FILTER (WHERE NOT r.cancelled), 0), "
+                "COUNT(r.id) FILTER (WHERE NOT r.cancelled AND r.start_datetime >= days.day_start), "
+                "COUNT(r.id) FILTER (WHERE r.cancelled AND r.start_datetime >= days.day_start), "
+                "COALESCE(SUM(r.host_income) FILTER (WHERE r.start_datetime >= days.day_start), 0) "
+                "FROM ("
+                "SELECT day, day::timestamp AT TIME ZONE %(time_zone)s AS day_start, "
+                "(day + 1)::timestamp AT TIME ZONE %(time_zone)s AS day_end "
+                "FROM unnest(%(days)s::date[]) AS day"
+                ") AS days "
+                "LEFT JOIN {reservations} r ON r.parking_space_id = %(parking_space_id)s "
+                "AND r.deleted_at IS NULL "
+                "AND r.start_datetime < days.day_end AND r.end_datetime > days.day_start "
+                "GROUP BY days.day "
+                "ON CONFLICT (parking_space_id, day) DO UPDATE SET "
+                "reserved_minutes = EXCLUDED.reserved_minutes, "
+                "booking_count = EXCLUDED.booking_count, "
+                "cancellation_count = EXCLUDED.cancellation_count, "
+                "host_income = EXCLUDED.host_income".format(
+                    stats=quote_name(cls._meta.db_table),
+                    reservations=quote_name(Reservation._meta.db_table)),
+                {
+                    'parking_space_id': parking_space_id,
+                    'days': sorted(days),
+                    'time_zone': settings.TIME_ZONE,
+                })
+
+    @classmethod
+    def rebuild(cls, parking_space_id, periods):
+        """
+        Replaces all the stats of a parking space with those of the days its
+        reservations touch, computed by refresh() like live updates are.
+        :param periods: iterable of the (start_datetime, end_datetime) of
+        the parking space's reservations
+        """
+        days = set()
+        for start_datetime, end_datetime in periods:
+            days.update(cls.days_between(start_datetime, end_datetime))
+
+        with transaction.atomic(using=router.db_for_write(cls)):
+            cls.objects.filter(parking_space_id=parking_space_id).delete()
+            cls.refresh(parking_space_id, days)
+
+    def __str__(self):
+        return "%s: %s" % (self.parking_space, self.day)
+
+
 class ParkingSpaceRating(models.Model):
-    value = models.PositiveIntegerField(validators=[MaxValueValidator(5)])
+    value = models.PositiveIntegerField(validators=[MinValueValidator(1), MaxValueValidator(5)])
     parking_space = models.ForeignKey(ParkingSpace, on_delete=models.CASCADE)
+
+    # reservations are partitioned, so the foreign key can't be enforced
+    # by the database
+    reservation = models.OneToOneField(
+        Reservation,
+        on_delete=models.CASCADE,
+        db_constraint=False,
+        null=True,
+        blank=True,
+        related_name='rating')
+
+    def check_reservation_is_completed(self):
+        if self.reservation_id is None:
+            if self._state.adding:
+                raise ValidationError("Ratings must be for a reservation")
+            return
+
+        if not Reservation.objects.filter(
+                pk=self.reservation_id,
+                parking_space_id=self.parking_space_id,
+                cancelled=False,
+                end_datetime__lte=timezone.now()).exists():
+            raise ValidationError("Only completed reservations of the parking space can be rated")
+
+    def save(self, *args, **kwargs):
+        self.check_reservation_is_completed()
+
+        previous = None
+        if not self._state.adding:
+            previous = ParkingSpaceRating.objects.filter(pk=self.pk).values('parking_space_id', 'value').first()
+
+        with transaction.atomic():
+            super(ParkingSpaceRating, self).save(*args, **kwargs)
+
+            if previous is not None:
+                ParkingSpace.add_rating(previous['parking_space_id'], -1, -previous['value'])
+            ParkingSpace.add_rating(self.parking_space_id, 1, self.value)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            ParkingSpace.add_rating(self.parking_space_id, -1, -self.value)
+            return super(ParkingSpaceRating, self).delete(*args, **kwargs)
+
+    def __str__(self):
+        return "%s: %s" % (self.parking_space, self.value)
@@ -0,0 +1,107 @@
+"""
+Helpers for the monthly range partitions of the reservation table.
+
+parking_reservation is partitioned on end_datetime: "current" reservation
+lists, search overlap counts and payouts are all bounded below by
+end_datetime, so Postgres only has to scan the latest partitions. Rows
+outside every monthly partition land in parking_reservation_default.
+"""
+import datetime
+import re
+
+import pytz
+
+
+RESERVATION_TABLE = 'parking_reservation'
+DEFAULT_PARTITION = 'parking_reservation_default'
+
+partition_name_pattern = re.compile(r'^parking_reservation_y(\d{4})m(\d{2})$')
+
+
+def month_start(value):
+    value = value.astimezone(pytz.utc)
+    return datetime.datetime(value.year, value.month, 1, tzinfo=pytz.utc)
+
+
+def add_months(month, months):
+    month_index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=month_index // 12, month=month_index % 12 + 1)
+
+
+def partition_name(month):
+    return '%s_y%04dm%02d' % (RESERVATION_TABLE, month.year, month.month)
+
+
+def partition_month(name):
+    match = partition_name_pattern.match(name)
+    if match is None:
+        return None
+    return datetime.datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=pytz.utc)
+
+
+def attached_partitions(cursor):
+    cursor.execute(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE parent.relname = %s", [RESERVATION_TABLE])
+    return [row[0] for row in cursor.fetchall()]
+
+
+def create_partition(cursor, month):
+    """
+    Creates and attaches the partition holding reservations that end in the
+    given month. Rows for that month that had fallen into the default
+    partition are moved over. Returns False if the partition already exists.
+    """
+    month = month_start(month)
+    name = partition_name(month)
+    if name in attached_partitions(cursor):
+        return False
+
+    lower, upper = month, add_months(month, 1)
+
+    cursor.execute(
+        'CREATE TABLE "%s" (LIKE "%s" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)' % (name, RESERVATION_TABLE))
+    cursor.execute(
+        'WITH moved AS (DELETE FROM "%s" WHERE end_datetime >= %%s AND end_datetime < %%s RETURNING *) '
+        'INSERT INTO "%s" SELECT * FROM moved' % (DEFAULT_PARTITION, name),
+        [lower, upper])
+    cursor.execute(
+        'ALTER TABLE "%s" ATTACH PARTITION "%s" FOR VALUES FROM (%%s) TO (%%s)' % (RESERVATION_TABLE, name),
+        [lower, upper])
+    return True
+
+
+def create_partitions(cursor, first_month, last_month):
+    """
+    Makes sure a partition exists for every month from first_month through
+    last_month. Returns the names of the partitions that were created.
+    """
+    created = []
+    month = month_start(first_month)
+    while month <= month_start(last_month):
+        if create_partition(cursor, month):
+            created.append(partition_name(month))
+        month = add_months(month, 1)
+    return created
+
+
+def detach_partitions_before(cursor, cutoff, drop=False):
+    """
+    Detaches every monthly partition whose reservations all ended before
+    cutoff. Detaching only touches the catalog, so it is instant no matter
+    how large the partition is; the detached table is kept around unless
+    drop is set.
+    """
+    detached = []
+    for name in sorted(attached_partitions(cursor)):
+        month = partition_month(name)
+        if month is None or add_months(month, 1) > cutoff:
+            continue
+
+        cursor.execute('ALTER TABLE "%s" DETACH PARTITION "%s"' % (RESERVATION_TABLE, name))
+        if drop:
+            cursor.execute('DROP TABLE "%s"' % name)
+        detached.append(name)
+    return detached
@@ -0,0 +1,77 @@
+"""
+Server side ranking of map search results.
+
+Every match is given a sort key but only the best `limit` are kept, with a
+bounded heap, so that serializing the response costs O(limit) however many
+parking spaces are in the searched box.
+"""
+import heapq
+
+
+SORTS = ('score', 'distance', 'price', 'rating')
+
+# weights of the normalized distance, price and capacity in the score
+DISTANCE_WEIGHT = 0.5
+PRICE_WEIGHT = 0.35
+CAPACITY_WEIGHT = 0.15
+
+# number of vacant spaces past which a parking space gets no extra credit
+CAPACITY_CAP = 4
+
+
+class Candidate(object):
+    __slots__ = ('parking_space', 'price', 'vacant_spaces', 'distance')
+
+    def __init__(self, parking_space, price, vacant_spaces, distance):
+        self.parking_space = parking_space
+        self.price = price
+        self.vacant_spaces = vacant_spaces
+        self.distance = distance
+
+
+def rating_key(candidate):
+    # best rated first, unrated parking spaces last
+    parking_space = candidate.parking_space
+    return parking_space.rating_count == 0, -(parking_space.get_average_rating() or 0)
+
+
+def score_key(candidates):
+    """
+    Key of the default ranking: a weighted sum of the distance and price,
+    each relative to the largest one among the candidates, minus a bonus for
+    vacant spaces. Lower is better.
+    """
+    max_distance = max((candidate.distance for candidate in candidates), default=0) or 1
+    max_price = max((candidate.price for candidate in candidates), default=0) or 1
+
+    def key(candidate):
+        return (DISTANCE_WEIGHT * candidate.distance / max_distance +
+                PRICE_WEIGHT * candidate.price / max_price -
+                CAPACITY_WEIGHT * min(candidate.vacant_spaces, CAPACITY_CAP) / CAPACITY_CAP)
+
+    return key
+
+
+def top_results(candidates, sort, limit):
+    """
+    The `limit` best candidates for the sort, best first. Ties are broken by
+    distance and then by parking space id so that pages are stable.
+    :param candidates: list of Candidate
+    :param sort: one of SORTS
+    :param limit: maximum number of candidates returned
+    """
+    if sort == 'distance':
+        primary = None
+    elif sort == 'price':
+        def primary(candidate):
+            return candidate.price
+    elif sort == 'rating':
+        primary = rating_key
+    else:
+        primary = score_key(candidates)
+
+    def key(candidate):
+        tie_breaker = (candidate.distance, candidate.parking_space.id)
+        return tie_breaker if primary is None else (primary(candidate),) + tie_breaker
+
+    return heapq.nsmallest(limit, candidates, key=key)
@@ -0,0 +1,52 @@
+"""
+Regions (metros) of parking data.
+
+Every parking space is assigned the region whose bounding box
+(settings.PARKING_REGIONS) contains it. Searches are bounded to a few
+miles, so they only read the regions their box touches, through the
+(region, latitude, longitude) index, and staff reports group by region.
+
+All regions live in the primary database. Moving a region to a database of
+its own would need the foreign keys from parking data to users, hosts and
+vehicles relaxed, and every view that reads parking data to know which
+database to read it from, so there is no routing by region yet.
+"""
+from django.conf import settings
+
+
+# spaces outside every configured region
+OTHER_REGION = 'other'
+
+
+def region_for(latitude, longitude):
+    """
+    The region a location belongs to.
+    :param latitude: degrees
+    :param longitude: degrees
+    :return: region name, OTHER_REGION if no region contains the location
+    """
+    latitude, longitude = float(latitude), float(longitude)
+    for region, (south, west, north, east) in settings.PARKING_REGIONS.items():
+        if south <= latitude <= north and west <= longitude <= east:
+            return region
+    return OTHER_REGION
+
+
+def regions_in_box(bottom_left_lat, bottom_left_long, top_right_lat, top_right_long):
+    """
+    The regions whose bounding box intersects a search box, plus
+    OTHER_REGION when part of the box is outside every region.
+    """
+    regions = []
+    for region, (south, west, north, east) in settings.PARKING_REGIONS.items():
+        if south <= top_right_lat and bottom_left_lat <= north and \
+                west <= top_right_long and bottom_left_long <= east:
+            regions.append(region)
+
+    corners = ((bottom_left_lat, bottom_left_long), (bottom_left_lat, top_right_long),
+               (top_right_lat, bottom_left_long), (top_right_lat, top_right_long))
+    # search boxes are much smaller than regions, so a box that has a corner
+    # outside every region is the only kind that reaches outside them
+    if any(region_for(lat, long) == OTHER_REGION for lat, long in corners):
+        regions.append(OTHER_REGION)
+    return regions
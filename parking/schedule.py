@@ -0,0 +1,105 @@
+"""
+Expansion of a parking space's schedule into concrete calendar events.
+
+Repeating availabilities are expanded one day at a time and fixed
+availabilities and reservations are read with server side cursors, and the
+resulting streams are merged lazily in start order, so memory use does not
+grow with the length of the requested range.
+"""
+import calendar
+import datetime
+import heapq
+from operator import itemgetter
+
+from django.utils import timezone
+
+from .models import FixedAvailability, RepeatingAvailability, Reservation
+
+
+def repeating_occurrences(repeating_availability, range_start, range_end):
+    """
+    Yields the (start, end) of every occurrence of a repeating availability
+    that overlaps the range, in order. Occurrences are in the current time
+    zone, like the rest of the availability checks.
+    """
+    day = timezone.localdate(range_start)
+    last_day = timezone.localdate(range_end)
+
+    while day <= last_day:
+        if calendar.day_name[day.weekday()][:3] in repeating_availability.repeating_days:
+            if repeating_availability.all_day:
+                start_time, end_time, end_day = datetime.time.min, datetime.time.min, day + datetime.timedelta(days=1)
+            else:
+                start_time, end_time, end_day = repeating_availability.start_time, repeating_availability.end_time, day
+
+            start = timezone.make_aware(datetime.datetime.combine(day, start_time), is_dst=False)
+            end = timezone.make_aware(datetime.datetime.combine(end_day, end_time), is_dst=False)
+
+            if start < range_end and end > range_start:
+                yield start, end
+
+        day += datetime.timedelta(days=1)
+
+
+def repeating_events(repeating_availability, range_start, range_end):
+    for start, end in repeating_occurrences(repeating_availability, range_start, range_end):
+        yield {
+            "type": "repeating_availability",
+            "id": repeating_availability.id,
+            "start": start,
+            "end": end,
+            "pricing": repeating_availability.pricing,
+        }
+
+
+def fixed_events(fixed_availabilities):
+    for fixed_availability in fixed_availabilities:
+        yield {
+            "type": "fixed_availability",
+            "id": fixed_availability['id'],
+            "start": timezone.localtime(fixed_availability['start_datetime']),
+            "end": timezone.localtime(fixed_availability['end_datetime']),
+            "pricing": fixed_availability['pricing'],
+        }
+
+
+def reservation_events(reservations):
+    for reservation in reservations:
+        yield {
+            "type": "reservation",
+            "id": reservation['id'],
+            "start": timezone.localtime(reservation['start_datetime']),
+            "end": timezone.localtime(reservation['end_datetime']),
+        }
+
+
+def calendar_events(parking_space, range_start, range_end, chunk_size=500):
+    """
+    Generates the availability occurrences and reservations of a parking
+    space that overlap the range, sorted by start.
+    :param parking_space: ParkingSpace instance
+    :param range_start: aware datetime
+    :param range_end: aware datetime
+    :param chunk_size: number of rows fetched at a time from each table
+    """
+    repeating_availabilities = RepeatingAvailability.objects.filter(parking_space=parking_space)
+
+    fixed_availabilities = FixedAvailability.objects.filter(
+        parking_space=parking_space,
+        start_datetime__lt=range_end,
+        end_datetime__gt=range_start).order_by('start_datetime').values(
+        'id', 'start_datetime', 'end_datetime', 'pricing')
+
+    reservations = Reservation.objects.filter(
+        parking_space=parking_space,
+        start_datetime__lt=range_end,
+        end_datetime__gt=range_start,
+        cancelled=False).order_by('start_datetime').values(
+        'id', 'start_datetime', 'end_datetime')
+
+    streams = [repeating_events(repeating_availability, range_start, range_end)
+               for repeating_availability in repeating_availabilities]
+    streams.append(fixed_events(fixed_availabilities.iterator(chunk_size=chunk_size)))
+    streams.append(reservation_events(reservations.iterator(chunk_size=chunk_size)))
+
+    return heapq.merge(*streams, key=itemgetter('start'))
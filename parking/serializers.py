@@ -1,10 +1,12 @@
 from rest_framework import serializers
 
+from api.general_serializers import SparseFieldsMixin
+
 from .serializer_fields import StringArrayField, VehicleField, ParkingSpaceField
 from .models import ParkingSpace, ParkingSpaceImage, FixedAvailability, RepeatingAvailability, Reservation
 
 
-class FixedAvailabilitySerializer(serializers.ModelSerializer):
+class FixedAvailabilitySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     parking_space = ParkingSpaceField()
     reservation_set = serializers.HyperlinkedRelatedField(
         many=True,
@@ -29,7 +31,7 @@ class FixedAvailabilitySerializer(serializers.ModelSerializer):
         return value
 
 
-class RepeatingAvailabilitySerializer(serializers.ModelSerializer):
+class RepeatingAvailabilitySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     parking_space = ParkingSpaceField()
     reservation_set = serializers.HyperlinkedRelatedField(
         many=True,
@@ -51,13 +53,15 @@ class RepeatingAvailabilitySerializer(serializers.ModelSerializer):
         return value
 
 
-class ParkingSpaceSerializer(serializers.ModelSerializer):
+class ParkingSpaceSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     url = serializers.HyperlinkedIdentityField(view_name='parkingspace-detail')
     fixedavailability_set = FixedAvailabilitySerializer(
         many=True, read_only=True)
     repeatingavailability_set = RepeatingAvailabilitySerializer(
         many=True, read_only=True)
     images = serializers.SerializerMethodField()
+    field_lookups = {'images': ('images',)}
+    average_rating = serializers.ReadOnlyField(source='get_average_rating')
     # reservations = ReservationSerializer(
     #     many=True,
     #     read_only=True)
@@ -66,30 +70,79 @@ class ParkingSpaceSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = ParkingSpace
-        fields = '__all__'
+        # change tracking columns are internal, see curbd.sync
+        exclude = ('change_seq', 'change_xid')
         read_only_fields = ('host',)
 
     def get_images(self, parking_space):
         return [parking_space_image.image.url for parking_space_image in parking_space.images.all()]
 
 
-class ParkingSpaceMinimalSerializer(serializers.ModelSerializer):
+class ParkingSpaceMinimalSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     features = StringArrayField()
     # TODO: add validation for features
 
     images = serializers.SerializerMethodField()
+    field_lookups = {'images': ('images',)}
+    average_rating = serializers.ReadOnlyField(source='get_average_rating')
 
     class Meta:
         model = ParkingSpace
         fields = ('id', 'name', 'latitude', 'longitude', 'features',
                   'instructions', 'size', 'available_spaces', 'images',
-                  "physical_type", "legal_type", "is_active")
+                  "physical_type", "legal_type", "is_active",
+                  'average_rating', 'rating_count')
 
     def get_images(self, parking_space):
         return [parking_space_image.image.url for parking_space_image in parking_space.images.all()]
 
 
-class ReservationSerializer(serializers.ModelSerializer):
+# fixed-point scale of the coordinates in columnar search results
+COORDINATE_SCALE = 10 ** 6
+
+
+def search_result_columns(results):
+    """
+    Lays out map search results column by column for the compact search
+    format: one array per field instead of one object per parking space.
+    Coordinates are fixed-point integers (degrees * coordinate_scale),
+    features are bitmasks over feature_names and unrated parking spaces
+    have a null average rating. Clients fetch everything else
+    from the parking space detail endpoint when a result is opened.
+    :param results: list of (parking_space, price) tuples
+    :return: dict of columns
+    """
+    feature_names = [feature for feature, _ in ParkingSpace.FEATURES]
+    feature_bits = {feature: 1 << index for index, feature in enumerate(feature_names)}
+
+    columns = {
+        'count': len(results),
+        'coordinate_scale': COORDINATE_SCALE,
+        'feature_names': feature_names,
+        'ids': [],
+        'latitudes': [],
+        'longitudes': [],
+        'sizes': [],
+        'prices': [],
+        'features': [],
+        'average_ratings': [],
+        'rating_counts': [],
+    }
+
+    for parking_space, price in results:
+        columns['ids'].append(parking_space.id)
+        columns['latitudes'].append(int(parking_space.latitude * COORDINATE_SCALE))
+        columns['longitudes'].append(int(parking_space.longitude * COORDINATE_SCALE))
+        columns['sizes'].append(parking_space.size)
+        columns['prices'].append(price)
+        columns['features'].append(sum(feature_bits.get(feature, 0) for feature in parking_space.features or ()))
+        columns['average_ratings'].append(parking_space.get_average_rating())
+        columns['rating_counts'].append(parking_space.rating_count)
+
+    return columns
+
+
+class ReservationSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     from accounts.serializers import VehicleMinimalSerializer, UserDetailSerializer
 
     vehicle = VehicleField(write_only=True)
@@ -111,8 +164,8 @@ class ReservationSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Reservation
-        fields = '__all__'
-        # exclude = ('for_repeating',)
+        # change tracking columns are internal, see curbd.sync
+        exclude = ('change_seq', 'change_xid')
         read_only_fields = ('fixed_availability', 'repeating_availability', 'cost', 'host_income')
         depth = 1
 
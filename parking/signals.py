@@ -0,0 +1,25 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import FixedAvailability, ParkingSpace, RepeatingAvailability, Reservation
+from .vacancy import notify_vacancy_change
+
+
+@receiver(post_save, sender=Reservation)
+@receiver(post_delete, sender=Reservation)
+@receiver(post_save, sender=FixedAvailability)
+@receiver(post_delete, sender=FixedAvailability)
+def vacancy_changed_between(sender, instance, **kwargs):
+    notify_vacancy_change(instance.parking_space_id, instance.start_datetime, instance.end_datetime)
+
+
+@receiver(post_save, sender=RepeatingAvailability)
+@receiver(post_delete, sender=RepeatingAvailability)
+def vacancy_changed(sender, instance, **kwargs):
+    notify_vacancy_change(instance.parking_space_id)
+
+
+@receiver(post_save, sender=ParkingSpace)
+def parking_space_changed(sender, instance, **kwargs):
+    # e.g. activated, deactivated, deleted or given more spaces
+    notify_vacancy_change(instance.pk)
@@ -1,3 +1,1405 @@
-from django.test import TestCase
+import calendar
+import csv
+import datetime
+import json
+import os
+import queue
+import shutil
+import tempfile
+import threading
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.core.signals import request_finished
+from django.db import IntegrityError, close_old_connections, connection, connections, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+import msgpack
+import pytz
+from rest_framework.pagination import PageNumberPagination
+
+from accounts.models import User, Host, Vehicle
+from api.general_mixins import DeltaSyncMixin
+from curbd.sync import SyncToken
+from curbd.testing import FakeStripeCustomerMixin, ParkingFixturesMixin
+from .management.commands.profile_imports import import_times
+from payment.helpers import calculate_customer_price
+from .models import (
+    ParkingSpace, ParkingSpaceDailyStats, ParkingSpaceRating, FixedAvailability, RepeatingAvailability, Reservation)
+from .ranking import Candidate, top_results
+from .regions import region_for, regions_in_box
+from . import partitioning
+from .exports import EXPORT_COLUMNS
+from .schedule import calendar_events
+from .vacancy import CHANNEL, Subscription, VacancyBus
+
+
+class AdminChangelistQueryCountTests(FakeStripeCustomerMixin, TestCase):
+    """
+    The admin changelists must run the same number of queries no matter how
+    many rows are listed.
+    """
+
+    def setUp(self):
+        super(AdminChangelistQueryCountTests, self).setUp()
+        self.admin = User.objects.create_superuser(
+            'admin@curbdparking.com', 'password', first_name='Ad', last_name='Min', phone_number='0')
+        self.client.force_login(self.admin)
+        self.row_count = 0
+
+    def add_rows(self, count):
+        now = timezone.now()
+
+        for _ in range(count):
+            self.row_count += 1
+            user = User.objects.create(
+                email='user%s@curbdparking.com' % self.row_count, first_name='F', last_name='L',
+                phone_number=str(self.row_count))
+            host = Host.objects.create(user=user)
+            parking_space = ParkingSpace.objects.create(
+                host=host, latitude=34, longitude=-118, size=3, name='Space %s' % self.row_count,
+                physical_type='Driveway', legal_type='Residential', is_active=True)
+            fixed_availability = FixedAvailability.objects.create(
+                parking_space=parking_space,
+                start_datetime=now, end_datetime=now + datetime.timedelta(days=1))
+            RepeatingAvailability.objects.create(
+                parking_space=parking_space, repeating_days=['Mon'], all_day=True)
+            vehicle = Vehicle.objects.create(
+                customer=user.customer, color='Red', year='2010', make='Honda', model='Civic', size=2,
+                license_plate='PLATE%s' % self.row_count)
+            Reservation.objects.create(
+                vehicle=vehicle, fixed_availability=fixed_availability,
+                start_datetime=now + datetime.timedelta(hours=1), end_datetime=now + datetime.timedelta(hours=2))
+
+    def changelist_query_count(self, model):
+        url = reverse('admin:%s_%s_changelist' % (model._meta.app_label, model._meta.model_name))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assertChangelistQueryCountIsConstant(self, model):
+        self.add_rows(2)
+        few_rows = self.changelist_query_count(model)
+        self.add_rows(5)
+        more_rows = self.changelist_query_count(model)
+
+        self.assertEqual(few_rows, more_rows)
+        self.assertLessEqual(more_rows, 10)
+
+    def test_parking_space_changelist(self):
+        self.assertChangelistQueryCountIsConstant(ParkingSpace)
+
+    def test_fixed_availability_changelist(self):
+        self.assertChangelistQueryCountIsConstant(FixedAvailability)
+
+    def test_repeating_availability_changelist(self):
+        self.assertChangelistQueryCountIsConstant(RepeatingAvailability)
+
+    def test_reservation_changelist(self):
+        self.assertChangelistQueryCountIsConstant(Reservation)
+
+    def test_vehicle_changelist(self):
+        self.assertChangelistQueryCountIsConstant(Vehicle)
+
+    def test_user_changelist(self):
+        self.assertChangelistQueryCountIsConstant(User)
+
+
+class ReservationListQueryCountTests(FakeStripeCustomerMixin, TestCase):
+    """
+    The reservation list endpoints must run the same number of queries for
+    a page of 100 reservations as for a page of 10.
+    """
+
+    def setUp(self):
+        super(ReservationListQueryCountTests, self).setUp()
+
+        # the user hosts every parking space and reserves them all
+        self.user = User.objects.create(
+            email='host@curbdparking.com', first_name='F', last_name='L', phone_number='0')
+        self.host = Host.objects.create(user=self.user)
+        self.client.force_login(self.user)
+        self.row_count = 0
+
+    def add_reservations(self, count):
+        now = timezone.now()
+
+        for _ in range(count):
+            self.row_count += 1
+            parking_space = ParkingSpace.objects.create(
+                host=self.host, latitude=34, longitude=-118, size=3, name='Space %s' % self.row_count,
+                physical_type='Driveway', legal_type='Residential', is_active=True)
+            fixed_availability = FixedAvailability.objects.create(
+                parking_space=parking_space,
+                start_datetime=now, end_datetime=now + datetime.timedelta(days=1))
+            vehicle = Vehicle.objects.create(
+                customer=self.user.customer, color='Red', year='2010', make='Honda', model='Civic', size=2,
+                license_plate='PLATE%s' % self.row_count)
+            Reservation.objects.create(
+                vehicle=vehicle, fixed_availability=fixed_availability,
+                start_datetime=now + datetime.timedelta(hours=1), end_datetime=now + datetime.timedelta(hours=2))
+
+    def list_query_count(self, url_name, page_size):
+        with mock.patch.object(PageNumberPagination, 'page_size', page_size), \
+                CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(url_name), {'format': 'json'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), page_size)
+        return len(queries)
+
+    def assertListQueryCountIsConstant(self, url_name):
+        self.add_reservations(10)
+        page_of_10 = self.list_query_count(url_name, 10)
+        self.add_reservations(90)
+        page_of_100 = self.list_query_count(url_name, 100)
+
+        self.assertEqual(page_of_10, page_of_100)
+        self.assertLessEqual(page_of_100, 12)
+
+    def test_reservation_list(self):
+        self.assertListQueryCountIsConstant('reservation-list')
+
+    def test_host_current_reservations(self):
+        self.assertListQueryCountIsConstant('host-self-reservations-current')
+
+    def test_customer_current_reservations(self):
+        self.assertListQueryCountIsConstant('customer-self-reservations-current')
+
+
+class ColdStartTests(SimpleTestCase):
+    """
+    Starting Django (every worker boot and management command) must not
+    import the third-party clients that are initialized on first use.
+    """
+    lazy_modules = ('stripe', 'timezonefinder', 'numpy', 'google.oauth2', 'google.cloud')
+
+    def test_manage_py_check(self):
+        returncode, modules = import_times(['manage.py', 'check'])
+        self.assertEqual(returncode, 0)
+
+        imported = {name for name, _, _, _ in modules}
+        for module in self.lazy_modules:
+            self.assertNotIn(module, imported)
+
+
+class DeltaSyncTests(ParkingFixturesMixin, TestCase):
+    """
+    Listing with ?since=<sync token> returns the rows that changed since the
+    token and the ids of those that left the list.
+    """
+
+    def setUp(self):
+        super(DeltaSyncTests, self).setUp()
+        self.now = timezone.now()
+        self.user = self.create_user(host=True)
+        self.parking_space = self.create_parking_space(self.user)
+        self.availability = self.create_fixed_availability(
+            self.parking_space, self.now - datetime.timedelta(days=1), self.now + datetime.timedelta(days=1))
+        self.vehicle = self.create_vehicle(self.user)
+        self.client.force_login(self.user)
+
+    def reserve_hours(self, start_hours, end_hours):
+        return self.reserve(self.vehicle, self.availability, self.now + datetime.timedelta(hours=start_hours),
+                            self.now + datetime.timedelta(hours=end_hours))
+
+    def token(self, **changes):
+        """
+        A token taken now. The test's writes are all made by the transaction
+        of the test case, which is still running, so its id is moved past
+        them as if they had committed before the token was taken.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT txid_current()')
+            xmin = cursor.fetchone()[0] + 1
+        return SyncToken.current()._replace(xmin=xmin, **changes).encode()
+
+    def delta(self, url_name, since, **kwargs):
+        response = self.client.get(reverse(url_name, **kwargs), {'since': since, 'format': 'json'})
+        self.assertEqual(response.status_code, 200)
+        return [row['id'] for row in response.data['results']], response.data['removed']
+
+    def test_lists_carry_a_token(self):
+        self.reserve_hours(1, 2)
+        response = self.client.get(reverse('host-self-reservations-current'), {'format': 'json'})
+
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertGreater(SyncToken.decode(response.data['sync_token']).xmin, 0)
+        self.assertNotIn('change_seq', response.data['results'][0])
+
+    def test_only_changed_rows_are_returned(self):
+        changed = self.reserve_hours(1, 2)
+        self.reserve_hours(3, 4)
+        since = self.token()
+
+        self.assertEqual(self.delta('host-self-reservations-current', since), ([], []))
+
+        Reservation.objects.filter(pk=changed.pk).update(payment_method_info='card')
+        self.assertEqual(self.delta('host-self-reservations-current', since), ([changed.pk], []))
+
+    def test_deleted_and_cancelled_rows_are_removed(self):
+        other_space = self.create_parking_space(self.user)
+        cancelled = self.reserve_hours(1, 2)
+        since = self.token()
+
+        other_space.delete()
+        Reservation.objects.filter(pk=cancelled.pk).update(cancelled=True)
+
+        self.assertEqual(self.delta('host-self-parkingspaces', since), ([], [other_space.pk]))
+        self.assertEqual(self.delta('customer-self-reservations-current', since), ([], [cancelled.pk]))
+
+    def test_ended_reservations_move_from_current_to_previous(self):
+        # the reservation ended after the token was taken, without any write
+        ended = self.reserve_hours(-2, -1)
+        since = self.token(time=int((self.now - datetime.timedelta(hours=3)).timestamp() * 1000000))
+
+        self.assertEqual(self.delta('customer-self-reservations-current', since), ([], [ended.pk]))
+        self.assertEqual(self.delta('customer-self-reservations-previous', since), ([ended.pk], []))
+        self.assertEqual(self.delta('parkingspace-reservations-previous', since, args=[self.parking_space.pk]),
+                         ([ended.pk], []))
+
+    def test_token_expires_when_too_much_changed(self):
+        since = self.token()
+        self.reserve_hours(1, 2)
+        self.reserve_hours(3, 4)
+
+        with mock.patch.object(DeltaSyncMixin, 'sync_limit', 1):
+            response = self.client.get(reverse('host-self-reservations-current'), {'since': since})
+        self.assertEqual(response.status_code, 410)
+
+    def test_invalid_token(self):
+        response = self.client.get(reverse('host-self-reservations-current'), {'since': 'not a token'})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(PARKING_REGIONS={'los-angeles': (33.40, -119.00, 34.85, -117.40)})
+class RegionTests(ParkingFixturesMixin, TestCase):
+
+    def test_region_for(self):
+        self.assertEqual(region_for(34.05, -118.25), 'los-angeles')
+        self.assertEqual(region_for('34.05', '-118.25'), 'los-angeles')
+        self.assertEqual(region_for(40.71, -74.00), 'other')
+
+    def test_regions_in_box(self):
+        self.assertEqual(regions_in_box(34.0, -118.3, 34.1, -118.2), ['los-angeles'])
+        self.assertEqual(regions_in_box(40.7, -74.1, 40.8, -74.0), ['other'])
+        # a corner past the region's northern edge
+        self.assertEqual(regions_in_box(34.8, -118.3, 34.9, -118.2), ['los-angeles', 'other'])
+
+    def test_parking_spaces_are_assigned_a_region(self):
+        parking_space = self.create_parking_space(self.create_user(host=True))
+        self.assertEqual(parking_space.region, 'los-angeles')
+
+        parking_space.latitude, parking_space.longitude = 40.71, -74.00
+        parking_space.save(update_fields=['latitude', 'longitude'])
+        parking_space.refresh_from_db()
+        self.assertEqual(parking_space.region, 'other')
+
+    def test_region_report(self):
+        user = self.create_user(host=True)
+        now = timezone.now()
+        availability = self.create_fixed_availability(
+            self.create_parking_space(user), now, now + datetime.timedelta(days=1))
+        self.create_parking_space(user, latitude=40.71, longitude=-74.00, is_active=False)
+        self.reserve(self.create_vehicle(user), availability, now + datetime.timedelta(hours=1),
+                     now + datetime.timedelta(hours=2))
+
+        stdout = StringIO()
+        call_command('region_report', stdout=stdout)
+
+        self.assertEqual([line.split() for line in stdout.getvalue().splitlines()], [
+            ['region', 'spaces', 'active', 'upcoming'],
+            ['los-angeles', '1', '1', '1'],
+            ['other', '1', '0', '0'],
+        ])
+
+
+class RankingTests(SimpleTestCase):
+
+    def candidate(self, id, price=100, vacant_spaces=1, distance=1.0, rating_sum=0, rating_count=0):
+        parking_space = ParkingSpace(id=id, rating_sum=rating_sum, rating_count=rating_count)
+        return Candidate(parking_space, price, vacant_spaces, distance)
+
+    def ranked_ids(self, candidates, sort, limit=10):
+        return [candidate.parking_space.id for candidate in top_results(candidates, sort, limit)]
+
+    def test_distance(self):
+        candidates = [self.candidate(1, distance=2), self.candidate(3, distance=1), self.candidate(2, distance=1)]
+        self.assertEqual(self.ranked_ids(candidates, 'distance'), [2, 3, 1])
+
+    def test_price(self):
+        candidates = [self.candidate(1, price=300), self.candidate(2, price=100, distance=2),
+                      self.candidate(3, price=100, distance=1)]
+        self.assertEqual(self.ranked_ids(candidates, 'price'), [3, 2, 1])
+
+    def test_rating(self):
+        candidates = [self.candidate(1), self.candidate(2, rating_sum=8, rating_count=2),
+                      self.candidate(3, rating_sum=5, rating_count=1)]
+        # unrated parking spaces come last
+        self.assertEqual(self.ranked_ids(candidates, 'rating'), [3, 2, 1])
+
+    def test_score(self):
+        candidates = [
+            self.candidate(1, price=100, distance=1),
+            self.candidate(2, price=1000, distance=0.5),
+            # far, but with room for more vehicles
+            self.candidate(3, price=100, distance=2, vacant_spaces=4),
+        ]
+        self.assertEqual(self.ranked_ids(candidates, 'score'), [1, 3, 2])
+
+    def test_limit(self):
+        candidates = [self.candidate(id, distance=id) for id in range(1, 6)]
+
+        self.assertEqual(self.ranked_ids(candidates, 'distance', limit=2), [1, 2])
+        self.assertEqual(self.ranked_ids(candidates, 'distance', limit=10), [1, 2, 3, 4, 5])
+        self.assertEqual(self.ranked_ids([], 'score'), [])
+
+
+class ParkingSpaceSearchTests(ParkingFixturesMixin, TestCase):
+
+    def setUp(self):
+        super(ParkingSpaceSearchTests, self).setUp()
+        now = timezone.now()
+        host = self.create_user(host=True)
+        self.near = self.create_parking_space(host, latitude=34.05, longitude=-118.25)
+        self.far = self.create_parking_space(host, latitude=34.06, longitude=-118.24)
+        for parking_space in (self.near, self.far):
+            self.create_fixed_availability(
+                parking_space, now - datetime.timedelta(days=1), now + datetime.timedelta(days=1))
+        self.params = {
+            'bl_lat': 34.0, 'bl_long': -118.3, 'tr_lat': 34.1, 'tr_long': -118.2,
+            'start': (now + datetime.timedelta(hours=1)).isoformat(),
+            'end': (now + datetime.timedelta(hours=2)).isoformat(),
+            'lat': 34.05, 'long': -118.25, 'format': 'json',
+        }
+
+    def search(self, **params):
+        return self.client.get(reverse('parkingspace=search'), dict(self.params, **params))
+
+    def test_results_are_limited(self):
+        response = self.search(sort='distance', limit=1)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(response.data['total'], 2)
+        self.assertEqual(response.data['results'][0]['parking_space']['id'], self.near.id)
+
+    def test_limit_bounds(self):
+        self.assertEqual(self.search(limit=500).status_code, 200)
+        for limit in (0, 501, 'ten'):
+            self.assertEqual(self.search(limit=limit).status_code, 400)
+
+    def test_unknown_sort(self):
+        self.assertEqual(self.search(sort='popularity').status_code, 400)
+
+    def test_invalid_origin(self):
+        self.assertEqual(self.search(lat='north').status_code, 400)
+        self.assertEqual(self.search(long='').status_code, 400)
+
+
+class SearchResultColumnsTests(ParkingFixturesMixin, TestCase):
+    """
+    Clients that accept MessagePack get the search results column by column.
+    """
+
+    def setUp(self):
+        super(SearchResultColumnsTests, self).setUp()
+        now = timezone.now()
+        host = self.create_user(host=True)
+        self.rated = self.create_parking_space(
+            host, latitude=34.051234, longitude=-118.254321, features=['Illuminated', 'Gated'],
+            rating_count=2, rating_sum=9)
+        self.unrated = self.create_parking_space(host, latitude=34.06, longitude=-118.24, features=None)
+        for parking_space in (self.rated, self.unrated):
+            self.create_fixed_availability(
+                parking_space, now - datetime.timedelta(days=1), now + datetime.timedelta(days=1))
+        self.params = {
+            'bl_lat': 34.0, 'bl_long': -118.3, 'tr_lat': 34.1, 'tr_long': -118.2,
+            'start': (now + datetime.timedelta(hours=1)).isoformat(),
+            'end': (now + datetime.timedelta(hours=2)).isoformat(),
+            'lat': 34.05, 'long': -118.25, 'sort': 'distance',
+        }
+
+    def search(self, **params):
+        return self.client.get(reverse('parkingspace=search'), dict(self.params, **params))
+
+    def unpack(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-msgpack')
+        return msgpack.unpackb(response.content, raw=False)
+
+    def test_negotiation(self):
+        by_header = self.unpack(self.client.get(
+            reverse('parkingspace=search'), self.params, HTTP_ACCEPT='application/x-msgpack'))
+        by_format = self.unpack(self.search(format='msgpack'))
+
+        # tokens hold the time they were taken
+        by_header.pop('sync_token')
+        by_format.pop('sync_token')
+        self.assertEqual(by_header, by_format)
+        self.assertEqual(self.search(format='json')['Content-Type'], 'application/json')
+
+    def test_columns(self):
+        columns = self.unpack(self.search(format='msgpack'))
+
+        feature_names = columns['feature_names']
+        self.assertEqual(feature_names, [feature for feature, _ in ParkingSpace.FEATURES])
+        self.assertEqual(columns['count'], 2)
+        self.assertEqual(columns['ids'], [self.rated.pk, self.unrated.pk])
+        self.assertEqual(columns['coordinate_scale'], 10 ** 6)
+        self.assertEqual(columns['latitudes'], [34051234, 34060000])
+        self.assertEqual(columns['longitudes'], [-118254321, -118240000])
+        self.assertEqual(columns['sizes'], [3, 3])
+        self.assertEqual(columns['features'], [
+            1 << feature_names.index('Illuminated') | 1 << feature_names.index('Gated'), 0])
+        self.assertEqual(columns['average_ratings'], [4.5, None])
+        self.assertEqual(columns['rating_counts'], [2, 0])
+        self.assertEqual(len(columns['prices']), 2)
+
+    def test_sync(self):
+        columns = self.unpack(self.search(format='msgpack'))
+        self.assertNotIn('removed', columns)
+
+        # as in DeltaSyncTests.token, the test's writes so far count as committed
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT txid_current()')
+            xmin = cursor.fetchone()[0] + 1
+        since = SyncToken.decode(columns['sync_token'])._replace(xmin=xmin).encode()
+
+        self.unrated.is_active = False
+        self.unrated.save()
+        columns = self.unpack(self.search(format='msgpack', since=since))
+
+        self.assertEqual(columns['ids'], [])
+        self.assertEqual(columns['removed'], [self.unrated.pk])
+        self.assertIsInstance(columns['sync_token'], str)
+
+    def test_json_is_unchanged(self):
+        from .serializers import ParkingSpaceMinimalSerializer
+
+        response = self.search(format='json')
+
+        self.assertEqual(set(response.data), {'count', 'total', 'results', 'sync_token'})
+        self.assertEqual(set(response.data['results'][0]), {'parking_space', 'price', 'distance'})
+        self.assertEqual(response.data['results'][0]['parking_space'],
+                         ParkingSpaceMinimalSerializer(self.rated).data)
+        self.assertEqual(response.data['results'][1]['parking_space']['average_rating'], None)
+
+
+class ConditionalGetTests(ParkingFixturesMixin, TestCase):
+    """
+    Reads answer 304 Not Modified while the ETag they sent still matches,
+    and writes to a parking space's availabilities change its ETag.
+    """
+
+    def setUp(self):
+        super(ConditionalGetTests, self).setUp()
+        self.now = timezone.now()
+        self.user = self.create_user(host=True)
+        self.parking_space = self.create_parking_space(self.user)
+        self.availability = self.create_fixed_availability(
+            self.parking_space, self.now, self.now + datetime.timedelta(days=1))
+        self.client.force_login(self.user)
+
+    def get(self, url, etag=None):
+        headers = {} if etag is None else {'HTTP_IF_NONE_MATCH': etag}
+        return self.client.get(url, {'format': 'json'}, **headers)
+
+    def assertRevalidates(self, url):
+        response = self.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        not_modified = self.get(url, etag=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b'')
+        return response['ETag']
+
+    def test_list(self):
+        url = reverse('parkingspace-fixedavailabilities', args=[self.parking_space.pk])
+        etag = self.assertRevalidates(url)
+
+        self.create_fixed_availability(
+            self.parking_space, self.now + datetime.timedelta(days=2), self.now + datetime.timedelta(days=3))
+        response = self.get(url, etag=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_detail(self):
+        url = reverse('parkingspace-detail', args=[self.parking_space.pk])
+        self.assertRevalidates(url)
+        self.assertIn('Last-Modified', self.get(url))
+
+    def test_availability_writes_change_the_parking_space_etag(self):
+        url = reverse('parkingspace-detail', args=[self.parking_space.pk])
+        etag = self.assertRevalidates(url)
+
+        self.availability.pricing = 300
+        self.availability.save()
+        response = self.get(url, etag=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        etag = response['ETag']
+        self.availability.delete()
+        self.assertEqual(self.get(url, etag=etag).status_code, 200)
+
+
+class ArchiveDeletedTests(ParkingFixturesMixin, TestCase):
+
+    def setUp(self):
+        super(ArchiveDeletedTests, self).setUp()
+        now = timezone.now()
+        self.long_ago = now - datetime.timedelta(days=100)
+        self.user = self.create_user(host=True)
+        self.parking_space = self.create_parking_space(self.user)
+        self.availability = self.create_fixed_availability(
+            self.parking_space, now, now + datetime.timedelta(days=1))
+
+    def reserve_hours(self, vehicle, start_hours, end_hours):
+        now = timezone.now()
+        return self.reserve(vehicle, self.availability, now + datetime.timedelta(hours=start_hours),
+                            now + datetime.timedelta(hours=end_hours))
+
+    def archive(self):
+        call_command('archive_deleted', stdout=StringIO())
+
+    def assertArchived(self, model, instance):
+        self.assertFalse(model.all_objects.filter(pk=instance.pk).exists())
+        self.assertEqual([row.pk for row in model.all_objects.with_archived(pk=instance.pk)], [instance.pk])
+
+    def assertKept(self, model, instance):
+        self.assertTrue(model.all_objects.filter(pk=instance.pk).exists())
+
+    def test_long_deleted_rows_are_archived(self):
+        parking_space = self.create_parking_space(self.user)
+        vehicle = self.create_vehicle(self.user)
+        reservation = self.reserve_hours(vehicle, 1, 2)
+        for model, instance in ((ParkingSpace, parking_space), (Vehicle, vehicle), (Reservation, reservation)):
+            model.all_objects.filter(pk=instance.pk).update(deleted_at=self.long_ago)
+
+        self.archive()
+
+        # the vehicle goes in the same run as the reservation that referenced it
+        self.assertArchived(ParkingSpace, parking_space)
+        self.assertArchived(Vehicle, vehicle)
+        self.assertArchived(Reservation, reservation)
+
+    def test_ended_cancelled_reservations_are_archived(self):
+        vehicle = self.create_vehicle(self.user)
+        cancelled = self.reserve_hours(vehicle, 1, 2)
+        ended = self.reserve_hours(vehicle, 3, 4)
+        Reservation.objects.filter(pk__in=[cancelled.pk, ended.pk]).update(
+            start_datetime=self.long_ago, end_datetime=self.long_ago + datetime.timedelta(hours=1))
+        Reservation.objects.filter(pk=cancelled.pk).update(cancelled=True)
+
+        self.archive()
+
+        self.assertArchived(Reservation, cancelled)
+        self.assertKept(Reservation, ended)
+
+    def test_recent_and_referenced_rows_are_kept(self):
+        vehicle = self.create_vehicle(self.user)
+        recently_deleted = self.create_vehicle(self.user)
+        reservation = self.reserve_hours(vehicle, 1, 2)
+        Vehicle.all_objects.filter(pk=vehicle.pk).update(deleted_at=self.long_ago)
+        ParkingSpace.all_objects.filter(pk=self.parking_space.pk).update(deleted_at=self.long_ago)
+        recently_deleted.delete()
+
+        self.archive()
+
+        # still referenced by a live reservation or availability
+        self.assertKept(Vehicle, vehicle)
+        self.assertKept(ParkingSpace, self.parking_space)
+        self.assertKept(Vehicle, recently_deleted)
+        self.assertKept(Reservation, reservation)
+
+
+class DailyStatsTests(ParkingFixturesMixin, TestCase):
+
+    def setUp(self):
+        super(DailyStatsTests, self).setUp()
+        self.day = timezone.localdate() + datetime.timedelta(days=2)
+        self.user = self.create_user(host=True)
+        self.parking_space = self.create_parking_space(self.user)
+        self.availability = self.create_fixed_availability(
+            self.parking_space, self.local(0, 0), self.local(3, 0))
+        self.vehicle = self.create_vehicle(self.user)
+
+    def local(self, days, hour, minute=0):
+        return timezone.make_aware(datetime.datetime.combine(
+            self.day + datetime.timedelta(days=days), datetime.time(hour, minute)))
+
+    def stats(self):
+        return {
+            row.day: {counter: getattr(row, counter) for counter in ParkingSpaceDailyStats.COUNTERS}
+            for row in ParkingSpaceDailyStats.objects.filter(parking_space=self.parking_space)}
+
+    def reserve_overnight(self):
+        # 22:00 to 01:30 the next day, and a cancelled hour on the second day
+        overnight = self.reserve(self.vehicle, self.availability, self.local(0, 22), self.local(1, 1, 30))
+        cancelled = self.reserve(self.vehicle, self.availability, self.local(1, 10), self.local(1, 11))
+        cancelled.cancelled = True
+        cancelled.save()
+        overnight.refresh_from_db()
+        cancelled.refresh_from_db()
+        return overnight, cancelled
+
+    def test_reservation_writes_refresh_the_days_they_touch(self):
+        overnight, cancelled = self.reserve_overnight()
+
+        stats = self.stats()
+        self.assertEqual(set(stats), {self.day, self.day + datetime.timedelta(days=1)})
+        self.assertEqual(stats[self.day], {
+            'reserved_minutes': 120, 'booking_count': 1, 'cancellation_count': 0,
+            'host_income': overnight.host_income})
+        self.assertEqual(stats[self.day + datetime.timedelta(days=1)], {
+            'reserved_minutes': 90, 'booking_count': 0, 'cancellation_count': 1,
+            'host_income': cancelled.host_income})
+
+    def test_moved_reservations_empty_the_days_they_left(self):
+        overnight, _ = self.reserve_overnight()
+
+        overnight.start_datetime = self.local(2, 8)
+        overnight.end_datetime = self.local(2, 9)
+        overnight.save()
+
+        stats = self.stats()
+        self.assertEqual(stats[self.day], dict.fromkeys(ParkingSpaceDailyStats.COUNTERS, 0))
+        self.assertEqual(stats[self.day + datetime.timedelta(days=2)]['reserved_minutes'], 60)
+
+    def test_refresh_is_a_single_query(self):
+        self.reserve_overnight()
+        days = [self.day + datetime.timedelta(days=offset) for offset in range(-10, 10)]
+
+        with self.assertNumQueries(1):
+            ParkingSpaceDailyStats.refresh(self.parking_space.pk, days)
+        self.assertEqual(len(self.stats()), 20)
+
+    def test_backfill(self):
+        self.reserve_overnight()
+        expected = self.stats()
+        ParkingSpaceDailyStats.objects.all().delete()
+
+        call_command('backfill_daily_stats', stdout=StringIO())
+
+        self.assertEqual(self.stats(), expected)
+
+    def test_backfill_clears_stale_stats(self):
+        self.reserve_overnight()
+        other = self.create_parking_space(self.user)
+        ParkingSpaceDailyStats.objects.create(parking_space=other, day=self.day, booking_count=3)
+        ParkingSpaceDailyStats.objects.create(
+            parking_space=self.parking_space, day=self.day - datetime.timedelta(days=5), booking_count=3)
+
+        call_command('backfill_daily_stats', stdout=StringIO())
+
+        self.assertFalse(ParkingSpaceDailyStats.objects.filter(parking_space=other).exists())
+        self.assertEqual(set(self.stats()), {self.day, self.day + datetime.timedelta(days=1)})
+
+
+class AvailabilityBatchTests(ParkingFixturesMixin, TestCase):
+
+    def setUp(self):
+        super(AvailabilityBatchTests, self).setUp()
+        now = timezone.now()
+        self.start = now + datetime.timedelta(hours=1)
+        self.end = now + datetime.timedelta(hours=3)
+        user = self.create_user(host=True)
+
+        self.fixed = self.create_parking_space(user, available_spaces=2)
+        fixed_availability = self.create_fixed_availability(
+            self.fixed, now, now + datetime.timedelta(days=1), pricing=200)
+        self.reserve(self.create_vehicle(user), fixed_availability, self.start, self.end)
+
+        self.both = self.create_parking_space(user)
+        self.create_fixed_availability(self.both, now, now + datetime.timedelta(days=1))
+        self.repeating_availability = RepeatingAvailability.objects.create(
+            parking_space=self.both, all_day=True, pricing=500,
+            repeating_days=['Sun', 'Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat'])
+
+        self.unavailable = self.create_parking_space(user)
+
+    def quote(self, ids, start=None, end=None):
+        return self.client.get(reverse('parkingspace-availability-batch'), {
+            'ids': ','.join(str(pk) for pk in ids),
+            'start': start or self.start.isoformat(),
+            'end': end or self.end.isoformat(),
+            'format': 'json',
+        })
+
+    def test_quote(self):
+        response = self.quote([self.fixed.pk, self.both.pk, self.unavailable.pk])
+
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertEqual(results[self.fixed.pk], {
+            'availability_type': 'fixed',
+            'availability_id': self.fixed.fixedavailability_set.get().pk,
+            'vacant_spaces': 1,
+            'price': calculate_customer_price(200, 120),
+        })
+        # repeating availabilities take precedence
+        self.assertEqual(results[self.both.pk]['availability_type'], 'repeating')
+        self.assertEqual(results[self.both.pk]['availability_id'], self.repeating_availability.pk)
+        self.assertEqual(results[self.both.pk]['price'], calculate_customer_price(500, 120))
+        self.assertIsNone(results[self.unavailable.pk])
+
+    def test_query_count_does_not_grow_with_the_batch(self):
+        with self.assertNumQueries(3):
+            self.quote([self.fixed.pk, self.both.pk, self.unavailable.pk])
+
+    def test_naive_datetimes_are_rejected(self):
+        naive_start = self.start.replace(tzinfo=None).isoformat()
+        self.assertEqual(self.quote([self.fixed.pk], start=naive_start).status_code, 400)
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.quote(['one']).status_code, 400)
+        self.assertEqual(self.quote([self.fixed.pk], start=self.end.isoformat(),
+                                    end=self.start.isoformat()).status_code, 400)
+        self.assertEqual(self.quote(range(1, 202)).status_code, 400)
+
+
+class CalendarTests(ParkingFixturesMixin, TestCase):
+
+    def setUp(self):
+        super(CalendarTests, self).setUp()
+        self.day = timezone.localdate() + datetime.timedelta(days=2)
+        self.user = self.create_user(host=True)
+        self.parking_space = self.create_parking_space(self.user)
+
+        self.repeating_availability = RepeatingAvailability.objects.create(
+            parking_space=self.parking_space, start_time=datetime.time(8), end_time=datetime.time(10),
+            repeating_days=[calendar.day_name[(self.day + datetime.timedelta(days=days)).weekday()][:3]
+                            for days in (0, 1)])
+        self.fixed_availability = self.create_fixed_availability(
+            self.parking_space, self.local(0, 11), self.local(1, 7))
+
+        vehicle = self.create_vehicle(self.user)
+        self.reservations = [
+            self.reserve(vehicle, self.fixed_availability, self.local(0, 12), self.local(0, 13)),
+            self.reserve(vehicle, self.fixed_availability, self.local(1, 6), self.local(1, 6, 30)),
+        ]
+        cancelled = self.reserve(vehicle, self.fixed_availability, self.local(0, 14), self.local(0, 15))
+        Reservation.objects.filter(pk=cancelled.pk).update(cancelled=True)
+
+    def local(self, days, hour, minute=0):
+        return timezone.make_aware(datetime.datetime.combine(
+            self.day + datetime.timedelta(days=days), datetime.time(hour, minute)))
+
+    def expected_events(self):
+        return [
+            ('repeating_availability', self.repeating_availability.pk, self.local(0, 8)),
+            ('fixed_availability', self.fixed_availability.pk, self.local(0, 11)),
+            ('reservation', self.reservations[0].pk, self.local(0, 12)),
+            ('reservation', self.reservations[1].pk, self.local(1, 6)),
+            ('repeating_availability', self.repeating_availability.pk, self.local(1, 8)),
+        ]
+
+    def test_events_are_merged_by_start(self):
+        for chunk_size in (1, 500):
+            events = calendar_events(self.parking_space, self.local(0, 0), self.local(2, 0), chunk_size=chunk_size)
+            self.assertEqual([(event['type'], event['id'], event['start']) for event in events],
+                             self.expected_events())
+
+    def test_events_outside_the_range_are_left_out(self):
+        events = calendar_events(self.parking_space, self.local(0, 12, 30), self.local(1, 6, 15))
+        self.assertEqual([(event['type'], event['start']) for event in events], [
+            ('fixed_availability', self.local(0, 11)),
+            ('reservation', self.local(0, 12)),
+            ('reservation', self.local(1, 6)),
+        ])
+
+    def test_endpoint(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('parkingspace-calendar', args=[self.parking_space.pk]), {
+            'from': self.day.isoformat(), 'to': (self.day + datetime.timedelta(days=2)).isoformat()})
+
+        self.assertEqual(response.status_code, 200)
+        calendar_json = json.loads(b''.join(response.streaming_content).decode())
+        self.assertEqual(calendar_json['parking_space'], self.parking_space.pk)
+        self.assertEqual([(event['type'], event['id']) for event in calendar_json['events']],
+                         [(event_type, pk) for event_type, pk, _ in self.expected_events()])
+
+    def test_endpoint_is_for_the_owner(self):
+        self.client.force_login(self.create_user(host=True))
+        response = self.client.get(reverse('parkingspace-calendar', args=[self.parking_space.pk]), {
+            'from': self.day.isoformat(), 'to': (self.day + datetime.timedelta(days=2)).isoformat()})
+
+        self.assertEqual(response.status_code, 403)
+
+
+class ReservationExtendTests(ParkingFixturesMixin, TestCase):
+
+    def setUp(self):
+        super(ReservationExtendTests, self).setUp()
+        self.now = timezone.now()
+        self.user = self.create_user(host=True)
+        self.parking_space = self.create_parking_space(self.user)
+        self.availability = self.create_fixed_availability(
+            self.parking_space, self.now, self.now + datetime.timedelta(hours=8), pricing=200)
+        self.vehicle = self.create_vehicle(self.user)
+        self.reservation = self.reserve_hours(1, 2)
+
+    def at(self, hours):
+        return self.now + datetime.timedelta(hours=hours)
+
+    def reserve_hours(self, start_hours, end_hours):
+        reservation = self.reserve(self.vehicle, self.availability, self.at(start_hours), self.at(end_hours))
+        reservation.refresh_from_db()
+        return reservation
+
+    def test_added_cost(self):
+        added_cost = self.reservation.extend(self.at(4))
+
+        self.assertEqual(added_cost, calculate_customer_price(200, 180) - calculate_customer_price(200, 60))
+        reservation = Reservation.objects.get(pk=self.reservation.pk)
+        self.assertEqual(reservation.end_datetime, self.at(4))
+        self.assertEqual(reservation.cost, calculate_customer_price(200, 180))
+        self.assertEqual(reservation.host_income, round(reservation.host_income_for(reservation.cost)))
+        self.assertEqual(self.reservation.cost, reservation.cost)
+
+    def assertNotExtended(self, reservation, end_datetime, message):
+        with self.assertRaisesMessage(ValidationError, message):
+            reservation.extend(end_datetime)
+
+        self.assertEqual(reservation.end_datetime, self.at(2))
+        self.assertEqual(Reservation.objects.get(pk=reservation.pk).end_datetime, self.at(2))
+
+    def test_overlapping_extensions_are_rejected(self):
+        self.reserve_hours(3, 4)
+        self.assertNotExtended(self.reservation, self.at(3.5), "Overlaps with other reservation")
+        self.reservation.extend(self.at(2.5))
+
+    def test_extensions_must_stay_within_the_availability(self):
+        self.assertNotExtended(self.reservation, self.at(9), "not within bounds")
+
+    def test_extensions_must_end_later(self):
+        self.assertNotExtended(self.reservation, self.at(1.5), "must come after its current end time")
+
+    def test_concurrent_changes_are_detected(self):
+        stale = Reservation.objects.get(pk=self.reservation.pk)
+        self.reservation.extend(self.at(3))
+
+        with self.assertRaisesMessage(ValidationError, "changed by another request"):
+            stale.extend(self.at(4))
+        self.assertEqual(stale.end_datetime, self.at(2))
+        self.assertEqual(Reservation.objects.get(pk=self.reservation.pk).end_datetime, self.at(3))
+
+    def test_cancelled_reservations_cannot_be_extended(self):
+        self.reservation.cancelled = True
+        with self.assertRaisesMessage(ValidationError, "Cancelled reservations can't be extended"):
+            self.reservation.extend(self.at(3))
+
+    def test_endpoint(self):
+        url = reverse('reservation-extend', args=[self.reservation.pk])
+
+        self.client.force_login(self.create_user())
+        self.assertEqual(self.client.post(url, {'end_datetime': self.at(3).isoformat()}).status_code, 403)
+
+        self.client.force_login(self.user)
+        response = self.client.post(url, {'end_datetime': self.at(3).isoformat()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['added_cost'],
+                         calculate_customer_price(200, 120) - calculate_customer_price(200, 60))
+
+        naive = self.at(4).replace(tzinfo=None).isoformat()
+        self.assertEqual(self.client.post(url, {'end_datetime': naive}).status_code, 400)
+
+
+class RatingTests(ParkingFixturesMixin, TestCase):
+
+    def setUp(self):
+        super(RatingTests, self).setUp()
+        now = timezone.now()
+        self.user = self.create_user(host=True)
+        self.parking_space = self.create_parking_space(self.user)
+        self.availability = self.create_fixed_availability(self.parking_space, now, now + datetime.timedelta(days=1))
+        self.vehicle = self.create_vehicle(self.user)
+        self.reservations = [self.completed_reservation(hours) for hours in (1, 2, 3)]
+
+    def completed_reservation(self, hours):
+        now = timezone.now()
+        reservation = self.reserve(self.vehicle, self.availability, now + datetime.timedelta(hours=hours),
+                                   now + datetime.timedelta(hours=hours, minutes=30))
+        Reservation.objects.filter(pk=reservation.pk).update(
+            start_datetime=now - datetime.timedelta(hours=hours),
+            end_datetime=now - datetime.timedelta(hours=hours, minutes=-30))
+        return reservation
+
+    def rate(self, reservation, value):
+        rating = ParkingSpaceRating(reservation=reservation, parking_space=self.parking_space, value=value)
+        rating.save()
+        return rating
+
+    def totals(self):
+        parking_space = ParkingSpace.objects.get(pk=self.parking_space.pk)
+        return parking_space.rating_count, parking_space.rating_sum
+
+    def test_running_totals(self):
+        ratings = [self.rate(reservation, value) for reservation, value in zip(self.reservations, (5, 4, 2))]
+        self.assertEqual(self.totals(), (3, 11))
+
+        ratings[2].value = 3
+        ratings[2].save()
+        self.assertEqual(self.totals(), (3, 12))
+
+        ratings[0].delete()
+        self.assertEqual(self.totals(), (2, 7))
+
+    def test_only_completed_reservations_can_be_rated(self):
+        now = timezone.now()
+        upcoming = self.reserve(self.vehicle, self.availability, now + datetime.timedelta(hours=5),
+                                now + datetime.timedelta(hours=6))
+
+        with self.assertRaises(ValidationError):
+            self.rate(upcoming, 5)
+        self.assertEqual(self.totals(), (0, 0))
+
+    def test_reservations_are_rated_once(self):
+        self.rate(self.reservations[0], 5)
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.rate(self.reservations[0], 1)
+        self.assertEqual(self.totals(), (1, 5))
+
+    def test_rating_again_replaces_the_rating(self):
+        self.client.force_login(self.user)
+        url = reverse('reservation-rate', args=[self.reservations[0].pk])
+
+        self.assertEqual(self.client.post(url, {'value': 5}).status_code, 200)
+        self.assertEqual(self.client.post(url, {'value': 2}).status_code, 200)
+        self.assertEqual(self.totals(), (1, 2))
+
+        self.client.force_login(self.create_user())
+        self.assertEqual(self.client.post(url, {'value': 1}).status_code, 403)
+
+    def test_rebuild_matches_the_running_totals(self):
+        for reservation, value in zip(self.reservations, (5, 4, 2)):
+            self.rate(reservation, value)
+        unrated = self.create_parking_space(self.user)
+        expected = self.totals()
+        ParkingSpace.objects.update(rating_count=7, rating_sum=7)
+
+        call_command('rebuild_rating_aggregates', chunk_size=1, stdout=StringIO())
+
+        self.assertEqual(self.totals(), expected)
+        unrated.refresh_from_db()
+        self.assertEqual((unrated.rating_count, unrated.rating_sum), (0, 0))
+
+
+class VacancyTests(SimpleTestCase):
+
+    def setUp(self):
+        self.start = timezone.now()
+        self.end = self.start + datetime.timedelta(hours=2)
+        self.subscription = Subscription(34.0, -118.3, 34.1, -118.2, self.start, self.end)
+
+    def change(self, latitude=34.05, longitude=-118.25, start=None, end=None, parking_space_id=1):
+        return {'parking_space_id': parking_space_id, 'latitude': latitude, 'longitude': longitude,
+                'start': start, 'end': end}
+
+    def test_matches(self):
+        hour = datetime.timedelta(hours=1)
+        self.assertTrue(self.subscription.matches(self.change()))
+        self.assertFalse(self.subscription.matches(self.change(latitude=34.2)))
+        self.assertFalse(self.subscription.matches(self.change(longitude=-118.1)))
+        self.assertTrue(self.subscription.matches(self.change(start=self.end - hour, end=self.end + hour)))
+        self.assertFalse(self.subscription.matches(self.change(start=self.end + hour, end=self.end + 2 * hour)))
+        self.assertFalse(self.subscription.matches(self.change(start=self.start - 2 * hour, end=self.start - hour)))
+
+    def test_publish(self):
+        bus = VacancyBus()
+        elsewhere = Subscription(40.7, -74.1, 40.8, -74.0, self.start, self.end)
+        bus.subscriptions.update([self.subscription, elsewhere])
+
+        bus.publish(self.change(start=self.start.isoformat(), end=self.end.isoformat()))
+
+        change = self.subscription.changes.get_nowait()
+        self.assertEqual((change['start'], change['end']), (self.start, self.end))
+        self.assertTrue(elsewhere.changes.empty())
+
+
+class VacancyStreamTests(ParkingFixturesMixin, TestCase):
+
+    def setUp(self):
+        super(VacancyStreamTests, self).setUp()
+        now = timezone.now()
+        self.start = now + datetime.timedelta(hours=1)
+        self.end = now + datetime.timedelta(hours=2)
+        user = self.create_user(host=True)
+        self.parking_spaces = [self.create_parking_space(user, available_spaces=2) for _ in range(2)]
+        for parking_space in self.parking_spaces:
+            self.create_fixed_availability(parking_space, now, now + datetime.timedelta(days=1))
+        vehicle = self.create_vehicle(user)
+        self.reserve(vehicle, self.parking_spaces[0].fixedavailability_set.get(), self.start, self.end)
+
+    @override_settings(VACANCY_STREAM_SECONDS=0.05, VACANCY_KEEPALIVE_SECONDS=0.01, VACANCY_STREAM_RETRY_SECONDS=3)
+    def test_bursts_are_sent_once_per_parking_space(self):
+        # imported here, parking.serializers and accounts.serializers import each other
+        from .api_views import ParkingSpaceVacancyStream
+
+        subscription = Subscription(34.0, -118.3, 34.1, -118.2, self.start, self.end)
+        for parking_space in self.parking_spaces + self.parking_spaces:
+            subscription.changes.put({'parking_space_id': parking_space.pk})
+
+        events = list(ParkingSpaceVacancyStream().events(subscription))
+
+        self.assertEqual(events[0], 'retry: 3000\n\n')
+        vacancies = [event for event in events if event.startswith('event: vacancy')]
+        self.assertEqual(vacancies, [
+            'event: vacancy\ndata: {"parking_space": %s, "vacant_spaces": 1}\n\n' % self.parking_spaces[0].pk,
+            'event: vacancy\ndata: {"parking_space": %s, "vacant_spaces": 2}\n\n' % self.parking_spaces[1].pk,
+        ])
+
+    def open_stream(self):
+        return self.client.get(reverse('parkingspace-vacancy-stream'), {
+            'bl_lat': 34.0, 'bl_long': -118.3, 'tr_lat': 34.1, 'tr_long': -118.2,
+            'start': self.start.isoformat(), 'end': self.end.isoformat(), 'format': 'json'})
+
+    def close(self, response):
+        # as the test client does, without closing the test case's connection
+        request_finished.disconnect(close_old_connections)
+        try:
+            response.close()
+        finally:
+            request_finished.connect(close_old_connections)
+
+    @override_settings(VACANCY_MAX_STREAMS=1)
+    def test_streams_are_capped(self):
+        bus = VacancyBus()
+        # no changes are listened to
+        bus.listen = lambda: None
+
+        with mock.patch('parking.api_views.vacancy_bus', bus):
+            stream = self.open_stream()
+            self.assertEqual(stream.status_code, 200)
+            self.assertEqual(len(bus.subscriptions), 1)
+
+            refused = self.open_stream()
+            self.assertEqual(refused.status_code, 503)
+            self.assertEqual(refused['Retry-After'], str(settings.VACANCY_STREAM_SECONDS))
+
+            # closed without having been read, e.g. the client went away
+            self.close(stream)
+            self.assertEqual(bus.subscriptions, set())
+            self.close(self.open_stream())
+            self.assertEqual(bus.subscriptions, set())
+
+    def test_streams_are_refused_by_default(self):
+        with mock.patch('parking.api_views.vacancy_bus') as bus:
+            bus.subscribe.return_value = False
+            self.assertEqual(self.open_stream().status_code, 503)
+        bus.subscribe.assert_called_once_with(mock.ANY, limit=0)
+
+    def test_writes_announce_the_change(self):
+        reservation = Reservation.objects.filter(parking_space=self.parking_spaces[0]).get()
+
+        with mock.patch('parking.signals.notify_vacancy_change') as notify:
+            reservation.cancelled = True
+            reservation.save()
+        notify.assert_called_once_with(self.parking_spaces[0].pk, self.start, self.end)
+
+        other = self.reserve(self.create_vehicle(self.create_user()),
+                             self.parking_spaces[1].fixedavailability_set.get(), self.start, self.end)
+        with mock.patch('parking.models.notify_vacancy_change') as notify:
+            other.extend(self.end + datetime.timedelta(hours=1))
+        notify.assert_called_once_with(self.parking_spaces[1].pk, self.end, self.end + datetime.timedelta(hours=1))
+
+
+class ConcurrentBookingTests(ParkingFixturesMixin, SimpleTestCase):
+    """
+    Bookings and extensions of a parking space wait for each other's
+    overlap check. Test cases can't commit (and TransactionTestCase can't
+    flush the partitioned reservations table), so the rows are committed
+    here and removed after the test.
+    """
+    allow_database_queries = True
+
+    def setUp(self):
+        super(ConcurrentBookingTests, self).setUp()
+        self.now = timezone.now()
+        self.user = self.create_user(host=True, email='concurrent@curbdparking.com', phone_number='555999')
+        self.parking_space = self.create_parking_space(self.user)
+        self.availability = self.create_fixed_availability(
+            self.parking_space, self.now, self.now + datetime.timedelta(hours=8))
+        self.vehicle = self.create_vehicle(self.user)
+        self.addCleanup(self.delete_fixtures)
+
+    def delete_fixtures(self):
+        Reservation.all_objects.filter(parking_space=self.parking_space).hard_delete()
+        ParkingSpace.all_objects.filter(pk=self.parking_space.pk).hard_delete()
+        self.vehicle.delete()
+        self.user.delete()
+
+    def at(self, hours):
+        return self.now + datetime.timedelta(hours=hours)
+
+    def test_bookings_wait_for_a_concurrent_extension(self):
+        reservation = self.reserve(self.vehicle, self.availability, self.at(1), self.at(2))
+        outcome = []
+
+        def book():
+            try:
+                self.reserve(self.vehicle, self.availability, self.at(3), self.at(4))
+                outcome.append('booked')
+            except ValidationError:
+                outcome.append('refused')
+            finally:
+                connection.close()
+
+        with transaction.atomic():
+            reservation = Reservation.objects.get(pk=reservation.pk)
+            reservation.extend(self.at(5))
+
+            booking = threading.Thread(target=book)
+            booking.start()
+            # the booking blocks on the parking space until the extension commits
+            booking.join(0.5)
+            self.assertTrue(booking.is_alive())
+
+        booking.join(5)
+        self.assertEqual(outcome, ['refused'])
+        self.assertEqual(Reservation.objects.filter(parking_space=self.parking_space).count(), 1)
+
+
+class VacancyBusTests(SimpleTestCase):
+    """
+    Changes reach subscribers through Postgres, from another connection.
+    Test cases can't commit (and TransactionTestCase can't flush the
+    partitioned reservations table), so nothing is written here.
+    """
+    allow_database_queries = True
+
+    def notify(self, change):
+        wrapper = connections['default']
+        notifier = wrapper.get_new_connection(wrapper.get_connection_params())
+        notifier.autocommit = True
+        try:
+            with notifier.cursor() as cursor:
+                cursor.execute('SELECT pg_notify(%s, %s)', [CHANNEL, json.dumps(change)])
+        finally:
+            notifier.close()
+
+    def test_notifications_reach_subscribers(self):
+        now = timezone.now()
+        subscription = Subscription(34.0, -118.3, 34.1, -118.2, now, now + datetime.timedelta(hours=1))
+        change = {'parking_space_id': 1, 'latitude': 34.05, 'longitude': -118.25,
+                  'start': now.isoformat(), 'end': (now + datetime.timedelta(minutes=30)).isoformat()}
+
+        bus = VacancyBus()
+        bus.poll_seconds = 0.05
+        bus.subscribe(subscription)
+        try:
+            # the listener may not be listening yet
+            for _ in range(100):
+                self.notify(change)
+                try:
+                    received = subscription.changes.get(timeout=0.05)
+                    break
+                except queue.Empty:
+                    continue
+            else:
+                self.fail("No change was delivered")
+        finally:
+            bus.unsubscribe(subscription)
+            bus.listener.join(5)
+
+        self.assertEqual(received['parking_space_id'], 1)
+        self.assertEqual(received['start'], now)
+        # the listener stops with its last subscriber
+        self.assertIsNone(bus.listener)
+
+
+class ExportTests(ParkingFixturesMixin, TestCase):
+
+    def setUp(self):
+        super(ExportTests, self).setUp()
+        self.now = timezone.now()
+        self.host = self.create_user(host=True)
+        self.other_host = self.create_user(host=True)
+        self.parking_space = self.create_parking_space(self.host)
+        self.other_space = self.create_parking_space(self.other_host)
+        vehicle = self.create_vehicle(self.create_user())
+
+        availability = self.create_fixed_availability(self.parking_space, self.now, self.at(8))
+        other_availability = self.create_fixed_availability(self.other_space, self.now, self.at(8))
+        self.first = self.reserve(vehicle, availability, self.at(1), self.at(2))
+        self.other = self.reserve(vehicle, other_availability, self.at(2), self.at(3))
+        self.cancelled = self.reserve(vehicle, availability, self.at(3), self.at(4))
+        Reservation.objects.filter(pk=self.cancelled.pk).update(cancelled=True)
+
+    def at(self, hours):
+        return self.now + datetime.timedelta(hours=hours)
+
+    def export(self, export_format='csv', **params):
+        response = self.client.get(reverse('reservation-export', args=[export_format]), params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def exported_ids(self, **params):
+        rows = list(csv.DictReader(StringIO(self.export(**params))))
+        return [int(row['id']) for row in rows]
+
+    def test_csv(self):
+        self.client.force_login(self.create_user(is_staff=True))
+        rows = list(csv.reader(StringIO(self.export())))
+
+        self.assertEqual(rows[0], [name for name, _ in EXPORT_COLUMNS])
+        self.assertEqual([int(row[0]) for row in rows[1:]], [self.first.pk, self.other.pk, self.cancelled.pk])
+        first = dict(zip(rows[0], rows[1]))
+        self.assertEqual(int(first['host_id']), self.host.pk)
+        self.assertEqual(first['parking_space_name'], self.parking_space.name)
+        self.assertEqual(first['start_datetime'], self.at(1).isoformat())
+
+    def test_jsonl(self):
+        self.client.force_login(self.create_user(is_staff=True))
+        rows = [json.loads(line) for line in self.export('jsonl').splitlines()]
+
+        self.assertEqual([row['id'] for row in rows], [self.first.pk, self.other.pk, self.cancelled.pk])
+        self.assertEqual(set(rows[0]), {name for name, _ in EXPORT_COLUMNS})
+        self.assertEqual(rows[2]['cancelled'], True)
+
+    def test_filters(self):
+        self.client.force_login(self.create_user(is_staff=True))
+
+        self.assertEqual(self.exported_ids(host=self.other_host.pk), [self.other.pk])
+        self.assertEqual(self.exported_ids(space=self.parking_space.pk), [self.first.pk, self.cancelled.pk])
+        self.assertEqual(self.exported_ids(cancelled='false'), [self.first.pk, self.other.pk])
+        self.assertEqual(self.exported_ids(paid_out='true'), [])
+        self.assertEqual(self.exported_ids(**{'from': self.at(2.5).isoformat()}), [self.other.pk, self.cancelled.pk])
+        self.assertEqual(self.exported_ids(to=self.at(2.5).isoformat()), [self.first.pk, self.other.pk])
+
+    def test_hosts_only_export_their_own_reservations(self):
+        self.client.force_login(self.host)
+
+        self.assertEqual(self.exported_ids(), [self.first.pk, self.cancelled.pk])
+        self.assertEqual(self.exported_ids(host=self.other_host.pk), [self.first.pk, self.cancelled.pk])
+        self.assertEqual(self.exported_ids(space=self.other_space.pk), [])
+
+    def test_invalid_requests(self):
+        url = reverse('reservation-export', args=['csv'])
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.force_login(self.create_user(is_staff=True))
+        self.assertEqual(self.client.get(reverse('reservation-export', args=['xlsx'])).status_code, 404)
+        self.assertEqual(self.client.get(url, {'host': 'me'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'cancelled': 'maybe'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'from': 'yesterday'}).status_code, 400)
+
+    def test_command(self):
+        stdout = StringIO()
+        call_command('export_reservations', export_format='jsonl', host=self.host.pk, chunk_size=1, stdout=stdout)
+        self.assertEqual([json.loads(line)['id'] for line in stdout.getvalue().splitlines()],
+                         [self.first.pk, self.cancelled.pk])
+
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir)
+        output = os.path.join(output_dir, 'reservations.csv')
+        stdout = StringIO()
+        call_command('export_reservations', output=output, cancelled='false', stdout=stdout)
+
+        self.assertIn("Exported 2 reservations", stdout.getvalue())
+        with open(output, newline='') as exported:
+            self.assertEqual([int(row['id']) for row in csv.DictReader(exported)], [self.first.pk, self.other.pk])
+
+        with self.assertRaises(CommandError):
+            call_command('export_reservations', chunk_size=0, stdout=StringIO())
+
+
+class PartitioningTests(ParkingFixturesMixin, TestCase):
+
+    def month(self, year, month):
+        return datetime.datetime(year, month, 1, tzinfo=pytz.utc)
+
+    def partition_of(self, reservation):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT tableoid::regclass::text FROM parking_reservation WHERE id = %s', [reservation.pk])
+            return cursor.fetchone()[0]
+
+    def table_exists(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT to_regclass(%s) IS NOT NULL', [name])
+            return cursor.fetchone()[0]
+
+    def test_months(self):
+        self.assertEqual(partitioning.add_months(self.month(2030, 11), 2), self.month(2031, 1))
+        self.assertEqual(partitioning.add_months(self.month(2030, 1), -1), self.month(2029, 12))
+        self.assertEqual(partitioning.month_start(
+            datetime.datetime(2030, 1, 31, 20, tzinfo=pytz.timezone('America/Los_Angeles'))), self.month(2030, 2))
+        self.assertEqual(partitioning.partition_name(self.month(2030, 2)), 'parking_reservation_y2030m02')
+        self.assertEqual(partitioning.partition_month('parking_reservation_y2030m02'), self.month(2030, 2))
+        self.assertIsNone(partitioning.partition_month(partitioning.DEFAULT_PARTITION))
+
+    def test_create_partition_moves_rows_out_of_the_default_partition(self):
+        user = self.create_user(host=True)
+        start = datetime.datetime(2040, 3, 10, 12, tzinfo=pytz.utc)
+        availability = self.create_fixed_availability(
+            self.create_parking_space(user), start, start + datetime.timedelta(days=1))
+        reservation = self.reserve(self.create_vehicle(user), availability, start, start + datetime.timedelta(hours=1))
+        self.assertEqual(self.partition_of(reservation), partitioning.DEFAULT_PARTITION)
+
+        with connection.cursor() as cursor:
+            self.assertTrue(partitioning.create_partition(cursor, start))
+            self.assertFalse(partitioning.create_partition(cursor, start))
+
+        self.assertEqual(self.partition_of(reservation), 'parking_reservation_y2040m03')
+        self.assertEqual(Reservation.objects.get(pk=reservation.pk).end_datetime, reservation.end_datetime)
+
+    def test_current_reservations_only_scan_recent_partitions(self):
+        with connection.cursor() as cursor:
+            partitioning.create_partitions(cursor, self.month(2001, 1), self.month(2001, 2))
+
+        now = timezone.now()
+        plan = Reservation.objects.filter(end_datetime__gte=now).explain()
+        self.assertIn(partitioning.partition_name(now), plan)
+        self.assertNotIn('parking_reservation_y2001m01', plan)
+        self.assertNotIn('parking_reservation_y2001m02', plan)
+
+        plan = Reservation.objects.filter(end_datetime__lt=self.month(2001, 2)).explain()
+        self.assertIn('parking_reservation_y2001m01', plan)
+        self.assertNotIn(partitioning.partition_name(now), plan)
+
+    def test_create_partitions(self):
+        with connection.cursor() as cursor:
+            partitioning.create_partition(cursor, self.month(2040, 2))
+            created = partitioning.create_partitions(cursor, self.month(2040, 1), self.month(2040, 3))
+
+        self.assertEqual(created, ['parking_reservation_y2040m01', 'parking_reservation_y2040m03'])
+
+    def test_create_command(self):
+        stdout = StringIO()
+        call_command('create_reservation_partitions', months=6, stdout=stdout)
+
+        last = partitioning.add_months(partitioning.month_start(timezone.now()), 6)
+        with connection.cursor() as cursor:
+            self.assertIn(partitioning.partition_name(last), partitioning.attached_partitions(cursor))
+
+    def test_detach_command(self):
+        with connection.cursor() as cursor:
+            partitioning.create_partitions(cursor, self.month(2001, 1), self.month(2001, 2))
+
+        stdout = StringIO()
+        call_command('detach_reservation_partitions', keep_months=24, stdout=stdout)
+        self.assertEqual(stdout.getvalue().splitlines(), [
+            'Detached partition parking_reservation_y2001m01', 'Detached partition parking_reservation_y2001m02'])
+
+        with connection.cursor() as cursor:
+            attached = partitioning.attached_partitions(cursor)
+        self.assertNotIn('parking_reservation_y2001m01', attached)
+        self.assertIn(partitioning.DEFAULT_PARTITION, attached)
+        self.assertIn(partitioning.partition_name(timezone.now()), attached)
+        # kept as a standalone table
+        self.assertTrue(self.table_exists('parking_reservation_y2001m01'))
+
+    def test_detach_command_can_drop(self):
+        with connection.cursor() as cursor:
+            partitioning.create_partition(cursor, self.month(2001, 1))
+
+        call_command('detach_reservation_partitions', keep_months=24, drop=True, stdout=StringIO())
+        self.assertFalse(self.table_exists('parking_reservation_y2001m01'))
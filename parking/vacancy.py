@@ -0,0 +1,152 @@
+"""
+Real-time vacancy changes for map clients.
+
+Whenever a reservation, an availability or a parking space changes, the
+transaction sends a Postgres NOTIFY on CHANNEL, carrying the space's
+location and the time range affected (see parking.signals). Postgres only
+delivers it once the transaction commits, to every process.
+
+Each process holds a single LISTEN connection, opened by the first
+subscriber, and a thread that hands each change to the subscribers whose
+bounding box and time window it touches (`VacancyBus`). The subscribers are
+the server-sent event streams of ParkingSpaceVacancyStream.
+
+A stream holds a worker thread for as long as it is open, so streams need a
+threaded or asynchronous server (e.g. gunicorn's gthread or gevent worker
+classes), and each process only opens VACANCY_MAX_STREAMS of them. Clients
+that are turned away poll the search with a sync token instead.
+"""
+import json
+import queue
+import select
+import threading
+
+from django.db import connection, connections
+from django.utils.dateparse import parse_datetime
+
+
+CHANNEL = 'parking_vacancy'
+
+
+def notify_vacancy_change(parking_space_id, start_datetime=None, end_datetime=None):
+    """
+    Announces that the vacancy of a parking space may have changed, between
+    start_datetime and end_datetime (at any time if not given). Delivered
+    when the current transaction commits.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT pg_notify(%s, json_build_object("
+            "'parking_space_id', id, 'latitude', latitude, 'longitude', longitude, "
+            "'start', %s::timestamptz, 'end', %s::timestamptz)::text) "
+            "FROM parking_parkingspace WHERE id = %s",
+            [CHANNEL, start_datetime, end_datetime, parking_space_id])
+
+
+class Subscription(object):
+    """
+    The changes inside a bounding box that overlap a time window, queued for
+    one stream.
+    """
+
+    def __init__(self, bottom_left_lat, bottom_left_long, top_right_lat, top_right_long,
+                 start_datetime, end_datetime):
+        self.box = (bottom_left_lat, bottom_left_long, top_right_lat, top_right_long)
+        self.start_datetime = start_datetime
+        self.end_datetime = end_datetime
+        self.changes = queue.Queue()
+
+    def matches(self, change):
+        bottom_left_lat, bottom_left_long, top_right_lat, top_right_long = self.box
+        if not (bottom_left_lat <= change['latitude'] <= top_right_lat and
+                bottom_left_long <= change['longitude'] <= top_right_long):
+            return False
+
+        if change['start'] is not None and change['end'] is not None:
+            return change['start'] <= self.end_datetime and change['end'] >= self.start_datetime
+        return True
+
+
+class VacancyBus(object):
+    # how often the listener checks whether it still has subscribers
+    poll_seconds = 5
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = set()
+        self.listener = None
+
+    def subscribe(self, subscription, limit=None):
+        """
+        :param limit: maximum number of subscriptions of the process
+        :return: False if the limit was reached, and nothing was subscribed
+        """
+        with self.lock:
+            if limit is not None and len(self.subscriptions) >= limit:
+                return False
+            self.subscriptions.add(subscription)
+            if self.listener is None or not self.listener.is_alive():
+                self.listener = threading.Thread(target=self.listen, name='vacancy-listener', daemon=True)
+                self.listener.start()
+        return True
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+    def listen(self):
+        wrapper = connections['default']
+        listener = wrapper.get_new_connection(wrapper.get_connection_params())
+        listener.autocommit = True
+        try:
+            with listener.cursor() as cursor:
+                cursor.execute('LISTEN %s' % CHANNEL)
+
+            while True:
+                with self.lock:
+                    if not self.subscriptions:
+                        # the next subscriber starts a new listener
+                        self.listener = None
+                        return
+
+                if select.select([listener], [], [], self.poll_seconds) == ([], [], []):
+                    continue
+
+                listener.poll()
+                while listener.notifies:
+                    self.publish(json.loads(listener.notifies.pop(0).payload))
+        finally:
+            listener.close()
+
+    def publish(self, change):
+        for field in ('start', 'end'):
+            if change[field] is not None:
+                change[field] = parse_datetime(change[field])
+
+        with self.lock:
+            subscriptions = list(self.subscriptions)
+        for subscription in subscriptions:
+            if subscription.matches(change):
+                subscription.changes.put(change)
+
+
+class SubscribedStream(object):
+    """
+    Streaming content that ends its subscription once it has been sent, or
+    the client went away, even if it was never started (Django closes it
+    either way).
+    """
+
+    def __init__(self, content, subscription, bus):
+        self.content = content
+        self.subscription = subscription
+        self.bus = bus
+
+    def __iter__(self):
+        return iter(self.content)
+
+    def close(self):
+        self.bus.unsubscribe(self.subscription)
+
+
+bus = VacancyBus()
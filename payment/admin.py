@@ -1,3 +1,17 @@
 from django.contrib import admin
 
-# Register your models here.
+from curbd.admin import ScalableModelAdmin
+from .models import Charge
+
+
+class ChargeAdmin(ScalableModelAdmin, admin.ModelAdmin):
+    list_display = ('idempotency_key', 'user', 'amount', 'reservation_cost', 'status', 'attempts', 'created_at')
+    list_select_related = ('user',)
+    list_filter = ('status',)
+    raw_id_fields = ('reservation', 'user')
+    readonly_fields = ('idempotency_key', 'stripe_charge_id', 'attempts')
+    date_hierarchy = 'created_at'
+    indexed_id_search_fields = ('reservation',)
+
+
+admin.site.register(Charge, ChargeAdmin)
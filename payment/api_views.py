@@ -1,5 +1,6 @@
 from django.core.mail import send_mail
 from django.db.models.query import Q
+from django.shortcuts import get_object_or_404
 
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
@@ -11,10 +12,12 @@ import datetime
 import pytz
 
 from accounts.api_permissions import IsHost
+from api.general_permissions import is_request_user
+from curbd.clients import stripe_client
+from curbd.metrics import timed
 from parking.models import Reservation
-
-import stripe
-stripe.api_key = config('STRIPE_SECRET_KEY')
+from .models import Charge
+from .serializers import ChargeSerializer
 
 
 @api_view(['POST'])
@@ -23,8 +26,8 @@ def ephemeral_keys(request):
     api_version = request.POST['api_version']
     customer_id = request.user.customer.stripe_customer_id
 
-    key = stripe.EphemeralKey.create(customer=customer_id, stripe_version=api_version)
-    return Response(key)
+    # cached until shortly before it expires, so app launches rarely wait for Stripe
+    return Response(stripe_client.ephemeral_key(customer_id, api_version))
 
 
 @api_view(['POST'])
@@ -32,34 +35,43 @@ def ephemeral_keys(request):
 def charge_reservation(request):
     amount = request.POST['amount']
     source = request.POST['source']
-    reservation = Reservation.objects.get(id=request.POST['reservation_id'])
+    reservation = get_object_or_404(
+        Reservation.objects.select_related('vehicle'), id=request.POST['reservation_id'])
     statement_descriptor = request.POST['statement_descriptor']
-    customer = request.user.customer.stripe_customer_id
+
+    if not is_request_user(request, reservation.vehicle.customer_id):
+        return Response(status=403)
 
     if reservation.cost != int(amount):
-        send_mail(
-            "Potential Fraudulent Activity",
-            "Suspected user id: %s\nThe cost of the reservation (in U.S. cents) is %s, but this user tried to pay %s." %
-            (request.user.id, reservation.cost, amount),
-            "security@curbdparking.com",
-            [config('PAYOUT_REQUEST_RECIPIENT')])
+        with timed('send_mail'):
+            send_mail(
+                "Potential Fraudulent Activity",
+                "Suspected user id: %s\nThe cost of the reservation (in U.S. cents) is %s, but this user tried to pay %s." %
+                (request.user.id, reservation.cost, amount),
+                "security@curbdparking.com",
+                [config('PAYOUT_REQUEST_RECIPIENT')])
         return Response(status=403)
 
-    try:
-        stripe.Charge.create(
-            amount=amount,
-            currency="usd",
-            source=source,
-            customer=customer,
-            description="Charge for " + request.user.email,
-            statement_descriptor=statement_descriptor,
-            metadata={'reservation_id': reservation.id},
-        )
+    # the amount is the reservation's whole cost, extensions are charged the difference
+    charge, created = Charge.for_reservation(reservation, request.user, source, statement_descriptor)
+    if created:
+        # Stripe is called by a payment worker, the client polls the charge
+        charge.submit()
+
+    # 202 while the charge is pending, 200 once it succeeded and 402 if it failed
+    status_codes = {Charge.PENDING: 202, Charge.SUCCEEDED: 200, Charge.FAILED: 402}
+    data = ChargeSerializer(charge, context={'request': request}).data
+    return Response(data, status=status_codes[charge.status], headers={'Location': data['url']})
 
-    except:
-        return Response(status=402)
-    else:
-        return Response(status=200)
+
+@api_view(['GET'])
+@permission_classes((permissions.IsAuthenticated,))
+def charge_detail(request, pk):
+    charge = get_object_or_404(Charge, pk=pk)
+    if not (request.user.is_staff or is_request_user(request, charge.user_id)):
+        return Response(status=403)
+
+    return Response(ChargeSerializer(charge, context={'request': request}).data)
 
 
 @api_view(['POST'])
@@ -80,10 +92,11 @@ def venmo_payout(request):
         end_datetime__lt=datetime.datetime.now(pytz.utc)).filter(
         cancelled=False).update(paid_out=True)
 
-    send_mail(
-        '[PAYOUT]',
-        "amount: %s,\n venmo email: %s,\n user id: %s,\n user full name: %s" %
-        (amount, venmo_email, request.user.id, request.user.get_full_name()),
-        'no-reply@curbdparking.com', [config('PAYOUT_REQUEST_RECIPIENT')])
+    with timed('send_mail'):
+        send_mail(
+            '[PAYOUT]',
+            "amount: %s,\n venmo email: %s,\n user id: %s,\n user full name: %s" %
+            (amount, venmo_email, request.user.id, request.user.get_full_name()),
+            'no-reply@curbdparking.com', [config('PAYOUT_REQUEST_RECIPIENT')])
 
     return Response("Success", 200)
@@ -0,0 +1,40 @@
+"""
+Payment workers.
+
+Charges are sent to Stripe from a small pool of threads rather than from
+the request that creates them, so a slow Stripe round trip never holds a
+web worker. Clients poll the charge's status instead. A charge whose worker
+died with the process stays pending until `reconcile_charges` retries it.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.PAYMENT_WORKERS)
+    return _executor
+
+
+def execute_charge(charge_id):
+    from .models import Charge
+
+    try:
+        Charge.objects.get(pk=charge_id).execute()
+    finally:
+        # worker threads keep no connection between charges
+        connection.close()
+
+
+def submit_charge(charge_id):
+    return executor().submit(execute_charge, charge_id)
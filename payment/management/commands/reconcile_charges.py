@@ -0,0 +1,34 @@
+import datetime
+
+from django.utils import timezone
+
+from curbd.metrics import InstrumentedCommand
+from payment.models import Charge
+
+
+class Command(InstrumentedCommand):
+    help = "Retries the charges still pending after a while (Stripe timed out, or their worker died). " \
+           "Each retry reuses the charge's idempotency key, so Stripe returns the outcome of an " \
+           "earlier attempt instead of charging twice. Charges older than Stripe's idempotency keys " \
+           "are looked up among the customer's Stripe charges before being sent again."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than', type=int, default=60,
+            help="Only retry charges last attempted more than this many seconds ago.")
+        parser.add_argument(
+            '--limit', type=int, default=500,
+            help="Maximum number of charges retried.")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - datetime.timedelta(seconds=options['older_than'])
+        charges = Charge.objects.filter(status=Charge.PENDING, updated_at__lt=cutoff) \
+            .select_related('user__customer').order_by('updated_at')[:options['limit']]
+
+        outcomes = {status: 0 for status, _ in Charge.STATUSES}
+        for charge in charges:
+            outcomes[charge.execute()] += 1
+
+        self.stdout.write("Reconciled %d charges: %s" % (
+            sum(outcomes.values()),
+            ", ".join("%d %s" % (count, status) for status, count in outcomes.items())))
@@ -0,0 +1,42 @@
+# Generated by Django 2.1 on 2026-10-19 20:10
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('parking', '0028_parking_space_regions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Charge',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.PositiveIntegerField(help_text='In U.S. cents')),
+                ('reservation_cost', models.PositiveIntegerField(help_text='Cost of the reservation (in U.S. cents) paid up to by this charge')),
+                ('source', models.CharField(max_length=255)),
+                ('statement_descriptor', models.CharField(blank=True, max_length=22)),
+                ('idempotency_key', models.CharField(editable=False, max_length=255, unique=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], db_index=True, default='pending', max_length=20)),
+                ('stripe_charge_id', models.CharField(blank=True, max_length=255)),
+                ('failure_message', models.CharField(blank=True, max_length=1000)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('reservation', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.PROTECT, related_name='charges', to='parking.Reservation')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='charges', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        # a reservation has at most one charge per cost that hasn't failed
+        migrations.RunSQL(
+            ["CREATE UNIQUE INDEX payment_charge_open_reservation_uniq ON payment_charge (reservation_id, reservation_cost) "
+             "WHERE status <> 'failed';"],
+            ['DROP INDEX payment_charge_open_reservation_uniq;']),
+    ]
@@ -1,3 +1,185 @@
-from django.db import models
+import datetime
 
-# Create your models here.
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from curbd.clients import stripe_client
+from parking.models import Reservation
+
+
+class Charge(models.Model):
+    """
+    A payment for a reservation. The row is stored before Stripe is called,
+    and the Stripe call carries an idempotency key derived from the
+    reservation, its cost and the attempt, so however many times a charge
+    is submitted, retried or reconciled the customer is charged at most
+    once. Paying again after a charge failed is a new attempt.
+
+    A charge brings what was paid for the reservation up to its cost at the
+    time (reservation_cost): the first one pays the whole cost, and each
+    extension of the reservation is paid by another charge of the added
+    cost. A reservation has at most one charge per cost that hasn't failed
+    (see migration payment 0001).
+    """
+    PENDING = 'pending'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+
+    STATUSES = (
+        (PENDING, "Pending"),
+        (SUCCEEDED, "Succeeded"),
+        (FAILED, "Failed"),
+    )
+
+    # reservations are partitioned, so they can't be referenced by a constraint
+    reservation = models.ForeignKey(
+        Reservation, on_delete=models.PROTECT, db_constraint=False, related_name='charges')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.PROTECT, related_name='charges')
+
+    amount = models.PositiveIntegerField(help_text="In U.S. cents")
+    reservation_cost = models.PositiveIntegerField(
+        help_text="Cost of the reservation (in U.S. cents) paid up to by this charge")
+    source = models.CharField(max_length=255)
+    statement_descriptor = models.CharField(max_length=22, blank=True)
+
+    idempotency_key = models.CharField(max_length=255, unique=True, editable=False)
+    status = models.CharField(max_length=20, choices=STATUSES, default=PENDING, db_index=True)
+    stripe_charge_id = models.CharField(max_length=255, blank=True)
+    failure_message = models.CharField(max_length=1000, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    # Stripe forgets idempotency keys after 24 hours, see execute()
+    IDEMPOTENCY_KEY_LIFETIME = datetime.timedelta(hours=23)
+
+    @staticmethod
+    def idempotency_key_for(reservation_id, reservation_cost, attempt):
+        return 'reservation-%s-%s-%s' % (reservation_id, reservation_cost, attempt)
+
+    @classmethod
+    def for_reservation(cls, reservation, user, source, statement_descriptor):
+        """
+        The charge that pays a reservation up to its current cost, created
+        the first time it is requested for that cost. Retried requests get
+        that charge back, and so do requests made while an earlier charge of
+        the reservation is still pending, until it settles. Once a charge
+        failed (e.g. the card was declined), the next request opens a new
+        one, with the same source or another.
+        :param reservation: a reservation of the user
+        :return: (charge, created)
+        """
+        open_charges = cls.objects.filter(reservation_id=reservation.id, user=user).exclude(status=cls.FAILED)
+
+        charge = open_charges.filter(reservation_cost=reservation.cost).first()
+        if charge is None:
+            # the added cost of an extension is only known once the earlier charges settled
+            charge = open_charges.filter(status=cls.PENDING).first()
+        if charge is not None:
+            return charge, False
+
+        paid = open_charges.aggregate(paid=Sum('amount'))['paid'] or 0
+        if paid and paid >= reservation.cost:
+            return open_charges.latest('created_at'), False
+
+        attempt = cls.objects.filter(
+            reservation_id=reservation.id, reservation_cost=reservation.cost, status=cls.FAILED).count() + 1
+
+        try:
+            with transaction.atomic():
+                return cls.objects.get_or_create(
+                    idempotency_key=cls.idempotency_key_for(reservation.id, reservation.cost, attempt),
+                    defaults={
+                        'reservation': reservation,
+                        'user': user,
+                        'amount': reservation.cost - paid,
+                        'reservation_cost': reservation.cost,
+                        'source': source,
+                        'statement_descriptor': statement_descriptor,
+                    })
+        except IntegrityError:
+            # a concurrent request opened the charge first
+            return open_charges.get(reservation_cost=reservation.cost), False
+
+    def submit(self):
+        """
+        Executes the charge on a payment worker once the current transaction
+        commits.
+        """
+        from .executor import submit_charge
+        transaction.on_commit(lambda: submit_charge(self.pk))
+
+    def execute(self):
+        """
+        Sends the charge to Stripe and records the outcome. When Stripe
+        can't be reached the charge stays pending, to be retried with the
+        same idempotency key by `reconcile_charges`. Stripe only remembers
+        the key for a day, so after that the charge is first looked up
+        among the customer's charges and only sent again if it isn't there.
+        """
+        if self.status != Charge.PENDING:
+            return self.status
+
+        stripe = stripe_client.stripe
+        Charge.objects.filter(pk=self.pk).update(attempts=models.F('attempts') + 1, updated_at=timezone.now())
+
+        try:
+            stripe_charge = None
+            if timezone.now() - self.created_at > self.IDEMPOTENCY_KEY_LIFETIME:
+                stripe_charge = self.find_stripe_charge()
+            if stripe_charge is None:
+                stripe_charge = self.create_stripe_charge()
+        except (stripe.error.APIConnectionError, stripe.error.RateLimitError, stripe.error.APIError):
+            # the outcome is unknown (or Stripe is unavailable), retry later
+            return self.status
+        except stripe.error.StripeError as e:
+            return self.finish(Charge.FAILED, failure_message=str(e.user_message or e)[:1000])
+
+        if stripe_charge.status == 'failed':
+            return self.finish(Charge.FAILED, stripe_charge_id=stripe_charge.id,
+                               failure_message=stripe_charge.failure_message or "")
+        return self.finish(Charge.SUCCEEDED, stripe_charge_id=stripe_charge.id)
+
+    def create_stripe_charge(self):
+        return stripe_client.call(
+            'Charge.create',
+            amount=self.amount,
+            currency="usd",
+            source=self.source,
+            customer=self.user.customer.stripe_customer_id,
+            description="Charge for " + self.user.email,
+            statement_descriptor=self.statement_descriptor or None,
+            metadata={'reservation_id': self.reservation_id, 'idempotency_key': self.idempotency_key},
+            idempotency_key=self.idempotency_key,
+        )
+
+    def find_stripe_charge(self):
+        """
+        The Stripe charge an earlier attempt created, if any, found by the
+        idempotency key in its metadata.
+        """
+        stripe_charges = stripe_client.call(
+            'Charge.list',
+            customer=self.user.customer.stripe_customer_id,
+            created={'gte': int(self.created_at.timestamp())},
+            limit=100)
+        for stripe_charge in stripe_charges.auto_paging_iter():
+            if stripe_charge.metadata.get('idempotency_key') == self.idempotency_key:
+                return stripe_charge
+        return None
+
+    def finish(self, status, **fields):
+        """
+        Records the final status of a pending charge.
+        :return: the charge's status, which another attempt may have settled first
+        """
+        Charge.objects.filter(pk=self.pk, status=Charge.PENDING).update(
+            status=status, updated_at=timezone.now(), **fields)
+        self.refresh_from_db()
+        return self.status
+
+    def __str__(self):
+        return self.idempotency_key
@@ -0,0 +1,13 @@
+from rest_framework import serializers
+
+from .models import Charge
+
+
+class ChargeSerializer(serializers.ModelSerializer):
+    url = serializers.HyperlinkedIdentityField(view_name='charge-detail')
+
+    class Meta:
+        model = Charge
+        fields = ('id', 'url', 'reservation', 'amount', 'reservation_cost', 'status', 'stripe_charge_id', 'failure_message',
+                  'created_at', 'updated_at')
+        read_only_fields = fields
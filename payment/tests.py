@@ -1,3 +1,235 @@
+import datetime
+from io import StringIO
+from unittest import mock
+
+import stripe
+from django.core.management import call_command
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import User, Host, Vehicle
+from curbd.testing import FakeStripeCustomerMixin
+from parking.models import ParkingSpace, FixedAvailability, Reservation
+from .models import Charge
+
+
+class FakeStripe(object):
+    """
+    Stands in for Stripe's charge API. Like Stripe, it answers a request
+    that reuses an idempotency key with the charge created the first time
+    (until the keys expire), and it can be told to time out after creating
+    a charge.
+    """
+
+    def __init__(self):
+        self.charges = {}
+        self.expired_charges = []
+        self.declined = {}
+        self.time_outs = 0
+        self.declined_sources = set()
+
+    def create_charge(self, idempotency_key=None, **params):
+        if idempotency_key in self.declined:
+            # Stripe answers with the same error for as long as it keeps the key
+            raise self.declined[idempotency_key]
+        if idempotency_key not in self.charges:
+            if params['source'] in self.declined_sources:
+                self.declined[idempotency_key] = stripe.error.CardError(
+                    "Your card was declined.", None, 'card_declined')
+                raise self.declined[idempotency_key]
+            self.charges[idempotency_key] = mock.Mock(
+                id='ch_%d' % len(self.all_charges()), status='succeeded', **params)
+
+        if self.time_outs:
+            self.time_outs -= 1
+            raise stripe.error.APIConnectionError("Request timed out")
+        return self.charges[idempotency_key]
+
+    def list_charges(self, customer=None, **params):
+        charges = [charge for charge in self.all_charges() if charge.customer == customer]
+        return mock.Mock(auto_paging_iter=mock.Mock(return_value=iter(charges)))
+
+    def all_charges(self):
+        return self.expired_charges + list(self.charges.values())
+
+    def expire_idempotency_keys(self):
+        self.expired_charges = self.all_charges()
+        self.charges = {}
+        self.declined = {}
+
+
+class ChargeTests(FakeStripeCustomerMixin, TestCase):
+
+    def setUp(self):
+        super(ChargeTests, self).setUp()
+        self.stripe = FakeStripe()
+        patcher = mock.patch('stripe.Charge.create', side_effect=self.stripe.create_charge)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('stripe.Charge.list', side_effect=self.stripe.list_charges)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # charges are executed by the tests instead of payment workers
+        patcher = mock.patch('payment.executor.submit_charge')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        now = timezone.now()
+        self.user = User.objects.create(
+            email='customer@curbdparking.com', first_name='F', last_name='L', phone_number='1')
+        host = Host.objects.create(user=self.user)
+        parking_space = ParkingSpace.objects.create(
+            host=host, latitude=34, longitude=-118, size=3, name='Space',
+            physical_type='Driveway', legal_type='Residential', is_active=True)
+        fixed_availability = FixedAvailability.objects.create(
+            parking_space=parking_space, start_datetime=now, end_datetime=now + datetime.timedelta(days=1))
+        vehicle = Vehicle.objects.create(
+            customer=self.user.customer, color='Red', year='2010', make='Honda', model='Civic', size=2,
+            license_plate='PLATE')
+        self.reservation = Reservation.objects.create(
+            vehicle=vehicle, fixed_availability=fixed_availability,
+            start_datetime=now + datetime.timedelta(hours=1), end_datetime=now + datetime.timedelta(hours=2))
+
+        self.client.force_login(self.user)
+
+    def charge(self, source='tok_visa'):
+        return self.client.post(reverse('charge'), {
+            'amount': self.reservation.cost,
+            'source': source,
+            'reservation_id': self.reservation.id,
+            'statement_descriptor': 'Curbd',
+        })
+
+    def test_retried_requests_share_one_charge(self):
+        first = self.charge()
+        second = self.charge()
+
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual(first.data['status'], Charge.PENDING)
+        self.assertEqual(second.data['id'], first.data['id'])
+        self.assertEqual(Charge.objects.count(), 1)
+
+    def test_status_endpoint_reports_the_outcome(self):
+        charge = Charge.objects.get(pk=self.charge().data['id'])
+        self.assertEqual(charge.execute(), Charge.SUCCEEDED)
+
+        response = self.client.get(reverse('charge-detail', args=[charge.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], Charge.SUCCEEDED)
+        self.assertEqual(response.data['stripe_charge_id'], 'ch_0')
+        self.assertEqual(self.charge().status_code, 200)
+
+    def test_status_endpoint_is_private(self):
+        charge = Charge.objects.get(pk=self.charge().data['id'])
+        other = User.objects.create(
+            email='other@curbdparking.com', first_name='O', last_name='T', phone_number='2')
+        self.client.force_login(other)
+
+        self.assertEqual(self.client.get(reverse('charge-detail', args=[charge.pk])).status_code, 403)
+
+    def test_reconcile_after_timeout_charges_once(self):
+        charge = Charge.objects.get(pk=self.charge().data['id'])
+
+        # Stripe charged the card, but the response never arrived
+        self.stripe.time_outs = 1
+        self.assertEqual(charge.execute(), Charge.PENDING)
+
+        Charge.objects.filter(pk=charge.pk).update(updated_at=timezone.now() - datetime.timedelta(minutes=5))
+        call_command('reconcile_charges', stdout=StringIO())
+
+        charge.refresh_from_db()
+        self.assertEqual(charge.status, Charge.SUCCEEDED)
+        self.assertEqual(charge.attempts, 2)
+        self.assertEqual(len(self.stripe.charges), 1)
+
+    def reconcile_later(self, charge, **age):
+        Charge.objects.filter(pk=charge.pk).update(
+            created_at=charge.created_at - datetime.timedelta(**age),
+            updated_at=timezone.now() - datetime.timedelta(minutes=5))
+        call_command('reconcile_charges', stdout=StringIO())
+        charge.refresh_from_db()
+
+    def test_reconcile_after_the_idempotency_key_expired_charges_once(self):
+        charge = Charge.objects.get(pk=self.charge().data['id'])
+        self.stripe.time_outs = 1
+        self.assertEqual(charge.execute(), Charge.PENDING)
+
+        self.stripe.expire_idempotency_keys()
+        self.reconcile_later(charge, days=2)
+
+        self.assertEqual(charge.status, Charge.SUCCEEDED)
+        self.assertEqual(charge.stripe_charge_id, 'ch_0')
+        self.assertEqual(len(self.stripe.all_charges()), 1)
+
+    def test_reconcile_after_the_idempotency_key_expired_sends_charges_stripe_never_got(self):
+        charge = Charge.objects.get(pk=self.charge().data['id'])
+
+        self.reconcile_later(charge, days=2)
+
+        self.assertEqual(charge.status, Charge.SUCCEEDED)
+        self.assertEqual(len(self.stripe.all_charges()), 1)
+
+    def test_declined_charge_can_be_paid_with_another_source(self):
+        self.stripe.declined_sources.add('tok_declined')
+        declined = Charge.objects.get(pk=self.charge('tok_declined').data['id'])
+        self.assertEqual(declined.execute(), Charge.FAILED)
+
+        response = self.charge('tok_visa')
+        self.assertEqual(response.status_code, 202)
+        self.assertNotEqual(response.data['id'], declined.pk)
+
+    def test_declined_charge_can_be_retried_with_the_same_source(self):
+        self.stripe.declined_sources.add('tok_visa')
+        declined = Charge.objects.get(pk=self.charge().data['id'])
+        self.assertEqual(declined.execute(), Charge.FAILED)
+        self.assertEqual(self.client.get(reverse('charge-detail', args=[declined.pk])).data['status'], Charge.FAILED)
+
+        # the customer topped up their card
+        self.stripe.declined_sources.clear()
+        response = self.charge()
+        self.assertEqual(response.status_code, 202)
+        retry = Charge.objects.get(pk=response.data['id'])
+        self.assertNotEqual(retry.pk, declined.pk)
+        self.assertNotEqual(retry.idempotency_key, declined.idempotency_key)
+
+        self.assertEqual(retry.execute(), Charge.SUCCEEDED)
+        self.assertEqual(self.charge().status_code, 200)
+
+    def test_only_the_reservation_owner_can_charge_it(self):
+        other = User.objects.create(
+            email='other@curbdparking.com', first_name='O', last_name='T', phone_number='2')
+        self.client.force_login(other)
+
+        self.assertEqual(self.charge().status_code, 403)
+        self.assertFalse(Charge.objects.exists())
+
+    def test_extension_is_charged_the_added_cost(self):
+        first = Charge.objects.get(pk=self.charge().data['id'])
+        self.assertEqual(first.execute(), Charge.SUCCEEDED)
+        first_cost = self.reservation.cost
+
+        added_cost = self.reservation.extend(self.reservation.end_datetime + datetime.timedelta(hours=1))
+        self.reservation.refresh_from_db()
+        self.assertGreater(added_cost, 0)
+
+        response = self.charge()
+        self.assertEqual(response.status_code, 202)
+        second = Charge.objects.get(pk=response.data['id'])
+        self.assertEqual(second.amount, added_cost)
+        self.assertEqual(second.reservation_cost, first_cost + added_cost)
+
+        # retries get the extension's charge back
+        self.assertEqual(self.charge().data['id'], second.pk)
+        self.assertEqual(second.execute(), Charge.SUCCEEDED)
+        self.assertEqual(self.charge().status_code, 200)
+        self.assertEqual(sum(charge.amount for charge in self.stripe.charges.values()), self.reservation.cost)
+
+    def test_extension_waits_for_the_pending_charge(self):
+        first_id = self.charge().data['id']
+        self.reservation.extend(self.reservation.end_datetime + datetime.timedelta(hours=1))
+        self.reservation.refresh_from_db()
 
-# Create your tests here.
+        self.assertEqual(self.charge().data['id'], first_id)
+        self.assertEqual(Charge.objects.count(), 1)